@@ -1,12 +1,21 @@
 from fastapi import FastAPI, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from pathlib import Path
 from contextlib import asynccontextmanager
+import json
+import os
 import shutil
+import threading
+import uuid
 import app
+from jobs import IngestQueue, QueueFull
+from metrics import REGISTRY
+from filters import MetadataFilter, file_type
+from retriever import EXTRACTORS
 
 
 @asynccontextmanager
@@ -16,7 +25,7 @@ async def lifespan(_: FastAPI):
 
     has_chroma_data = chroma_db_path.exists() and any(chroma_db_path.iterdir())
     has_data_files = data_path.exists() and any(
-        f.is_file() and f.suffix.lower() in ['.pdf', '.txt', '.png', '.jpg', '.jpeg']
+        f.is_file() and f.suffix.lower() in EXTRACTORS
         for f in data_path.iterdir()
     )
 
@@ -24,10 +33,15 @@ async def lifespan(_: FastAPI):
         try:
             print("found existing data and initializing retriever...")
             app.initialize()
-            print(f"successfully initialized with {len(app.docs)} documents and {len(app.chunks)} chunks")
+            print(f"successfully initialized with {len(app.chunks)} chunks ({len(app.docs)} documents re-indexed)")
         except Exception as e:
             print(f"couldn't initialize from existing data: {e}")
+    if os.getenv("PRELOAD_MODEL", "1") != "0":
+        # the embedding model loads in the background, the server takes requests in the meantime
+        threading.Thread(target=app.warm_up, name="warm-up", daemon=True).start()
     yield
+    ingest_queue.shutdown()
+    app.shutdown()
 
 api = FastAPI(lifespan=lifespan)
 
@@ -47,26 +61,169 @@ async def root():
 upload_dir = Path("data")
 upload_dir.mkdir(parents=True, exist_ok=True)
 
-class QueryRequest(BaseModel):
+def staged_path(file_path):
+    # where the newest upload of a file waits for its job, hidden from directory syncs
+    return file_path.with_name(f".{file_path.name}.upload")
+
+def ingest_upload(job, file_path):
+    # the upload only replaces the file once its job runs. the queue runs one job per file at a time,
+    # so a job still reading the previous version (pages are extracted lazily) never has it swapped out
+    try:
+        os.replace(staged_path(file_path), file_path)
+    except FileNotFoundError:
+        pass  # nothing newer staged, index what is there
+    app.ingest_file(file_path, job=job)
+
+# uploads are indexed in the background, a full queue pushes back with 429 instead of piling up work
+ingest_queue = IngestQueue(
+    ingest_upload,
+    workers=int(os.getenv("INGEST_JOBS", "2")),
+    max_pending=int(os.getenv("INGEST_QUEUE_SIZE", "16")),
+)
+
+class Filters(BaseModel):
+    # optional metadata filters, retrieval only looks at chunks of files matching all of the given ones
+    sources: list[str] | None = None
+    file_types: list[str] | None = None  # extensions, "pdf" or ".pdf"
+    date_from: str | None = None  # inclusive bounds on the file's modified time, ISO 8601
+    date_to: str | None = None
+
+class QueryRequest(Filters):
+    query: str
+
+class RetrieveRequest(Filters):
     query: str
+    k: int | None = None
+
+class BatchQueryRequest(Filters):
+    queries: list[str]
+    retrieval_only: bool = False
+
+max_batch_queries = int(os.getenv("QUERY_BATCH_MAX", "1000"))
 
-@api.post("/api/upload")
+@api.post("/api/upload", status_code=202)
 async def upload(file: UploadFile = File(...)):
+    if ingest_queue.full():
+        return JSONResponse(status_code=429, content={"error": "ingest queue is full, retry later"},
+                            headers={"Retry-After": "5"})
+
+    # written to a temporary file and renamed onto the staged path, ingest_upload moves it into place when
+    # the job runs. a second upload before then replaces the staged file and shares the queued job
     file_path = upload_dir / Path(file.filename).name
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    file.file.close()
+    partial = upload_dir / f".{file_path.name}.{uuid.uuid4().hex}.part"
+    try:
+        with open(partial, "wb") as buffer:
+            await run_in_threadpool(shutil.copyfileobj, file.file, buffer)
+        os.replace(partial, staged_path(file_path))
+    finally:
+        file.file.close()
+        partial.unlink(missing_ok=True)
 
     try:
-        app.ingest_file(file_path)
-        return {"message": f"{file.filename} uploaded and indexed."}
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        job = ingest_queue.submit(str(file_path), file_path, filename=file_path.name)
+    except QueueFull as e:
+        staged_path(file_path).unlink(missing_ok=True)
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "5"})
+    return {"job_id": job.id, "status": job.status, "message": f"{file.filename} queued for indexing."}
+
+@api.get("/metrics")
+async def metrics():
+    # prometheus text format: per-stage query and ingest latency histograms, index size gauges
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@api.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"unknown job {job_id}"})
+    return job.to_dict()
     
+@api.get("/api/documents")
+async def documents():
+    # file_type and modified are the values /api/query's filters match on
+    counts = app.get_manager().source_counts()
+    metadata = app.get_manager().source_metadata()
+    return {"documents": [
+        {"source": source, "chunks": n, "file_type": file_type(source, metadata.get(source, {})),
+         "modified": metadata.get(source, {}).get("modified")}
+        for source, n in sorted(counts.items())
+    ]}
+
+@api.delete("/api/documents/{source}")
+async def delete_document(source: str):
+    try:
+        removed = await run_in_threadpool(app.delete_document, source, str(upload_dir))
+    except KeyError:
+        return JSONResponse(status_code=404, content={"error": f"unknown document {source}"})
+    return {"source": source, "chunks_removed": removed}
+
+def _filters(request):
+    return MetadataFilter(request.sources, request.file_types, request.date_from, request.date_to)
+
+def _bad_filters(e):
+    return JSONResponse(status_code=400, content={"error": str(e)})
+
 @api.post("/api/query")
 async def query_docs(request: QueryRequest):
     try:
-        answer, sources = app.ask(request.query)
+        filters = _filters(request)
+    except ValueError as e:
+        return _bad_filters(e)
+    try:
+        answer, sources = await app.aask(request.query, filters)
         return {"answer": answer, "sources": sources}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
+
+@api.post("/api/retrieve")
+async def retrieve(request: RetrieveRequest):
+    try:
+        filters = _filters(request)
+    except ValueError as e:
+        return _bad_filters(e)
+    try:
+        return await run_in_threadpool(app.retrieve, request.query, request.k, filters)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@api.post("/api/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    if len(request.queries) > max_batch_queries:
+        return JSONResponse(status_code=413, content={"error": f"at most {max_batch_queries} queries per batch"})
+    try:
+        filters = _filters(request)
+    except ValueError as e:
+        return _bad_filters(e)
+    try:
+        return {"results": await app.aask_batch(request.queries, retrieval_only=request.retrieval_only,
+                                                filters=filters)}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@api.post("/api/query/stream")
+async def query_stream(request: QueryRequest):
+    # server-sent events: sources as soon as retrieval is done, then answer tokens, then timings
+    try:
+        filters = _filters(request)
+    except ValueError as e:
+        return _bad_filters(e)
+
+    async def events():
+        try:
+            async for event, data in app.astream(request.query, filters):
+                yield _sse(event, data)
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api.get("/api/stats")
+async def stats():
+    return {
+        "chunks": app.get_manager().get_chunk_count(),
+        "caches": dict(app.get_manager().cache_stats(), answer=app.answer_cache.stats()),
+    }
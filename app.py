@@ -1,57 +1,386 @@
 import os
-from retriever import load_files, chunk_files, HybridRetrieverManager
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
+import asyncio
+import hashlib
+import threading
+import time
+from retriever import iter_pages, iter_chunks, index_batches, sync_dir, file_metadata, HybridRetrieverManager
 from dotenv import load_dotenv
+from jobs import IngestJob
+from chunker import token_length
+from embeddings import make_process_pool
+from cache import make_cache
+from context import pack_context
+from metrics import REGISTRY, QUERY_SECONDS, INGEST_SECONDS, CONTEXT_TOKENS, resident_memory_bytes
 
 load_dotenv()
 
-docs = []
-chunks = []
-retriever_manager = HybridRetrieverManager()
+# cpu-bound ocr/pdf parsing and embedding run in worker processes, set to 0 to run in-process
+extract_pool = make_process_pool(int(os.getenv("EXTRACT_WORKERS", "2")))
+
+docs = []  # sources re-indexed by the last initialize()
+chunks = []  # the manager's current chunk records, texts stay in its chunk store
+manager_lock = threading.Lock()
+llm_client = None
 qa_chain = None
+chain_key = None
+ingest_lock = threading.Lock()  # held for index-wide changes, never while a file is being extracted
+source_locks = {}  # source -> lock held by the ingest or delete of that file
 
-def create_chain():
-    global qa_chain
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        temperature=0.1,
-        google_api_key=os.getenv("GOOGLE_API_KEY")
-    )
+# llm calls in flight per /api/query/batch request
+batch_concurrency = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
+
+# final answers per (query, k, weights, corpus version, llm + prompt, context budget),
+# ANSWER_CACHE_PATH keeps them on disk
+answer_cache = make_cache(
+    int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "0")) or None,
+    path=os.getenv("ANSWER_CACHE_PATH"),
+)
+
+# chunk size and overlap in characters, or in the embedding model's tokens when CHUNK_TOKENIZER names the model
+# (or an export_onnx.py directory), e.g. CHUNK_SIZE=256 CHUNK_OVERLAP=32. files already indexed keep their
+# chunks until their content changes
+chunk_size = int(os.getenv("CHUNK_SIZE", "800"))
+chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "100"))
+chunk_tokenizer = os.getenv("CHUNK_TOKENIZER")
+_chunk_length = None
+
+# retrieved chunks are deduplicated and overlapping or adjacent chunks of a file merged before the llm call,
+# then packed best first into CONTEXT_TOKEN_BUDGET estimated tokens (0 for no limit)
+context_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+
+def chunk_length():
+    # the tokenizer loads on the first ingest, not at import
+    global _chunk_length
+    if _chunk_length is None:
+        _chunk_length = token_length(chunk_tokenizer) if chunk_tokenizer else len
+    return _chunk_length
+
+def get_manager():
+    # the manager is built on first use rather than at import, so `import api` doesn't open chroma.
+    # tests and benchmarks may assign app.retriever_manager themselves
+    manager = globals().get("retriever_manager")
+    if manager is None:
+        with manager_lock:
+            manager = globals().get("retriever_manager")
+            if manager is None:
+                manager = HybridRetrieverManager(
+                    embedding_model=os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"),
+                    embedding_backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+                    embed_workers=int(os.getenv("EMBED_WORKERS", "0")),
+                    embed_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "64")),
+                    query_cache_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+                    query_cache_ttl=float(os.getenv("QUERY_CACHE_TTL", "0")) or None,
+                    retrieval_cache_size=int(os.getenv("RETRIEVAL_CACHE_SIZE", "256")),
+                    fusion=os.getenv("HYBRID_FUSION", "minmax"),
+                    candidates=int(os.getenv("HYBRID_CANDIDATES", "20")),
+                    vector_backend=os.getenv("VECTOR_BACKEND", "chroma"),
+                    vector_dtype=os.getenv("VECTOR_DTYPE", "float32"),
+                )
+                globals()["retriever_manager"] = manager
+    return manager
+
+def __getattr__(name):
+    # app.retriever_manager from outside builds the manager like get_manager() does
+    if name == "retriever_manager":
+        return get_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warm_up():
+    # loads the embedding model and runs one query embedding, so the first real query doesn't pay for it
+    try:
+        get_manager().embeddings.embed_query("warm up")
+    except Exception as e:
+        print(f"couldn't preload the embedding model: {e}")
+
+def _index_stat(name):
+    manager = globals().get("retriever_manager")
+    return None if manager is None else manager.index_stats()[name]
+
+def _index_memory():
+    manager = globals().get("retriever_manager")
+    if manager is None:
+        return None
+    stats = manager.index_stats()
+    return {"chunk_text": stats["chunk_text_bytes"], "vectors": stats["vector_bytes"]}
+
+# index sizes for /metrics, read from whichever manager is current when scraped, left out until there is one
+REGISTRY.gauge("rag_index_chunks", "chunks in the current index snapshot", lambda: _index_stat("chunks"))
+REGISTRY.gauge("rag_index_vocabulary_terms", "distinct terms in the bm25 index", lambda: _index_stat("vocabulary"))
+REGISTRY.gauge("rag_index_vectors", "vectors in the vector index", lambda: _index_stat("vectors"))
+REGISTRY.gauge("rag_index_memory_bytes", "bytes held by the index, chunk texts are a memory-mapped file",
+               _index_memory, label="component")
+REGISTRY.gauge("process_resident_memory_bytes", "resident memory of the server process", resident_memory_bytes)
+
+def get_llm():
+    global llm_client
+    if llm_client is None:
+        from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+        llm_client = ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash",
+            temperature=0.1,
+            google_api_key=os.getenv("GOOGLE_API_KEY")
+        )
+    return llm_client
+
+def create_chain(llm=None):
+    # built once, the manager's retriever always searches its latest index snapshot,
+    # so uploads don't need a new chain
+    global qa_chain, chain_key
+    from langchain.chains import RetrievalQA
+    llm = llm or get_llm()
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
-        retriever=retriever_manager.get_retriever(),
+        retriever=get_manager().get_retriever(),
         return_source_documents=True
     )
+    # a different model or prompt must not reuse cached answers, retrieval results are unaffected
+    prompt = qa_chain.combine_documents_chain.llm_chain.prompt
+    chain_key = hashlib.sha256(repr((type(llm).__name__, llm._identifying_params, prompt)).encode("utf-8")).hexdigest()
 
-def initialize():
+def initialize(data_dir="data"):
+    # the manager has already hydrated from chroma, so only files that are new or
+    # whose content hash changed since they were indexed get re-embedded
     global docs, chunks
-    docs = load_files("data")
-    chunks = chunk_files(docs)
-    retriever_manager.add_documents(chunks)
-    create_chain()
+    docs = sync_dir(get_manager(), data_dir, ingest_file)
+    chunks = get_manager().all_chunks
+    if chunks and qa_chain is None:
+        create_chain()
 
-def ingest_file(file_path):
-    global docs, chunks
+def shutdown():
+    manager = globals().get("retriever_manager")
+    if manager is not None:
+        manager.save_snapshot()
+        manager.close()
+    if extract_pool is not None:
+        extract_pool.shutdown(cancel_futures=True)
+
+def ingest_file(file_path, job=None):
+    # pages are extracted on the pool, split and embedded as they arrive, so a long pdf is
+    # searchable from its first pages on and only a few page ranges are held in memory
+    global chunks
+    job = job or IngestJob(os.path.basename(str(file_path)))
+    start = time.perf_counter()
+    source = os.path.basename(str(file_path))
+    metadata = file_metadata(str(file_path))
+
+    def pages():
+        for page in job.track_iter("extract", iter_pages(str(file_path), extract_pool)):
+            job.pages_extracted += 1
+            yield page
+
+    def batches():
+        for batch in iter_chunks(pages(), metadata, chunk_size, chunk_overlap, length_function=chunk_length()):
+            job.chunks_total += len(batch)
+            yield batch
+
+    def embedded(count):
+        job.chunks_embedded += count
 
-    new_docs = load_files(os.path.dirname(file_path))
-    new_doc = [d for d in new_docs if d.metadata["source"] == os.path.basename(file_path)]
-    if not new_doc:
-        raise ValueError(f"no text extracted from {file_path}")
-    new_chunks = chunk_files(new_doc)
-    chunks.extend(new_chunks)
+    # pages are pulled by replace_source_stream between batches, outside the manager's lock, so other
+    # files extract while this one is embedded. only an ingest or delete of the same file waits
+    with _source_lock(source):
+        with job.track("index"):
+            added, removed = index_batches(get_manager(), str(file_path), batches(), progress=embedded)
+    with ingest_lock:
+        chunks = get_manager().all_chunks
+        if chunks and qa_chain is None:
+            with job.track("chain"):
+                create_chain()
+    INGEST_SECONDS.observe("extract", job.stage_seconds.get("extract", 0.0))
+    INGEST_SECONDS.observe("file", time.perf_counter() - start)
+    if not job.chunks_total:
+        job.message = f"no text found in {job.filename}, {removed} indexed chunks removed."
+        print(f"no text extracted from {file_path} ({removed} stale chunks removed)")
+        return
+    job.message = f"{job.filename} uploaded and indexed."
+    print(f"indexed {added} new chunks from {file_path} ({removed} stale chunks removed, "
+          f"{job.chunks_total - added} unchanged)")
 
-    retriever_manager.add_documents(new_chunks)
-    create_chain()
-    print(f"indexed {len(new_chunks)} new chunks from {file_path}")
+def _source_lock(source):
+    with ingest_lock:
+        return source_locks.setdefault(source, threading.Lock())
 
-def ask(query: str):
-    if not qa_chain:
+def delete_document(source, data_dir="data"):
+    # drops the source's chunks from chroma, bm25 and the chunk store, and its file so
+    # initialize() doesn't index it again on the next start
+    global chunks
+    with _source_lock(source), ingest_lock:
+        removed = get_manager().remove_source(source)
+        chunks = get_manager().all_chunks
+        path = os.path.join(data_dir, os.path.basename(source))
+        had_file = os.path.isfile(path)
+        if had_file:
+            os.remove(path)
+    if not removed and not had_file:
+        raise KeyError(source)
+    print(f"deleted {source} ({removed} chunks removed)")
+    return removed
+
+def ask(query: str, filters=None):
+    # filters is a filters.MetadataFilter limiting retrieval to the files it matches
+    if not qa_chain or not get_manager().get_chunk_count():
+        raise ValueError("no documents indexed yet")
+    key = _answer_key(query, filters)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        return cached
+    with QUERY_SECONDS.time("total"):
+        with QUERY_SECONDS.time("retrieve"):
+            source_documents = get_manager().get_retriever(filters).invoke(query)
+        if not source_documents:
+            return "", []  # filters matching no file leave nothing to answer from, the llm isn't asked
+        context, _ = _pack(source_documents)
+        stuff_chain = qa_chain.combine_documents_chain
+        with QUERY_SECONDS.time("llm"):
+            output = stuff_chain.invoke({"input_documents": context, "question": query})
+    result = (output[stuff_chain.output_key], _sources(source_documents))
+    answer_cache.put(key, result)
+    return result
+
+async def aask(query: str, filters=None):
+    # native async path for the api, the llm call doesn't hold up the event loop
+    if not qa_chain or not get_manager().get_chunk_count():
+        raise ValueError("no documents indexed yet")
+    key = _answer_key(query, filters)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        return cached
+    # retrieval and the llm call are run apart, what qa_chain would do, so each gets its own timing
+    with QUERY_SECONDS.time("total"):
+        with QUERY_SECONDS.time("retrieve"):
+            source_documents = await get_manager().get_retriever(filters).ainvoke(query)
+        if not source_documents:
+            return "", []
+        context, _ = _pack(source_documents)
+        stuff_chain = qa_chain.combine_documents_chain
+        with QUERY_SECONDS.time("llm"):
+            output = await stuff_chain.ainvoke({"input_documents": context, "question": query})
+    result = (output[stuff_chain.output_key], _sources(source_documents))
+    answer_cache.put(key, result)
+    return result
+
+async def astream(query: str, filters=None):
+    # yields ("sources", [...]) once retrieval is done, then ("token", text) per llm chunk and
+    # ("done", timings and context stats) at the end, the same chain prompt and answer cache as aask
+    if not qa_chain or not get_manager().get_chunk_count():
+        raise ValueError("no documents indexed yet")
+    key = _answer_key(query, filters)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        answer, sources = cached
+        yield "sources", sources
+        yield "token", answer
+        yield "done", {"cached": True, "retrieval_ms": 0.0, "first_token_ms": 0.0, "llm_ms": 0.0, "context": None}
+        return
+
+    start = time.perf_counter()
+    source_documents = await get_manager().get_retriever(filters).ainvoke(query)
+    retrieval_ms = (time.perf_counter() - start) * 1000
+    QUERY_SECONDS.observe("retrieve", retrieval_ms / 1000)
+    sources = _sources(source_documents)
+    yield "sources", sources
+    if not source_documents:
+        yield "done", {"cached": False, "retrieval_ms": retrieval_ms, "first_token_ms": None, "llm_ms": 0.0,
+                       "context": None}
+        return
+
+    context, stats = _pack(source_documents)
+    stuff_chain = qa_chain.combine_documents_chain
+    inputs = stuff_chain._get_inputs(context, question=query)
+    prompt = stuff_chain.llm_chain.prompt.format_prompt(**inputs)
+    parts = []
+    first_token_ms = None
+    start = time.perf_counter()
+    async for chunk in stuff_chain.llm_chain.llm.astream(prompt):
+        text = getattr(chunk, "content", chunk)
+        if not text:
+            continue
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - start) * 1000
+        parts.append(text)
+        yield "token", text
+    llm_ms = (time.perf_counter() - start) * 1000
+    QUERY_SECONDS.observe("llm", llm_ms / 1000)
+    QUERY_SECONDS.observe("total", (retrieval_ms + stats["pack_ms"] + llm_ms) / 1000)
+
+    answer_cache.put(key, ("".join(parts), sources))
+    yield "done", {"cached": False, "retrieval_ms": retrieval_ms, "first_token_ms": first_token_ms, "llm_ms": llm_ms,
+                   "context": stats}
+
+def retrieve(query: str, k=None, filters=None):
+    # ranked chunks with their fused, bm25 and semantic scores and per-stage latency, no llm involved.
+    # skips the retrieval cache so the timings are real. context is what packing would send the llm
+    if not get_manager().get_chunk_count():
         raise ValueError("no documents indexed yet")
-    result = qa_chain.invoke({"query": query})
-    answer = result["result"]
-    sources = [doc.metadata.get('source', 'Unknown') for doc in result["source_documents"]]
-    return answer, sources
+    timings = {}
+    start = time.perf_counter()
+    results = get_manager().search(query, k=k, with_scores=True, timings=timings, filters=filters)
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    _, context = pack_context([doc for doc, _ in results], context_budget)
+    return {"results": [_chunk_dict(doc, scores) for doc, scores in results], "timings": timings, "context": context}
+
+async def aask_batch(queries, retrieval_only=False, concurrency=None, filters=None):
+    # one result per query, in order. retrieval is shared by the whole batch, then the llm runs
+    # on at most `concurrency` queries at a time. a failed item carries its error instead of failing the batch
+    if not get_manager().get_chunk_count() or not (retrieval_only or qa_chain):
+        raise ValueError("no documents indexed yet")
+    # answers are cached under the snapshot retrieval read, an upload finishing mid-batch doesn't
+    # file them under the newer index
+    snapshot = get_manager().snapshot()
+    retrieved = await asyncio.to_thread(get_manager().retrieve_batch, queries, filters, snapshot)
+    if retrieval_only:
+        return [
+            {"query": query, "sources": _sources(docs),
+             "chunks": [_chunk_dict(d) for d in docs]}
+            for query, docs in zip(queries, retrieved)
+        ]
+
+    semaphore = asyncio.Semaphore(concurrency or batch_concurrency)
+    stuff_chain = qa_chain.combine_documents_chain
+
+    async def answer(query, docs):
+        if not docs:
+            return {"query": query, "answer": "", "sources": []}
+        key = _answer_key(query, filters, snapshot)
+        result = answer_cache.get(key)
+        if result is None:
+            context, _ = _pack(docs)
+            async with semaphore:
+                try:
+                    with QUERY_SECONDS.time("llm"):
+                        output = await stuff_chain.ainvoke({"input_documents": context, "question": query})
+                except Exception as e:
+                    return {"query": query, "error": str(e)}
+            result = (output[stuff_chain.output_key], _sources(docs))
+            answer_cache.put(key, result)
+        return {"query": query, "answer": result[0], "sources": result[1]}
+
+    return await asyncio.gather(*(answer(query, docs) for query, docs in zip(queries, retrieved)))
+
+def _answer_key(query, filters=None, snapshot=None):
+    # snapshot is the index the answer's chunks were retrieved from, the current one by default
+    return get_manager().retrieval_key(query, snapshot, filters) + (chain_key, context_budget)
+
+def _pack(docs):
+    # the chunks to put in the prompt and their stats, the answer's sources stay the retrieved chunks
+    start = time.perf_counter()
+    context, stats = pack_context(docs, context_budget)
+    seconds = time.perf_counter() - start
+    QUERY_SECONDS.observe("pack", seconds)
+    CONTEXT_TOKENS.observe("retrieved", stats["tokens_retrieved"])
+    CONTEXT_TOKENS.observe("packed", stats["tokens"])
+    stats["pack_ms"] = seconds * 1000
+    return context, stats
+
+def _chunk_dict(doc, scores=None):
+    chunk = {"id": doc.id, "source": doc.metadata.get("source"), "content": doc.page_content}
+    if scores is not None:
+        chunk["scores"] = scores
+    return chunk
+
+def _sources(docs):
+    return [doc.metadata.get('source', 'Unknown') for doc in docs]
 
 
 # while True:
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import httpx
+from pathlib import Path
+from common import StubLLM, synthetic_chunks, synthetic_queries
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+os.environ.setdefault("EMBED_WORKERS", "0")
+os.environ.setdefault("EXTRACT_WORKERS", "0")
+os.chdir(Path(__file__).resolve().parent.parent)  # api serves static/ relative to the repo root
+
+import app
+from api import api
+from retriever import HybridRetrieverManager
+
+# an evaluation run of many questions: one /api/query call per question (at a fixed client
+# concurrency) vs a single /api/query/batch, retrieval only and with a stub llm. caches are off
+# so every run pays for embedding and retrieval
+
+async def run(requests):
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await requests(client)
+        return time.perf_counter() - start
+
+def one_by_one(queries, concurrency):
+    async def requests(client):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(query):
+            async with semaphore:
+                (await client.post("/api/query", json={"query": query})).raise_for_status()
+        await asyncio.gather(*(one(q) for q in queries))
+    return requests
+
+def batched(queries, retrieval_only):
+    async def requests(client):
+        response = await client.post("/api/query/batch", json={"queries": queries, "retrieval_only": retrieval_only})
+        response.raise_for_status()
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub llm latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="client concurrency and batch llm concurrency")
+    args = parser.parse_args()
+
+    app.retriever_manager = HybridRetrieverManager(
+        persist_dir=tempfile.mkdtemp(prefix="bench_batch_"),
+        embeddings=DeterministicFakeEmbedding(size=384),
+        query_cache_size=0,
+        retrieval_cache_size=0,
+    )
+    app.answer_cache.max_size = 0
+    app.batch_concurrency = args.concurrency
+    app.retriever_manager.add_documents(synthetic_chunks(args.chunks))
+    queries = synthetic_queries(args.queries)
+
+    print(f"{args.chunks} chunks, {args.queries} queries, concurrency {args.concurrency}")
+    print(f"{'mode':>22} {'total (s)':>10} {'queries/s':>10}")
+    manager = app.retriever_manager
+    for name, search in [("search, one by one", lambda: [manager.search(q) for q in queries]),
+                         ("search_batch", lambda: manager.search_batch(queries))]:
+        start = time.perf_counter()
+        search()
+        seconds = time.perf_counter() - start
+        print(f"{name:>22} {seconds:>10.2f} {len(queries) / seconds:>10.1f}")
+    for name, requests, latency in [
+        ("retrieval, batch", batched(queries, True), 0.0),
+        ("llm, one by one", one_by_one(queries, args.concurrency), args.latency),
+        ("llm, batch", batched(queries, False), args.latency),
+    ]:
+        app.create_chain(llm=StubLLM(latency=latency))
+        seconds = asyncio.run(run(requests))
+        print(f"{name:>22} {seconds:>10.2f} {len(queries) / seconds:>10.1f}")
+
+if __name__ == "__main__":
+    main()
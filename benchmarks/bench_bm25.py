@@ -0,0 +1,34 @@
+import time
+from common import synthetic_chunks
+from langchain_community.retrievers import BM25Retriever
+from bm25 import BM25Index
+
+# upload cost as the corpus grows: full BM25Retriever rebuild vs in-place BM25Index update
+BATCH = 50
+CHECKPOINTS = [1000, 5000, 10000, 20000]
+
+def main():
+    corpus = synthetic_chunks(CHECKPOINTS[-1] + BATCH)
+    index = BM25Index()
+    indexed = 0
+
+    print(f"{'corpus':>8} {'rebuild (s)':>12} {'incremental (s)':>16}")
+    for size in CHECKPOINTS:
+        index.add_documents(corpus[indexed:size])
+        indexed = size
+        batch = corpus[size:size + BATCH]
+
+        start = time.perf_counter()
+        BM25Retriever.from_documents(corpus[:size + BATCH])
+        rebuild = time.perf_counter() - start
+
+        start = time.perf_counter()
+        slots = index.add_documents(batch)
+        index.top_n("w1 w2 w3", 3)  # includes the lazy idf refresh paid by the next query
+        incremental = time.perf_counter() - start
+        index.remove(slots)
+
+        print(f"{size:>8} {rebuild:>12.4f} {incremental:>16.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# server boot as a user sees it, each run in a fresh python process against an already indexed data dir:
+# `import api`, lifespan startup (warm start, nothing re-embedded) and the first successful /api/retrieve
+# and /api/query (stub llm). with PRELOAD_MODEL=1 the model loads in the background during boot, with 0
+# the first query loads it. this file imports nothing heavy at the top so the child's import time is clean
+ROOT = Path(__file__).resolve().parent.parent
+
+def index():
+    sys.path.insert(0, str(ROOT))
+    import app
+    app.initialize()
+    app.shutdown()
+
+def child():
+    sys.path.insert(0, str(ROOT))
+    start = time.perf_counter()
+    import api
+    imported = time.perf_counter()
+
+    from fastapi.testclient import TestClient
+    import app
+    from common import StubLLM
+    timings = {"import_s": imported - start}
+    with TestClient(api.api) as client:
+        timings["boot_s"] = time.perf_counter() - start
+        response = client.post("/api/retrieve", json={"query": "w12 w40 w7"})
+        assert response.status_code == 200, response.text
+        timings["first_retrieve_s"] = time.perf_counter() - start
+        app.create_chain(llm=StubLLM(latency=0))
+        response = client.post("/api/query", json={"query": "w3 w41 w9"})
+        assert response.status_code == 200, response.text
+        timings["first_answer_s"] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+def run_child(workdir, preload):
+    env = dict(os.environ, PRELOAD_MODEL="1" if preload else "0", EMBED_WORKERS="0", EXTRACT_WORKERS="0",
+               ANSWER_CACHE_SIZE="0", RETRIEVAL_CACHE_SIZE="0", QUERY_CACHE_SIZE="0")
+    result = subprocess.run([sys.executable, __file__, "--child"], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def make_workdir(n_chunks):
+    # a data dir of synthetic text files and the static dir api mounts, indexed once up front
+    from common import synthetic_chunks
+    workdir = Path(tempfile.mkdtemp(prefix="bench_boot_"))
+    (workdir / "static").symlink_to(ROOT / "static")
+    (workdir / "data").mkdir()
+    texts = {}
+    for chunk in synthetic_chunks(n_chunks):
+        texts.setdefault(chunk.metadata["source"], []).append(chunk.page_content)
+    for source, parts in texts.items():
+        (workdir / "data" / source).write_text("\n\n".join(parts), encoding="utf-8")
+    subprocess.run([sys.executable, __file__, "--index"], cwd=workdir, check=True,
+                   env=dict(os.environ, EMBED_WORKERS="0", EXTRACT_WORKERS="0"))
+    return workdir
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--index", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.index:
+        index()
+        return
+    if args.child:
+        child()
+        return
+
+    workdir = make_workdir(args.chunks)
+    try:
+        print(f"{args.chunks} synthetic chunks, median of {args.runs} runs, seconds since the process started importing")
+        print(f"{'model preload':>14} {'import api':>11} {'boot':>8} {'first retrieve':>15} {'first answer':>13}")
+        for preload in (False, True):
+            runs = [run_child(workdir, preload) for _ in range(args.runs)]
+            median = {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+            print(f"{'on' if preload else 'off':>14} {median['import_s']:>11.2f} {median['boot_s']:>8.2f} "
+                  f"{median['first_retrieve_s']:>15.2f} {median['first_answer_s']:>13.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
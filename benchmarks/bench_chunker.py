@@ -0,0 +1,81 @@
+import argparse
+import gc
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from common import synthetic_chunks
+from chunker import token_length
+from retriever import chunk_files, iter_chunks, iter_pages
+
+# splitting a large .txt file into 800/100 chunks: langchain's RecursiveCharacterTextSplitter over the whole
+# file (how chunk_files worked before chunker.py), the native chunker over the whole file, and the native
+# chunker streaming the file in 1 MiB blocks the way uploads are indexed. MB/s is timed without tracing,
+# peak python heap in a second traced run. --tokenizer sizes chunks in the model's tokens instead
+
+def write_text(path, mb, seed=0):
+    # synthetic paragraphs of a few lines each, separated by blank lines
+    rng = random.Random(seed)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < mb * 1e6:
+            for chunk in synthetic_chunks(1000, seed=rng.randrange(1 << 30)):
+                words = chunk.page_content.split()
+                lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+                paragraph = "\n".join(lines) + "\n\n"
+                f.write(paragraph)
+                written += len(paragraph)
+
+def langchain_whole(path, chunk_size, chunk_overlap, length):
+    with open(path, encoding="utf-8") as f:
+        doc = Document(page_content=f.read(), metadata={"source": "dump.txt"})
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length)
+    return len(splitter.split_documents([doc]))
+
+def native_whole(path, chunk_size, chunk_overlap, length):
+    with open(path, encoding="utf-8") as f:
+        doc = Document(page_content=f.read(), metadata={"source": "dump.txt"})
+    return len(chunk_files([doc], chunk_size, chunk_overlap, length_function=length))
+
+def native_streamed(path, chunk_size, chunk_overlap, length):
+    # batches are dropped as they come, like they are once embedded and written to the chunk store
+    return sum(len(batch) for batch in iter_chunks(iter_pages(path), {"source": "dump.txt"}, chunk_size,
+                                                   chunk_overlap, length_function=length))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=50, help="size of the synthetic text file")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--tokenizer", help="measure chunks in this model's tokens, e.g. all-MiniLM-L6-v2 with 256/32")
+    args = parser.parse_args()
+
+    length = token_length(args.tokenizer) if args.tokenizer else len
+    directory = tempfile.mkdtemp(prefix="bench_chunker_")
+    path = os.path.join(directory, "dump.txt")
+    try:
+        write_text(path, args.mb)
+        mb = os.path.getsize(path) / 1e6
+        print(f"{mb:.1f} MB of text, chunk size {args.chunk_size}, overlap {args.chunk_overlap}"
+              f"{f', in {args.tokenizer} tokens' if args.tokenizer else ''}")
+        print(f"{'splitter':>18} {'chunks':>9} {'seconds':>8} {'MB/s':>7} {'peak heap (MB)':>15}")
+        for name, split in [("langchain", langchain_whole), ("native", native_whole), ("native streamed", native_streamed)]:
+            gc.collect()
+            start = time.perf_counter()
+            count = split(path, args.chunk_size, args.chunk_overlap, length)
+            seconds = time.perf_counter() - start
+            gc.collect()
+            tracemalloc.start()
+            split(path, args.chunk_size, args.chunk_overlap, length)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name:>18} {count:>9} {seconds:>8.2f} {mb / seconds:>7.1f} {peak / 1e6:>15.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
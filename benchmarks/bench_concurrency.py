@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import httpx
+from pathlib import Path
+from common import StubLLM, synthetic_chunks, synthetic_queries
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+os.environ.setdefault("EMBED_WORKERS", "0")
+os.environ.setdefault("EXTRACT_WORKERS", "0")
+os.chdir(Path(__file__).resolve().parent.parent)  # api serves static/ relative to the repo root
+
+import app
+from api import api
+from retriever import HybridRetrieverManager
+
+# query throughput through the api against a stub llm. /api/query awaits the chain natively,
+# /bench/blocking is the old handler shape that calls app.ask synchronously on the event loop
+
+@api.post("/bench/blocking")
+async def blocking_query(request: dict):
+    answer, sources = app.ask(request["query"])
+    return {"answer": answer, "sources": sources}
+
+async def drive(path, queries, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(query):
+            async with semaphore:
+                response = await client.post(path, json={"query": query})
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in queries))
+        return len(queries) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub llm latency in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    args = parser.parse_args()
+
+    app.retriever_manager = HybridRetrieverManager(
+        persist_dir=tempfile.mkdtemp(prefix="bench_concurrency_"),
+        embeddings=DeterministicFakeEmbedding(size=384),
+    )
+    app.retriever_manager.add_documents(synthetic_chunks(args.chunks))
+    app.create_chain(llm=StubLLM(latency=args.latency))
+    queries = synthetic_queries(args.requests)
+
+    print(f"{'concurrency':>11} {'blocking (req/s)':>17} {'async (req/s)':>14}")
+    for concurrency in args.concurrency:
+        blocking = asyncio.run(drive("/bench/blocking", queries, concurrency))
+        native = asyncio.run(drive("/api/query", queries, concurrency))
+        print(f"{concurrency:>11} {blocking:>17.2f} {native:>14.2f}")
+
+if __name__ == "__main__":
+    main()
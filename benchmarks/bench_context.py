@@ -0,0 +1,59 @@
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from langchain.schema import Document
+from common import HashingEmbeddings, queries_for, synthetic_chunks
+from context import pack_context
+from retriever import HybridRetrieverManager, chunk_files
+
+# prompt context per query before and after packing: synthetic files split into 800/100 chunks, hybrid search
+# at several k, then pack_context with no budget and with --budget. tokens are the ~4 characters per token
+# estimate, "saved" is the share of retrieved tokens that never reach the llm
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=200, help="synthetic paragraphs per file")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--budget", type=int, default=1500)
+    args = parser.parse_args()
+
+    paragraphs = synthetic_chunks(args.files * args.paragraphs, n_sources=args.files)
+    texts = {}
+    for paragraph in paragraphs:
+        texts.setdefault(paragraph.metadata["source"], []).append(paragraph.page_content)
+    chunks = chunk_files([Document(page_content="\n\n".join(parts), metadata={"source": source})
+                          for source, parts in texts.items()])
+    queries = [query for query, _ in queries_for(chunks, args.queries)]
+
+    persist_dir = tempfile.mkdtemp(prefix="bench_context_")
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=HashingEmbeddings(),
+                                         vector_backend="numpy", query_cache_size=0)
+        for start in range(0, len(chunks), 1000):
+            manager.add_documents(chunks[start:start + 1000])
+        print(f"{len(chunks)} chunks in {args.files} files, {args.queries} queries")
+        print(f"{'k':>4} {'budget':>7} {'passages':>9} {'retrieved':>10} {'packed':>8} {'saved':>7} {'pack p50 (ms)':>14}")
+        for k in args.k:
+            retrieved = [manager.search(query, k=k) for query in queries]
+            for budget in (0, args.budget):
+                latencies, passages, stats = [], 0, []
+                for docs in retrieved:
+                    start = time.perf_counter()
+                    packed, query_stats = pack_context(docs, budget)
+                    latencies.append(time.perf_counter() - start)
+                    passages += len(packed)
+                    stats.append(query_stats)
+                tokens_retrieved = sum(s["tokens_retrieved"] for s in stats) / len(stats)
+                tokens = sum(s["tokens"] for s in stats) / len(stats)
+                saved = sum(s["tokens_saved"] for s in stats) / max(1, sum(s["tokens_retrieved"] for s in stats))
+                print(f"{k:>4} {budget or '-':>7} {passages / len(stats):>9.1f} {tokens_retrieved:>10.0f} {tokens:>8.0f} "
+                      f"{saved:>7.1%} {statistics.median(latencies) * 1000:>14.3f}")
+        manager.close()
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
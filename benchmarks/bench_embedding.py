@@ -0,0 +1,46 @@
+import argparse
+import shutil
+import tempfile
+import time
+from common import synthetic_chunks
+from retriever import HybridRetrieverManager
+
+# end-to-end add_documents throughput (encode + chroma upsert) at several batch sizes and
+# worker counts. uses the real model unless --fake is given
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32, 64, 128, 256])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2])
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--fake", action="store_true", help="deterministic fake embeddings, measures pipeline overhead only")
+    args = parser.parse_args()
+
+    embeddings = None  # the manager loads --model, in each worker process when there are any
+    if args.fake:
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        embeddings = DeterministicFakeEmbedding(size=384)
+
+    print(f"{'workers':>7} {'batch':>6} {'chunks/s':>10}")
+    for workers in args.workers:
+        if workers and args.fake:
+            continue  # worker processes always load the real model
+        for batch_size in args.batch_sizes:
+            persist_dir = tempfile.mkdtemp(prefix="bench_embedding_")
+            manager = HybridRetrieverManager(
+                persist_dir=persist_dir, embeddings=embeddings, embedding_model=args.model,
+                embed_batch_size=batch_size, embed_workers=workers,
+            )
+            try:
+                manager.add_documents(synthetic_chunks(batch_size * max(workers, 1), seed=99))  # warm up workers
+                batch = synthetic_chunks(args.chunks)
+                start = time.perf_counter()
+                manager.add_documents(batch)
+                elapsed = time.perf_counter() - start
+                print(f"{workers:>7} {batch_size:>6} {len(batch) / elapsed:>10.1f}")
+            finally:
+                manager.close()
+                shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
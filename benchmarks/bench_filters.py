@@ -0,0 +1,62 @@
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from common import HashingEmbeddings, queries_for, synthetic_chunks
+from filters import MetadataFilter
+from retriever import HybridRetrieverManager
+
+# filtered retrieval at 1, 5 and 25 of 50 sources per vector backend: the filter pushed down into bm25 and
+# the vector search against the old way, searching everything and post-filtering an over-fetched top k.
+# "empty" is the share of queries post-filtering left without any result, filtered search never does
+def measure(search, queries):
+    latencies, empty = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        docs = search(query)
+        latencies.append(time.perf_counter() - start)
+        empty += not docs
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.95)] * 1000, empty / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy", "ivf"])
+    parser.add_argument("--overfetch", type=int, default=10, help="post-filtering searches k times this")
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+    queries = [query for query, _ in queries_for(chunks, args.queries)]
+    sources = sorted({c.metadata["source"] for c in chunks})
+    print(f"{args.chunks} chunks in {len(sources)} sources, {args.queries} queries, k={args.k}")
+    print(f"{'backend':>8} {'sources':>8} {'method':>12} {'p50 (ms)':>9} {'p95 (ms)':>9} {'empty':>7}")
+    for backend in args.backends:
+        persist_dir = tempfile.mkdtemp(prefix="bench_filters_")
+        try:
+            manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=HashingEmbeddings(), k=args.k,
+                                             vector_backend=backend, query_cache_size=0)
+            for start in range(0, len(chunks), 1000):
+                manager.add_documents(chunks[start:start + 1000])
+            p50, p95, _ = measure(manager.search, queries)
+            print(f"{backend:>8} {'all':>8} {'unfiltered':>12} {p50:>9.2f} {p95:>9.2f} {'':>7}")
+            for n_sources in (1, 5, 25):
+                metadata_filter = MetadataFilter(sources=sources[:n_sources])
+
+                def post_filtered(query):
+                    docs = manager.search(query, k=args.k * args.overfetch)
+                    return [d for d in docs if d.metadata["source"] in metadata_filter.sources][:args.k]
+
+                for method, search in [("post-filter", post_filtered),
+                                       ("pushdown", lambda q: manager.search(q, filters=metadata_filter))]:
+                    p50, p95, empty = measure(search, queries)
+                    print(f"{backend:>8} {n_sources:>8} {method:>12} {p50:>9.2f} {p95:>9.2f} {empty:>7.1%}")
+            manager.close()
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
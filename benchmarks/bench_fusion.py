@@ -0,0 +1,68 @@
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from common import HashingEmbeddings, queries_for, synthetic_chunks
+from langchain.retrievers import EnsembleRetriever
+from bm25 import BM25IndexRetriever
+from fusion import FUSION_MODES
+from retriever import HybridRetrieverManager
+
+# latency and recall@k of the old EnsembleRetriever (sequential, weighted rrf over k per side)
+# against the manager's native fusion. a query is a hit when the chunk it was sampled from is in the top k
+def measure(search, queries, k):
+    latencies, hits = [], 0
+    for query, target_id in queries:
+        start = time.perf_counter()
+        docs = search(query)
+        latencies.append(time.perf_counter() - start)
+        hits += target_id in [d.id for d in docs[:k]]
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.95)] * 1000, hits / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--model", help="sentence-transformers model, hashed bag-of-words embeddings if not given")
+    args = parser.parse_args()
+
+    if args.model:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    else:
+        embeddings = HashingEmbeddings()
+
+    persist_dir = tempfile.mkdtemp(prefix="bench_fusion_")
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=embeddings, k=args.k,
+                                         candidates=args.candidates, query_cache_size=0)
+        chunks = synthetic_chunks(args.chunks)
+        manager.add_documents(chunks)
+        queries = [(query, chunks[target].id) for query, target in queries_for(chunks, args.queries)]
+
+        ensemble = EnsembleRetriever(
+            retrievers=[BM25IndexRetriever(index=manager.bm25_index, k=args.k),
+                        manager.vectordb.as_retriever(search_kwargs={"k": args.k})],
+            weights=[manager.bm25_weight, manager.semantic_weight]
+        )
+
+        print(f"{args.chunks} chunks, {args.queries} queries, k={args.k}, candidates={args.candidates}")
+        print(f"{'method':>18} {'p50 (ms)':>9} {'p95 (ms)':>9} {'recall@k':>9}")
+        # chroma documents carry no id, map them back through the text
+        by_text = {c.page_content: c for c in manager.all_chunks}
+        p50, p95, recall = measure(lambda q: [by_text[d.page_content] for d in ensemble.invoke(q)], queries, args.k)
+        print(f"{'ensemble':>18} {p50:>9.2f} {p95:>9.2f} {recall:>9.3f}")
+        for mode in FUSION_MODES:
+            manager.fusion = mode
+            p50, p95, recall = measure(manager.search, queries, args.k)
+            print(f"{'native ' + mode:>18} {p50:>9.2f} {p95:>9.2f} {recall:>9.3f}")
+        manager.close()
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
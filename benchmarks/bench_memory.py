@@ -0,0 +1,49 @@
+import argparse
+import gc
+import shutil
+import tempfile
+import tracemalloc
+from common import synthetic_chunks
+from chunkstore import ChunkStore
+from retriever import assign_chunk_ids
+
+# python heap held by the indexed chunks: Documents kept twice (manager.all_chunks and app.chunks,
+# as before the chunk store) vs ChunkRecords pointing into the memory-mapped text file
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, kept
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8} {'documents (MB)':>15} {'chunk store (MB)':>17} {'text file (MB)':>15}")
+    for size in args.sizes:
+        persist_dir = tempfile.mkdtemp(prefix="bench_memory_")
+        try:
+            def documents():
+                all_chunks = assign_chunk_ids(synthetic_chunks(size))
+                return all_chunks, list(all_chunks)
+
+            def records():
+                # the Documents of the upload are dropped once their texts are in the store
+                store = ChunkStore(persist_dir)
+                return store, store.add(assign_chunk_ids(synthetic_chunks(size)))
+
+            docs_size, _ = measure(documents)
+            records_size, (store, _) = measure(records)
+            print(f"{size:>8} {docs_size / 2**20:>15.1f} {records_size / 2**20:>17.1f} "
+                  f"{store.buffer.size / 2**20:>15.1f}")
+            store.close()
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
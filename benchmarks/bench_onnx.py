@@ -0,0 +1,71 @@
+import argparse
+import os
+import time
+import numpy as np
+from common import synthetic_chunks, synthetic_queries
+from embeddings import encode, export_onnx, get_embeddings
+from retriever import iter_chunks, iter_pages
+
+# all-MiniLM-L6-v2 on torch vs onnx runtime (fp32 and int8): chunks/sec embedding a corpus, single query
+# embed latency, how close the vectors are to torch's and recall@k of exact search against torch's top k.
+# "mixed" queries the torch-built vectors with the backend's query vectors, the case of switching
+# backends on an existing index. pass --data to embed real documents instead of synthetic text
+
+def load_texts(data_dir, n):
+    texts = []
+    for fname in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, fname)
+        for batch in iter_chunks(iter_pages(path), {"source": fname}):
+            texts += [c.page_content for c in batch]
+    return texts[:n]
+
+def top_k(queries, docs, k):
+    return np.argsort(-(queries @ docs.T), axis=1)[:, :k]
+
+def recall(found, expected):
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)]))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--onnx-dir", default="models/minilm-onnx", help="export_onnx.py output, exported if missing")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--data", help="directory of documents to chunk instead of synthetic text")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.onnx_dir, "model_quantized.onnx")):
+        export_onnx(args.model, args.onnx_dir)
+    texts = load_texts(args.data, args.chunks) if args.data else [c.page_content for c in synthetic_chunks(args.chunks)]
+    queries = synthetic_queries(args.queries) if not args.data else [t[:120] for t in texts[::max(1, len(texts) // args.queries)]]
+
+    results = {}
+    for backend, model in [("torch", args.model), ("onnx", args.onnx_dir), ("onnx-int8", args.onnx_dir)]:
+        embeddings = get_embeddings(model, backend)
+        encode(embeddings, texts[:args.batch_size], args.batch_size)  # warm up
+        start = time.perf_counter()
+        docs = encode(embeddings, texts, args.batch_size)
+        seconds = time.perf_counter() - start
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append(time.perf_counter() - start)
+        results[backend] = (len(texts) / seconds, latencies, docs, encode(embeddings, queries, args.batch_size))
+
+    _, _, torch_docs, torch_queries = results["torch"]
+    expected = top_k(torch_queries, torch_docs, args.k)
+    print(f"{len(texts)} chunks, {len(queries)} queries, batch size {args.batch_size}")
+    print(f"{'backend':>10} {'chunks/s':>9} {'query p50 (ms)':>15} {'query p95 (ms)':>15} "
+          f"{'cos vs torch':>13} {f'recall@{args.k}':>10} {'mixed':>7}")
+    for backend, (rate, latencies, docs, query_vectors) in results.items():
+        cosine = float(np.mean(np.sum(docs * torch_docs, axis=1)))
+        own = recall(top_k(query_vectors, docs, args.k), expected)
+        mixed = recall(top_k(query_vectors, torch_docs, args.k), expected)
+        print(f"{backend:>10} {rate:>9.1f} {np.percentile(latencies, 50) * 1000:>15.2f} "
+              f"{np.percentile(latencies, 95) * 1000:>15.2f} {cosine:>13.4f} {own:>10.3f} {mixed:>7.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import shutil
+import tempfile
+import time
+from common import synthetic_chunks
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from retriever import HybridRetrieverManager
+
+# startup cost with an existing chroma_db: cold re-embed (old initialize) vs warm start from
+# chroma documents vs warm start from the bm25 snapshot. fake embeddings by default so the
+# cold number is a lower bound, pass --model to embed with the real model
+INSERT_BATCH = 5000
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+def cold_start(persist_dir, chunks, embeddings):
+    manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=embeddings, warm_start=False)
+    for start in range(0, len(chunks), INSERT_BATCH):
+        manager.add_documents(chunks[start:start + INSERT_BATCH])
+    return manager
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--model", default=None, help="embedding model name, e.g. all-MiniLM-L6-v2")
+    args = parser.parse_args()
+
+    if args.model:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    else:
+        embeddings = DeterministicFakeEmbedding(size=384)
+
+    print(f"{'chunks':>8} {'cold (s)':>10} {'warm chroma (s)':>16} {'warm snapshot (s)':>18}")
+    for size in args.sizes:
+        persist_dir = tempfile.mkdtemp(prefix="bench_startup_")
+        try:
+            chunks = synthetic_chunks(size)
+            cold, _ = timed(lambda: cold_start(persist_dir, chunks, embeddings))
+
+            warm, manager = timed(lambda: HybridRetrieverManager(persist_dir=persist_dir, embeddings=embeddings))
+            assert manager.get_chunk_count() == size
+            manager.save_snapshot()
+
+            snapshot, manager = timed(lambda: HybridRetrieverManager(persist_dir=persist_dir, embeddings=embeddings))
+            assert manager.get_chunk_count() == size
+
+            print(f"{size:>8} {cold:>10.2f} {warm:>16.2f} {snapshot:>18.2f}")
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
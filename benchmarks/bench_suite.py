@@ -0,0 +1,160 @@
+import argparse
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+from common import HashingEmbeddings, StubLLM, queries_for, synthetic_chunks
+from embeddings import make_process_pool
+
+# the numbers to compare between runs: per corpus size, add_documents throughput, cold start
+# (hydrate from chroma) and warm start (bm25 snapshot), bm25 / semantic / hybrid search and a
+# full stub-llm answer at p50/p95/p99, and peak rss. each size runs in its own process so its
+# peak rss isn't inherited from a bigger one. corpus, queries and embeddings are seeded, so two
+# runs differ only by the code and the machine
+#
+#   python bench_suite.py --output before.json
+#   python bench_suite.py --output after.json --compare before.json
+INSERT_BATCH = 1000
+PERCENTILES = (50, 95, 99)
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+def latency(func, queries):
+    seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        seconds.append(time.perf_counter() - start)
+    return {f"p{p}_ms": float(np.percentile(seconds, p)) * 1000 for p in PERCENTILES}
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on linux, bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def run_size(size, n_queries, model, backend, seed):
+    from langchain.chains import RetrievalQA
+    from retriever import HybridRetrieverManager
+
+    if model:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=model)
+    else:
+        embeddings = HashingEmbeddings(size=384)
+    chunks = synthetic_chunks(size, seed=seed)
+    queries = [query for query, _ in queries_for(chunks, n_queries, seed=seed + 2)]
+    persist_dir = tempfile.mkdtemp(prefix="bench_suite_")
+
+    def open_manager(warm_start=True):
+        # caches off, every query pays for embedding and retrieval
+        return HybridRetrieverManager(persist_dir=persist_dir, embeddings=embeddings, warm_start=warm_start,
+                                      vector_backend=backend, query_cache_size=0, retrieval_cache_size=0)
+    try:
+        manager = open_manager(warm_start=False)
+        ingest, _ = timed(lambda: [manager.add_documents(chunks[start:start + INSERT_BATCH])
+                                   for start in range(0, size, INSERT_BATCH)])
+        manager.close()
+
+        cold, manager = timed(open_manager)
+        assert manager.get_chunk_count() == size
+        manager.save_snapshot()
+        manager.close()
+        warm, manager = timed(open_manager)
+        assert manager.get_chunk_count() == size
+
+        snapshot = manager.snapshot()
+        n = max(manager.candidates, manager.k)
+        chain = RetrievalQA.from_chain_type(llm=StubLLM(latency=0), retriever=manager.get_retriever())
+        manager.search(queries[0])  # first query pays for lazy setup
+        query = {
+            "bm25": latency(lambda q: snapshot.bm25_index.top_scores(q, n), queries),
+            "semantic": latency(lambda q: manager._semantic_scores(snapshot, q, n), queries),
+            "hybrid": latency(manager.search, queries),
+            "answer": latency(lambda q: chain.invoke({"query": q}), queries),
+        }
+        manager.close()
+        return {
+            "chunks": size,
+            "ingest": {"seconds": ingest, "chunks_per_s": size / ingest},
+            "startup": {"cold_s": cold, "warm_s": warm},
+            "query": query,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        return {k: v for key, item in value.items() for k, v in flatten(item, f"{prefix}{key}.").items()}
+    return {prefix.rstrip("."): value}
+
+def compare(baseline, report):
+    # current / baseline per metric and size, > 1 means slower (or more memory, or higher throughput)
+    before = {r["chunks"]: flatten(r) for r in baseline["results"]}
+    print(f"{'chunks':>8} {'metric':>22} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for result in report["results"]:
+        old = before.get(result["chunks"])
+        if old is None:
+            continue
+        for metric, value in flatten(result).items():
+            if metric == "chunks" or not old.get(metric):
+                continue
+            print(f"{result['chunks']:>8} {metric:>22} {old[metric]:>10.2f} {value:>10.2f} {value / old[metric]:>7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--model", default=None, help="embedding model name, hashing embeddings if not given")
+    parser.add_argument("--backend", default="chroma", help="vector backend: chroma, numpy or ivf")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the json report here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="an earlier report to print ratios against")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        with make_process_pool(1) as pool:
+            result = pool.submit(run_size, size, args.queries, args.model, args.backend, args.seed).result()
+        print(f"{size} chunks: ingest {result['ingest']['seconds']:.2f}s, hybrid p95 "
+              f"{result['query']['hybrid']['p95_ms']:.2f}ms, peak rss {result['peak_rss_mb']:.0f}MB", file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+import chromadb
+import numpy as np
+import common  # noqa: F401, puts the repo root on sys.path
+from vectors import ChromaVectorIndex, IVFVectorIndex, NumpyVectorIndex
+
+# semantic query latency per vector backend as the corpus grows, with recall@10 against exact search.
+# vectors are clustered and l2 normalized like sentence embeddings, 384 dims like all-MiniLM-L6-v2
+CHROMA_BATCH = 5000
+
+def clustered_vectors(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(n // 100, 1), dim))
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def measure(index, queries, truth, n):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids, _ = index.query(query, n)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[:10]) & expected)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    return statistics.median(latencies) * 1000, p95 * 1000, hits / (10 * len(queries))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n", type=int, default=20, help="candidates per query, as in hybrid search")
+    args = parser.parse_args()
+
+    print(f"{'chunks':>7} {'backend':>13} {'build (s)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'recall@10':>10}")
+    for size in args.sizes:
+        vectors = clustered_vectors(size, args.dim)
+        ids = [f"chunk{i}" for i in range(size)]
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.integers(0, size, args.queries)] + 0.05 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+        exact = NumpyVectorIndex()
+        exact.add(ids, vectors)
+        truth = [set(exact.query(q, 10)[0]) for q in queries]
+
+        persist_dir = tempfile.mkdtemp(prefix="bench_vectors_")
+        try:
+            backends = {
+                "chroma": lambda: ChromaVectorIndex(
+                    chromadb.PersistentClient(path=f"{persist_dir}/chroma").create_collection("bench")),
+                "numpy float32": lambda: NumpyVectorIndex(f"{persist_dir}/vectors32.npz"),
+                "numpy float16": lambda: NumpyVectorIndex(f"{persist_dir}/vectors16.npz", dtype="float16"),
+                "ivf": lambda: IVFVectorIndex(f"{persist_dir}/ivf", nprobe=8),
+            }
+            for name, make in backends.items():
+                index = make()
+                start = time.perf_counter()
+                for i in range(0, size, CHROMA_BATCH):
+                    if name == "chroma":
+                        index.collection.add(ids=ids[i:i + CHROMA_BATCH], embeddings=vectors[i:i + CHROMA_BATCH])
+                    else:
+                        index.add(ids[i:i + CHROMA_BATCH], vectors[i:i + CHROMA_BATCH])
+                index.save()
+                build = time.perf_counter() - start
+                p50, p95, recall = measure(index, queries, truth, args.n)
+                print(f"{size:>7} {name:>13} {build:>10.2f} {p50:>9.3f} {p95:>9.3f} {recall:>10.3f}")
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import random
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+VOCAB_SIZE = 20000
+
+def synthetic_chunks(n, seed=0, words_per_chunk=120, n_sources=50):
+    # zipf-ish word distribution so BM25 postings look like real text
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(VOCAB_SIZE)]
+    weights = [1.0 / (i + 1) for i in range(VOCAB_SIZE)]
+    chunks = []
+    for i in range(n):
+        words = rng.choices(vocab, weights=weights, k=words_per_chunk)
+        chunks.append(Document(page_content=" ".join(words), metadata={"source": f"synthetic_{i % n_sources}.txt"}))
+    return chunks
+
+def synthetic_queries(n, seed=1, words_per_query=6):
+    rng = random.Random(seed)
+    return [" ".join(f"w{rng.randint(0, 2000)}" for _ in range(words_per_query)) for _ in range(n)]
+
+def queries_for(chunks, n, seed=2, words_from_chunk=2, noise_words=3, skip_common=100):
+    # (query, target chunk index) pairs: content words sampled from one chunk, skipping the
+    # skip_common most frequent ones like a real query would, plus a few random words
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        target = rng.randrange(len(chunks))
+        content = sorted({w for w in chunks[target].page_content.split() if int(w[1:]) >= skip_common})
+        words = rng.sample(content, min(words_from_chunk, len(content)))
+        words += [f"w{rng.randint(0, VOCAB_SIZE - 1)}" for _ in range(noise_words)]
+        rng.shuffle(words)
+        pairs.append((" ".join(words), target))
+    return pairs
+
+class HashingEmbeddings(Embeddings):
+    # offline stand-in for the model: hashed bag of words, l2 normalized, so similar text gets similar vectors
+    def __init__(self, size=384):
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in text.split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % self.size] += 1.0
+        vector = np.log1p(vector)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+class StubLLM(LLM):
+    # stands in for gemini: fixed latency, no network
+    latency: float = 0.5
+    answer: str = "stub answer"
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    @property
+    def _identifying_params(self):
+        return {"latency": self.latency, "answer": self.answer}
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self.answer
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self.answer
@@ -0,0 +1,290 @@
+import math
+import numpy as np
+from langchain.schema import BaseRetriever
+from typing import Any
+
+
+def default_preprocess(text):
+    return text.split()
+
+
+class BM25Index:
+    # incremental Okapi BM25 with the same scoring as rank_bm25.BM25Okapi (used by BM25Retriever),
+    # documents live in slots so removals don't shift the rest of the index.
+    # an index that queries can see is never modified, writers change a copy() and publish that
+
+    def __init__(self, k1=1.5, b=0.75, epsilon=0.25, preprocess_func=default_preprocess):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.preprocess_func = preprocess_func
+
+        self.postings = {}      # term -> {slot: term frequency}
+        self.doc_len = []       # slot -> token count
+        self.docs = []          # slot -> Document, None once removed
+        self.total_len = 0
+        self.live_count = 0
+        self._owned = None      # terms whose posting this copy may modify, None means all of them
+
+        # derived state, recomputed lazily on the first query after a change
+        self._idf = None
+        self._doc_len_array = None
+        self._live_slots = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_owned"] = None
+        return state
+
+    def copy(self):
+        # postings are shared with this index until the copy first writes to them
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.postings = dict(self.postings)
+        other.doc_len = list(self.doc_len)
+        other.docs = list(self.docs)
+        other._owned = set()
+        return other
+
+    def __len__(self):
+        return self.live_count
+
+    @property
+    def avgdl(self):
+        return self.total_len / self.live_count if self.live_count else 0.0
+
+    def _posting(self, term):
+        posting = self.postings.get(term)
+        if posting is None:
+            posting = self.postings[term] = {}
+        elif self._owned is not None and term not in self._owned:
+            posting = self.postings[term] = dict(posting)
+        else:
+            return posting
+        if self._owned is not None:
+            self._owned.add(term)
+        return posting
+
+    def add_documents(self, docs):
+        slots = []
+        for doc in docs:
+            slot = len(self.docs)
+            tokens = self.preprocess_func(doc.page_content)
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for term, freq in frequencies.items():
+                self._posting(term)[slot] = freq
+
+            self.docs.append(doc)
+            self.doc_len.append(len(tokens))
+            self.total_len += len(tokens)
+            self.live_count += 1
+            slots.append(slot)
+
+        if slots:
+            self._invalidate()
+        return slots
+
+    def remove(self, slots):
+        removed = 0
+        for slot in slots:
+            doc = self.docs[slot]
+            if doc is None:
+                continue
+            for term in set(self.preprocess_func(doc.page_content)):
+                posting = self._posting(term)
+                del posting[slot]
+                if not posting:
+                    del self.postings[term]
+            self.total_len -= self.doc_len[slot]
+            self.doc_len[slot] = 0
+            self.docs[slot] = None
+            self.live_count -= 1
+            removed += 1
+
+        if removed:
+            self._invalidate()
+        return removed
+
+    def clear(self):
+        self.__init__(self.k1, self.b, self.epsilon, self.preprocess_func)
+
+    @property
+    def dead_count(self):
+        return len(self.docs) - self.live_count
+
+    def compact(self):
+        # a new index without the removed slots, live documents keep their order under new slot numbers
+        remap = {int(old): new for new, old in enumerate(self.live_slots())}
+        other = type(self)(self.k1, self.b, self.epsilon, self.preprocess_func)
+        other.postings = {
+            term: {remap[slot]: freq for slot, freq in posting.items()} for term, posting in self.postings.items()
+        }
+        other.doc_len = [self.doc_len[slot] for slot in remap]
+        other.docs = [self.docs[slot] for slot in remap]
+        other.total_len = self.total_len
+        other.live_count = self.live_count
+        return other
+
+    def _invalidate(self):
+        self._idf = None
+        self._doc_len_array = None
+        self._live_slots = None
+
+    def idf(self):
+        if self._idf is None:
+            # mirrors BM25Okapi._calc_idf: terms in more than half the documents get eps * average idf
+            idf = {}
+            idf_sum = 0.0
+            negative = []
+            for term, posting in self.postings.items():
+                value = math.log(self.live_count - len(posting) + 0.5) - math.log(len(posting) + 0.5)
+                idf[term] = value
+                idf_sum += value
+                if value < 0:
+                    negative.append(term)
+            if idf:
+                eps = self.epsilon * (idf_sum / len(idf))
+                for term in negative:
+                    idf[term] = eps
+            self._idf = idf
+        return self._idf
+
+    def live_slots(self):
+        if self._live_slots is None:
+            self._live_slots = np.array([i for i, d in enumerate(self.docs) if d is not None], dtype=np.int64)
+        return self._live_slots
+
+    def get_scores(self, tokens):
+        # scores for every slot, removed slots stay at 0 and are masked out by top_n
+        return self._scores(tokens)[0]
+
+    def _scores(self, tokens):
+        # get_scores and which slots contain at least one of the terms. scores can be 0 or negative for
+        # matching documents: in a corpus of one or two files every term gets the negative eps idf
+        doc_len = self._doc_lengths()
+        scores = np.zeros(len(doc_len))
+        matched = np.zeros(len(doc_len), dtype=bool)
+        if not self.live_count:
+            return scores, matched
+
+        for term in tokens:
+            term_scores = self._term_scores(term, doc_len)
+            if term_scores is not None:
+                scores[term_scores[0]] += term_scores[1]
+                matched[term_scores[0]] = True
+        return scores, matched
+
+    def _doc_lengths(self):
+        if self._doc_len_array is None:
+            self._doc_len_array = np.array(self.doc_len, dtype=np.float64)
+        return self._doc_len_array
+
+    def _term_scores(self, term, doc_len):
+        # (slots, bm25 contribution) of one query term, None for terms no document contains
+        weight = self.idf().get(term)
+        if weight is None:
+            return None
+        posting = self.postings[term]
+        idx = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+        tf = np.fromiter(posting.values(), dtype=np.float64, count=len(posting))
+        return idx, self._weigh(weight, tf, doc_len[idx])
+
+    def _weigh(self, weight, tf, lengths):
+        k1, b = self.k1, self.b
+        return weight * (tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / self.avgdl)))
+
+    def _slot_scores(self, tokens, slots):
+        # _scores for the given sorted live slots only, the rest of the index is never touched: a term
+        # whose posting is longer than the slots is looked up per slot instead of read whole
+        doc_len = self._doc_lengths()
+        scores = np.zeros(len(slots))
+        matched = np.zeros(len(slots), dtype=bool)
+        if not len(slots):
+            return scores, matched
+        slot_list = None
+        for term in tokens:
+            weight = self.idf().get(term)
+            if weight is None:
+                continue
+            posting = self.postings[term]
+            if len(posting) <= len(slots):
+                idx, contribution = self._term_scores(term, doc_len)
+                positions = np.minimum(np.searchsorted(slots, idx), len(slots) - 1)
+                found = slots[positions] == idx
+                scores[positions[found]] += contribution[found]
+                matched[positions[found]] = True
+            else:
+                if slot_list is None:
+                    slot_list = slots.tolist()
+                tf = np.fromiter((posting.get(slot, 0) for slot in slot_list), dtype=np.float64, count=len(slots))
+                scores += self._weigh(weight, tf, doc_len[slots])
+                matched |= tf > 0
+        return scores, matched
+
+    def replace(self, slot, doc):
+        # same text, new metadata
+        self.docs[slot] = doc
+
+    def top_n(self, query, n):
+        if not self.live_count:
+            return []
+        live = self.live_slots()
+        scores = self.get_scores(self.preprocess_func(query))[live]
+        order = np.argsort(scores)[::-1][:n]
+        return [self.docs[live[i]] for i in order]
+
+    def top_scores(self, query, n, slots=None):
+        # (slots, scores) of the n best matching documents, best first, documents without any of the query
+        # terms are left out. slots (sorted live slots, a metadata filter's) limits scoring to those documents
+        if not self.live_count:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if slots is not None:
+            return self._best(slots, *self._slot_scores(self.preprocess_func(query), slots), n)
+        live = self.live_slots()
+        scores, matched = self._scores(self.preprocess_func(query))
+        return self._best(live, scores[live], matched[live], n)
+
+    def top_scores_many(self, queries, n, slots=None):
+        # top_scores for several queries, each distinct term is scored once for all of them
+        if not self.live_count:
+            return [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in queries]
+        if slots is not None:
+            return [self.top_scores(query, n, slots) for query in queries]
+        rows_by_term = {}
+        for row, query in enumerate(queries):
+            for term in self.preprocess_func(query):
+                rows_by_term.setdefault(term, []).append(row)
+
+        doc_len = self._doc_lengths()
+        scores = np.zeros((len(queries), len(doc_len)))
+        matched = np.zeros((len(queries), len(doc_len)), dtype=bool)
+        for term, rows in rows_by_term.items():
+            term_scores = self._term_scores(term, doc_len)
+            if term_scores is None:
+                continue
+            # a term repeated in one query counts once per occurrence, like in get_scores
+            rows, counts = np.unique(rows, return_counts=True)
+            block = np.ix_(rows, term_scores[0])
+            scores[block] += counts[:, None] * term_scores[1]
+            matched[block] = True
+        live = self.live_slots()
+        return [self._best(live, row[live], row_matched[live], n) for row, row_matched in zip(scores, matched)]
+
+    @staticmethod
+    def _best(live, scores, matched, n):
+        top = np.flatnonzero(matched)
+        if len(top) > n:
+            top = top[np.argpartition(-scores[top], n)[:n]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return live[top], scores[top]
+
+
+class BM25IndexRetriever(BaseRetriever):
+    index: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        # records from the manager's chunk store become Documents only for the k results
+        return [d.to_document() if hasattr(d, "to_document") else d for d in self.index.top_n(query, self.k)]
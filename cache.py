@@ -0,0 +1,202 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from embeddings import encode
+
+
+def normalize_query(text):
+    return " ".join(text.split()).lower()
+
+
+def _sizeof(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    # thread-safe LRU with optional ttl, tracks hits/misses and a rough memory estimate
+
+    def __init__(self, max_size=1024, ttl=None, sizeof=_sizeof):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+                self._evict(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        size = sys.getsizeof(key) + self.sizeof(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+            self._data[key] = (value, expires_at, size)
+            self.memory_bytes += size
+            while len(self._data) > self.max_size:
+                self._evict(next(iter(self._data)))
+
+    def _evict(self, key):
+        self.memory_bytes -= self._data.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.memory_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_bytes": self.memory_bytes,
+        }
+
+
+class DiskCache:
+    # same interface as LRUCache, backed by sqlite so cached answers survive restarts
+
+    def __init__(self, path, max_size=10000, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL, used_at REAL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def _key(key):
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get(self, key, default=None):
+        digest = self._key(key)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (digest,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (digest,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            self._db.execute("UPDATE cache SET used_at = ? WHERE key = ?", (now, digest))
+            self._db.commit()
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (self._key(key), blob, expires_at, now),
+            )
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM cache")
+            self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            size, memory = self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache").fetchone()
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_bytes": memory,
+            "path": self.path,
+        }
+
+
+def make_cache(max_size, ttl=None, path=None):
+    if path:
+        return DiskCache(path, max_size=max_size, ttl=ttl)
+    return LRUCache(max_size=max_size, ttl=ttl)
+
+
+class CachedQueryEmbeddings(Embeddings):
+    # wraps the model for the vector store: query vectors are cached on normalized text,
+    # document embedding passes straight through
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(key), dtype=np.float32)
+            self.cache.put(key, vector)
+        return vector.tolist()
+
+    def embed_queries(self, texts):
+        # several queries as one float32 matrix, the ones not cached go to the model in a single call
+        keys = [normalize_query(t) for t in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+        if missing:
+            fresh = dict(zip(missing, encode(self.embeddings, missing)))
+            for key, vector in fresh.items():
+                self.cache.put(key, vector)
+            vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
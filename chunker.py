@@ -0,0 +1,150 @@
+import os
+
+# recursive character chunking with the semantics of langchain's RecursiveCharacterTextSplitter (try
+# "\n\n", then "\n", " " and single characters, keep each separator at the start of the following piece,
+# merge pieces up to chunk_size with chunk_overlap, strip the chunks), computed on offsets into the text
+# instead of copied strings and Documents, and over a stream of text so chunks come out while it arrives
+
+SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+def split_spans(text, chunk_size=800, chunk_overlap=100, separators=SEPARATORS, length=len):
+    # (start, end) of every chunk of text, in order. length measures a piece of text, len by default,
+    # token_length() to size chunks for the embedding model
+    return [(start, end) for start, end, _ in _chunk_spans(text, chunk_size, chunk_overlap, separators, length)]
+
+
+def iter_spans(pieces, chunk_size=800, chunk_overlap=100, separators=SEPARATORS, length=len, window=64000):
+    # (start, end, text) of every chunk of the concatenated pieces, offsets from the start of the stream.
+    # once `window` characters are buffered, the text up to the last top level separator (the piece after
+    # it may still grow) is split and the chunks before the point the last one can be rebuilt from are
+    # emitted. the rest waits for more text. this gives the same chunks as splitting the whole text as long
+    # as each window holds the separator the whole text would be split on first, a paragraph break usually
+    buffer = ""
+    base = 0
+    split_at = window
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) < split_at:
+            continue
+        cut = 0
+        separator = next((s for s in separators if s and s in buffer), "")
+        complete = buffer.rfind(separator) if separator else len(buffer)
+        while separator and complete > 0 and buffer.startswith(separator, complete - 1):
+            complete -= 1  # to the start of a run like "\n\n\n", which is where the piece ends
+        if complete > 0 and (not separator or buffer.find(separator, 0, complete) != -1):
+            spans = _chunk_spans(buffer[:complete], chunk_size, chunk_overlap, separators, length)
+            cut = spans[-1][2] if spans else 0
+        if cut <= 0:
+            split_at = 2 * len(buffer)  # nothing to cut at yet, wait for more text instead of re-splitting
+            continue
+        for start, end, restart in spans:
+            if restart >= cut:
+                break
+            yield base + start, base + end, buffer[start:end]
+        base += cut
+        buffer = buffer[cut:]
+        split_at = window
+    for start, end, _ in _chunk_spans(buffer, chunk_size, chunk_overlap, separators, length):
+        yield base + start, base + end, buffer[start:end]
+
+
+def token_length(model):
+    # length function counting the embedding model's tokens (all-MiniLM-L6-v2 reads at most 256), from a
+    # tokenizer.json in `model` (an export_onnx.py directory) or the model's tokenizer on the hub
+    from tokenizers import Tokenizer
+    path = os.path.join(model, "tokenizer.json")
+    if os.path.exists(path):
+        tokenizer = Tokenizer.from_file(path)
+    else:
+        tokenizer = Tokenizer.from_pretrained(model if "/" in model else f"sentence-transformers/{model}")
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+
+    def length(text):
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return length
+
+
+def _chunk_spans(text, chunk_size, chunk_overlap, separators, length):
+    # (start, end, restart) per chunk. splitting again from restart on, with the pieces before it dropped,
+    # yields this chunk and the ones after it unchanged: it is where the chunk's first top level piece
+    # starts, or the start of the oversized top level piece the chunk was cut from
+    out = []
+    _split(text, 0, len(text), list(separators), chunk_size, chunk_overlap, length, out)
+    return out
+
+
+def _split(text, start, end, separators, chunk_size, chunk_overlap, length, out, restart=None):
+    separator = separators[-1]
+    rest = []
+    for i, candidate in enumerate(separators):
+        if not candidate:
+            separator = candidate
+            break
+        if text.find(candidate, start, end) != -1:
+            separator = candidate
+            rest = separators[i + 1:]
+            break
+
+    good = []
+    for a, b in _pieces(text, start, end, separator):
+        n = b - a if length is len else length(text[a:b])
+        if n < chunk_size:
+            good.append((a, b, n))
+            continue
+        if good:
+            _merge(text, good, chunk_size, chunk_overlap, out, restart)
+            good = []
+        if rest:
+            _split(text, a, b, rest, chunk_size, chunk_overlap, length, out, a if restart is None else restart)
+        else:
+            # can't be split any further, kept whole and unstripped like langchain does
+            out.append((a, b, a if restart is None else restart))
+    if good:
+        _merge(text, good, chunk_size, chunk_overlap, out, restart)
+
+
+def _pieces(text, start, end, separator):
+    # text[start:end] cut before every separator, empty pieces dropped
+    if not separator:
+        return [(i, i + 1) for i in range(start, end)]
+    pieces = []
+    size = len(separator)
+    previous = start
+    found = text.find(separator, start, end)
+    while found != -1:
+        if found > previous:
+            pieces.append((previous, found))
+        previous = found
+        found = text.find(separator, found + size, end)
+    if end > previous:
+        pieces.append((previous, end))
+    return pieces
+
+
+def _merge(text, pieces, chunk_size, chunk_overlap, out, restart=None):
+    # consecutive pieces are contiguous, so a chunk is one span from its first piece to its last
+    current = []
+    first = 0  # pieces before current[first] have dropped out of the overlap
+    total = 0
+    for piece in pieces:
+        n = piece[2]
+        if total + n > chunk_size and first < len(current):
+            _emit(text, current[first][0], current[-1][1], out, restart)
+            while total > chunk_overlap or (total + n > chunk_size and total > 0):
+                total -= current[first][2]
+                first += 1
+        current.append(piece)
+        total += n
+    if first < len(current):
+        _emit(text, current[first][0], current[-1][1], out, restart)
+
+
+def _emit(text, start, end, out, restart):
+    chunk = text[start:end]
+    stripped = chunk.strip()
+    if stripped:
+        restart = start if restart is None else restart
+        start += len(chunk) - len(chunk.lstrip())
+        out.append((start, start + len(stripped), restart))
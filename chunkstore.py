@@ -0,0 +1,168 @@
+import glob
+import mmap
+import os
+import sys
+import uuid
+from langchain.schema import Document
+
+PER_CHUNK = ("chunk_index", "start_index")  # metadata kept on the record instead of the shared dict
+
+
+class ChunkRecord:
+    # one indexed chunk: id, where its text sits in the store's file, and its metadata split into a dict
+    # shared by every chunk of the same file and the chunk's own index and offset in the file (start_index).
+    # Documents are only built on demand
+    __slots__ = ("buffer", "id", "start", "end", "shared", "chunk_index", "start_index")
+
+    def __init__(self, buffer, chunk_id, start, end, shared, chunk_index, start_index=None):
+        self.buffer = buffer
+        self.id = chunk_id
+        self.start = start
+        self.end = end
+        self.shared = shared
+        self.chunk_index = chunk_index
+        self.start_index = start_index
+
+    def __reduce__(self):
+        # pickled with the bm25 snapshot, the manager binds the buffer again on load
+        return (ChunkRecord, (None, self.id, self.start, self.end, self.shared, self.chunk_index, self.start_index))
+
+    @property
+    def page_content(self):
+        return self.buffer.read(self.start, self.end)
+
+    @property
+    def source(self):
+        return self.shared.get("source")
+
+    @property
+    def metadata(self):
+        metadata = dict(self.shared)
+        if self.chunk_index is not None:
+            metadata["chunk_index"] = self.chunk_index
+        if self.start_index is not None:
+            metadata["start_index"] = self.start_index
+        return metadata
+
+    def to_document(self):
+        return Document(page_content=self.page_content, metadata=self.metadata, id=self.id)
+
+
+class TextBuffer:
+    # append-only utf-8 file read through mmap. appends remap the file, older maps stay valid
+    # for readers that still hold them
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a+b")
+        self.size = os.path.getsize(path)
+        self._map = None
+        self._remap()
+
+    def _remap(self):
+        self._map = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ) if self.size else None
+
+    def append(self, texts):
+        spans = []
+        data = bytearray()
+        for text in texts:
+            encoded = text.encode("utf-8")
+            spans.append((self.size + len(data), self.size + len(data) + len(encoded)))
+            data += encoded
+        self._file.write(data)
+        self._file.flush()
+        self.size += len(data)
+        self._remap()
+        return spans
+
+    def read(self, start, end):
+        if start == end:
+            return ""
+        return self._map[start:end].decode("utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+class ChunkStore:
+    # chunk texts in one file under persist_dir, chunks are ChunkRecords pointing into it.
+    # removed chunks leave dead bytes behind until compact() rewrites the live ones to a new file
+
+    def __init__(self, directory, filename=None):
+        self.directory = directory
+        self._shared = {}  # metadata items -> the one dict every chunk with that metadata points to
+        os.makedirs(directory, exist_ok=True)
+        self.buffer = TextBuffer(os.path.join(directory, filename or self._new_name()))
+        self.dead_bytes = 0
+
+    @staticmethod
+    def _new_name():
+        return f"chunks-{uuid.uuid4().hex[:8]}.txt"
+
+    @property
+    def filename(self):
+        return os.path.basename(self.buffer.path)
+
+    def remove_stale_files(self):
+        for path in glob.glob(os.path.join(self.directory, "chunks-*.txt")):
+            if path != self.buffer.path:
+                os.remove(path)
+
+    def intern(self, metadata):
+        shared = {k: v for k, v in metadata.items() if k not in PER_CHUNK}
+        try:
+            key = tuple(sorted(shared.items()))
+            hash(key)
+        except TypeError:
+            return shared  # unhashable values are kept per chunk
+        existing = self._shared.get(key)
+        if existing is None:
+            if isinstance(shared.get("source"), str):
+                shared["source"] = sys.intern(shared["source"])
+            existing = self._shared[key] = shared
+        return existing
+
+    def add(self, chunks):
+        spans = self.buffer.append([c.page_content for c in chunks])
+        return [
+            ChunkRecord(self.buffer, c.id, start, end, self.intern(c.metadata),
+                        c.metadata.get("chunk_index"), c.metadata.get("start_index"))
+            for c, (start, end) in zip(chunks, spans)
+        ]
+
+    def with_metadata(self, record, metadata):
+        return ChunkRecord(record.buffer, record.id, record.start, record.end,
+                           self.intern(metadata), metadata.get("chunk_index"), metadata.get("start_index"))
+
+    def bind(self, records):
+        # records unpickled for a warm start are all the live ones, the rest of the file is what
+        # chunks removed before the restart left behind and counts towards compaction
+        live = set()
+        for record in records:
+            record.buffer = self.buffer
+            record.shared = self.intern(record.shared)
+            live.add((record.start, record.end))
+        self.dead_bytes = self.buffer.size - sum(end - start for start, end in live)
+
+    def release(self, records):
+        self.dead_bytes += sum(r.end - r.start for r in records)
+
+    def needs_compaction(self):
+        return self.dead_bytes > max(self.buffer.size - self.dead_bytes, 1 << 20)
+
+    def compact(self, records):
+        # copies the live texts to a fresh file and returns new records in the same order,
+        # records of older snapshots keep reading the old file until they are dropped
+        old = self.buffer
+        self.buffer = TextBuffer(os.path.join(self.directory, self._new_name()))
+        spans = self.buffer.append([r.page_content for r in records])
+        self.dead_bytes = 0
+        # the old file's handle is closed and its name removed. on posix its mmap stays readable for
+        # older snapshots, and the disk space is freed once their records drop the map
+        old.close()
+        os.remove(old.path)
+        return [ChunkRecord(self.buffer, r.id, start, end, r.shared, r.chunk_index, r.start_index)
+                for r, (start, end) in zip(records, spans)]
+
+    def close(self):
+        self.buffer.close()
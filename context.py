@@ -0,0 +1,121 @@
+import math
+from langchain.schema import Document
+
+# the context stage between retrieval and the llm. retrieved chunks often repeat text: neighbouring chunks
+# share their 100 character overlap, bm25 and the vector search bring back chunks next to each other, and
+# the same file may be indexed under two names. pack_context drops duplicates, merges chunks of one file
+# that overlap or follow each other into one passage using their offsets, and fits the result into a
+# token budget, best ranked passages first
+
+
+def estimate_tokens(text):
+    # gemini has no local tokenizer, about 4 characters per token for english text
+    return math.ceil(len(text) / 4)
+
+
+def pack_context(docs, budget=0, length=estimate_tokens):
+    # (passages, stats) for docs in rank order. a passage takes the rank of its best ranked chunk.
+    # budget is in tokens as counted by length, 0 means no budget. stats has the chunk and passage
+    # counts and the tokens retrieved, packed and saved
+    unique = _dedupe(docs)
+    passages = []
+    for run in _runs(unique):
+        passages.append((min(rank for rank, _ in run), _merge([doc for _, doc in run])))
+    passages = [doc for _, doc in sorted(passages, key=lambda p: p[0])]
+
+    packed = []
+    used = 0
+    for doc in passages:
+        tokens = length(doc.page_content)
+        if budget and used + tokens > budget:
+            text = _truncate(doc.page_content, budget - used, length)
+            if text:
+                packed.append(Document(page_content=text, metadata=dict(doc.metadata, truncated=True), id=doc.id))
+                used += length(text)
+            break
+        packed.append(doc)
+        used += tokens
+
+    retrieved = sum(length(doc.page_content) for doc in docs)
+    return packed, {"chunks": len(docs), "passages": len(packed), "tokens_retrieved": retrieved,
+                    "tokens": used, "tokens_saved": retrieved - used}
+
+
+def _dedupe(docs):
+    # (rank, doc) of each chunk's first appearance, by id and by text with whitespace collapsed
+    seen_ids, seen_texts, unique = set(), set(), []
+    for rank, doc in enumerate(docs):
+        text = " ".join(doc.page_content.split())
+        if (doc.id is not None and doc.id in seen_ids) or text in seen_texts:
+            continue
+        seen_ids.add(doc.id)
+        seen_texts.add(text)
+        unique.append((rank, doc))
+    return unique
+
+
+def _runs(ranked):
+    # groups of (rank, doc) to merge: chunks of the same file whose spans overlap or touch, or that are
+    # consecutive chunks of it. chunks without an offset stay on their own
+    by_source, runs = {}, []
+    for rank, doc in ranked:
+        if doc.metadata.get("start_index") is None:
+            runs.append([(rank, doc)])
+        else:
+            by_source.setdefault(doc.metadata.get("source"), []).append((rank, doc))
+    for chunks in by_source.values():
+        chunks.sort(key=lambda c: c[1].metadata["start_index"])
+        run, end = [chunks[0]], _end(chunks[0][1])
+        for rank, doc in chunks[1:]:
+            if doc.metadata["start_index"] <= end or _consecutive(run[-1][1], doc):
+                run.append((rank, doc))
+                end = max(end, _end(doc))
+            else:
+                runs.append(run)
+                run, end = [(rank, doc)], _end(doc)
+        runs.append(run)
+    return runs
+
+
+def _merge(docs):
+    # one passage from chunks in file order, the overlap written once
+    if len(docs) == 1:
+        return docs[0]
+    first = docs[0]
+    text, end = first.page_content, _end(first)
+    for doc in docs[1:]:
+        start = doc.metadata["start_index"]
+        if start <= end:
+            text += doc.page_content[end - start:]
+        else:
+            text += "\n" + doc.page_content  # consecutive chunks, only whitespace was stripped between them
+        end = max(end, _end(doc))
+    return Document(page_content=text, metadata=dict(first.metadata, merged_chunks=len(docs)), id=first.id)
+
+
+def _end(doc):
+    return doc.metadata["start_index"] + len(doc.page_content)
+
+
+def _consecutive(previous, doc):
+    a, b = previous.metadata.get("chunk_index"), doc.metadata.get("chunk_index")
+    return a is not None and b is not None and b == a + 1
+
+
+def _truncate(text, tokens, length):
+    # the longest prefix within tokens, cut back to a word boundary
+    if tokens <= 0:
+        return ""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if length(text[:middle]) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    if low < len(text):
+        space = max(cut.rfind(" "), cut.rfind("\n"))
+        if space > len(cut) // 2:
+            cut = cut[:space]
+    return cut.rstrip()
@@ -0,0 +1,232 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from metrics import INGEST_SECONDS
+
+
+def make_process_pool(workers):
+    # spawn rather than fork, the parent already has torch and chroma threads running
+    if workers <= 0:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# "torch" runs the model through sentence-transformers. "onnx" and "onnx-int8" run an export made by
+# export_onnx() on onnx runtime, model_name is then the export directory
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+_models = {}
+_models_lock = threading.Lock()
+
+def get_embeddings(model_name, backend="torch", threads=None):
+    # one embeddings object per (backend, model) and process, loaded on first use and shared by every caller.
+    # torch, sentence-transformers and onnx runtime are only imported here
+    key = (backend, model_name)
+    model = _models.get(key)
+    if model is None:
+        with _models_lock:
+            model = _models.get(key)
+            if model is None:
+                model = _models[key] = _load(model_name, backend, threads)
+    return model
+
+def _load(model_name, backend, threads):
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddings(model_name, quantized=backend == "onnx-int8", threads=threads)
+    raise ValueError(f"unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+
+class LazyEmbeddings(Embeddings):
+    # stands in for get_embeddings(model_name, backend) until the first text is embedded, so building
+    # or warm starting a manager doesn't load the model
+
+    def __init__(self, model_name, backend="torch"):
+        self.model_name = model_name
+        self.backend = backend
+
+    @property
+    def model(self):
+        return get_embeddings(self.model_name, self.backend)
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.model.embed_query(text)
+
+
+class OnnxEmbeddings(Embeddings):
+    # sentence-transformers on onnx runtime without torch: the exported transformer, then the mean pooling
+    # and l2 normalization all-MiniLM-L6-v2 applies, so vectors match the torch backend's and an index
+    # built with one can be queried with the other. int8 weights drift slightly, see bench_onnx.py
+
+    def __init__(self, model_dir, quantized=False, threads=None, max_length=256, batch_size=64):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        path = os.path.join(model_dir, "model_quantized.onnx" if quantized else "model.onnx")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found, export the model with export_onnx.py first")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def encode(self, texts, batch_size=None):
+        # longest texts first so each batch pads to a similar length, rows come back in input order
+        batch_size = batch_size or self.batch_size
+        texts = [t.replace("\n", " ") for t in texts]
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        vectors = np.empty((0, 0), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self._encode_batch([texts[i] for i in rows])
+            if not start:
+                vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            vectors[rows] = batch
+        return vectors
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        feed = {"input_ids": np.array([e.ids for e in encoded], dtype=np.int64), "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in encoded], dtype=np.int64)}
+        hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+        weights = mask[..., None].astype(np.float32)
+        pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+def export_onnx(model_name, output_dir, quantize=True, opset=14):
+    # one-time export of a sentence-transformers model's transformer to output_dir/model.onnx with its
+    # tokenizer.json, and with quantize an int8 dynamically quantized model_quantized.onnx next to it.
+    # needs torch and transformers, serving the export only needs onnxruntime and tokenizers
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    name = model_name if "/" in model_name or os.path.isdir(model_name) else f"sentence-transformers/{model_name}"
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    model = AutoModel.from_pretrained(name).eval()
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["an example sentence to trace the model with"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]  # forward() order
+    path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[n] for n in names), path, input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes={n: {0: "batch", 1: "sequence"} for n in names + ["last_hidden_state"]},
+            opset_version=opset,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, os.path.join(output_dir, "model_quantized.onnx"), weight_type=QuantType.QInt8)
+    return path
+
+
+def encode(embeddings, texts, batch_size=64):
+    # float32 matrix straight from sentence-transformers or onnx runtime, skipping the tolist() round trip
+    # HuggingFaceEmbeddings does; other embeddings go through embed_documents
+    if isinstance(embeddings, LazyEmbeddings):
+        embeddings = embeddings.model
+    if isinstance(embeddings, OnnxEmbeddings):
+        return embeddings.encode(texts, batch_size)
+    client = getattr(embeddings, "_client", None)
+    if client is not None and hasattr(client, "encode"):
+        kwargs = dict(getattr(embeddings, "encode_kwargs", None) or {})
+        kwargs["batch_size"] = batch_size
+        vectors = client.encode(
+            [t.replace("\n", " ") for t in texts], convert_to_numpy=True, show_progress_bar=False, **kwargs
+        )
+        return np.asarray(vectors, dtype=np.float32)
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def encode_in_worker(model_name, texts, batch_size, threads, backend="torch"):
+    # runs inside pipeline worker processes, each loads the model once
+    if backend == "torch" and (backend, model_name) not in _models:
+        import torch
+        torch.set_num_threads(threads)
+    return encode(get_embeddings(model_name, backend, threads), texts, batch_size)
+
+
+class EmbeddingPipeline:
+    # encodes chunks in batches and hands each batch to write() while the next ones are encoding,
+    # in-process on a background thread or across `workers` processes
+
+    def __init__(self, embeddings, model_name, batch_size=64, workers=0, backend="torch"):
+        # worker processes load (backend, model_name) themselves, any other embeddings would only be used
+        # for queries and the index would mix vectors of two models
+        if workers > 0 and not (isinstance(embeddings, LazyEmbeddings) and embeddings.model_name == model_name
+                                and embeddings.backend == backend):
+            raise ValueError("embed_workers > 0 encodes with embedding_model in each worker, "
+                             "custom embeddings need embed_workers=0")
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.workers = workers
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = make_process_pool(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        return self._executor
+
+    def _submit(self, texts):
+        executor = self._get_executor()
+        if self.workers > 0:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            return executor.submit(encode_in_worker, self.model_name, texts, self.batch_size, threads, self.backend)
+        return executor.submit(encode, self.embeddings, texts, self.batch_size)
+
+    def run(self, chunks, write, progress=None):
+        batches = iter([chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size)])
+        in_flight = deque()
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                in_flight.append((batch, self._submit([c.page_content for c in batch])))
+
+        try:
+            for _ in range(max(self.workers, 1) + 1):
+                submit_next()
+            while in_flight:
+                batch, future = in_flight.popleft()
+                with INGEST_SECONDS.time("embed"):  # time blocked on the encoder, writes overlap the next batches
+                    vectors = future.result()
+                submit_next()
+                write(batch, vectors)
+                if progress is not None:
+                    progress(len(batch))
+        finally:
+            # a failed encode or write leaves batches behind: the queued ones are cancelled and the running
+            # ones waited for, so the next run doesn't queue behind work whose vectors nobody writes
+            futures = [future for _, future in in_flight if not future.cancel()]
+            wait(futures)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+from retriever import HybridRetrieverManager, iter_pages, iter_chunks, index_batches, sync_dir, file_metadata
+from embeddings import EMBEDDING_BACKENDS
+from chunker import token_length
+
+# offline retrieval evaluation: runs a file of queries through HybridRetrieverManager.search(),
+# no llm involved, and reports per-stage latency and, given qrels, recall@k and MRR@k
+#
+#   python evaluate.py queries.tsv --qrels qrels.txt --k 10 --output ranked.jsonl
+#
+# queries: one per line, either "query" or "qid<TAB>query"
+# qrels: trec style "qid 0 doc relevance" (or "qid doc"), doc is a chunk id or a source file name
+
+STAGES = ("embed", "vector", "bm25", "fuse", "total")
+
+def read_queries(path):
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            qid, _, query = line.partition("\t") if "\t" in line else (str(len(queries) + 1), "", line)
+            queries.append((qid.strip(), query.strip()))
+    return queries
+
+def read_qrels(path):
+    qrels = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if len(fields) >= 4 and float(fields[3]) <= 0:
+                continue
+            doc = fields[2] if len(fields) >= 3 else fields[1]
+            qrels.setdefault(fields[0], set()).add(doc)
+    return qrels
+
+def judge(results, relevant):
+    # (recall, reciprocal rank) of one ranking, a result matches a qrel by chunk id or by source
+    found = set()
+    first = None
+    for rank, (chunk_id, source) in enumerate(results, 1):
+        matches = relevant & {chunk_id, source}
+        if matches and first is None:
+            first = rank
+        found |= matches
+    return len(found) / len(relevant), 1.0 / first if first else 0.0
+
+def index_dir(manager, data_dir, chunk_size=800, chunk_overlap=100, length_function=len):
+    # brings the index in line with data_dir like app.initialize does, chunking must match the server's
+    # (CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_TOKENIZER) when both share a persist dir
+    def ingest(path):
+        batches = iter_chunks(iter_pages(path), file_metadata(path), chunk_size, chunk_overlap,
+                              length_function=length_function)
+        index_batches(manager, path, batches)
+
+    return sync_dir(manager, data_dir, ingest)
+
+def run(manager, queries, k, qrels=None, output=None):
+    latencies = {stage: [] for stage in STAGES}
+    recalls, reciprocal_ranks = [], []
+    for qid, query in queries:
+        timings = {}
+        start = time.perf_counter()
+        results = manager.search(query, k=k, with_scores=True, timings=timings)
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
+        for stage in STAGES:
+            latencies[stage].append(timings.get(f"{stage}_ms", 0.0))
+        if qrels is not None and qid in qrels:
+            recall, rr = judge([(doc.id, doc.metadata.get("source")) for doc, _ in results], qrels[qid])
+            recalls.append(recall)
+            reciprocal_ranks.append(rr)
+        if output is not None:
+            output.write(json.dumps({
+                "qid": qid, "query": query, "timings": timings,
+                "results": [{"rank": rank, "id": doc.id, "source": doc.metadata.get("source"), "scores": scores}
+                            for rank, (doc, scores) in enumerate(results, 1)],
+            }) + "\n")
+
+    report = {"queries": len(queries), "k": k}
+    for stage, values in latencies.items():
+        report[f"{stage}_ms"] = {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+    if qrels is not None:
+        report["judged"] = len(recalls)
+        report[f"recall@{k}"] = float(np.mean(recalls)) if recalls else 0.0
+        report[f"mrr@{k}"] = float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0
+    return report
+
+def main(argv=None):
+    load_dotenv()  # the server's .env, for the chunking defaults below
+    parser = argparse.ArgumentParser(description="offline retrieval evaluation, no llm calls")
+    parser.add_argument("queries", help="file with one query per line, optionally 'qid<TAB>query'")
+    parser.add_argument("--qrels", help="trec style relevance judgements, by chunk id or source name")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--index", metavar="DATA_DIR", help="index new or changed files of this directory first")
+    # --index chunks like the server does, the defaults are the environment variables app.py reads
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("CHUNK_SIZE", "800")))
+    parser.add_argument("--chunk-overlap", type=int, default=int(os.getenv("CHUNK_OVERLAP", "100")))
+    parser.add_argument("--chunk-tokenizer", default=os.getenv("CHUNK_TOKENIZER"),
+                        help="size chunks in this model's tokens instead of characters")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="embedding model the index was built with")
+    parser.add_argument("--embedding-backend", default="torch", choices=EMBEDDING_BACKENDS,
+                        help="onnx backends take --model as the export_onnx.py output directory")
+    parser.add_argument("--fusion", default="minmax")
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--output", help="write each query's ranked chunks and scores as jsonl")
+    args = parser.parse_args(argv)
+
+    manager = HybridRetrieverManager(persist_dir=args.persist_dir, embedding_model=args.model,
+                                     embedding_backend=args.embedding_backend, fusion=args.fusion,
+                                     candidates=args.candidates, query_cache_size=0, retrieval_cache_size=0)
+    try:
+        if args.index:
+            length = token_length(args.chunk_tokenizer) if args.chunk_tokenizer else len
+            index_dir(manager, args.index, args.chunk_size, args.chunk_overlap, length)
+            manager.save_snapshot()
+        if not manager.get_chunk_count():
+            sys.exit(f"nothing indexed in {args.persist_dir}, pass --index DATA_DIR")
+        queries = read_queries(args.queries)
+        if not queries:
+            sys.exit(f"no queries in {args.queries}")
+        qrels = read_qrels(args.qrels) if args.qrels else None
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output:
+                report = run(manager, queries, args.k, qrels, output)
+        else:
+            report = run(manager, queries, args.k, qrels)
+        print(json.dumps(report, indent=2))
+    finally:
+        manager.close()
+
+if __name__ == "__main__":
+    main()
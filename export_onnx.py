@@ -0,0 +1,20 @@
+import argparse
+from embeddings import export_onnx
+
+# one-time export of the embedding model for EMBEDDING_BACKEND=onnx / onnx-int8
+#
+#   python export_onnx.py all-MiniLM-L6-v2 models/minilm-onnx
+#   EMBEDDING_BACKEND=onnx-int8 EMBEDDING_MODEL=models/minilm-onnx uvicorn api:api
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="export a sentence-transformers model to onnx runtime")
+    parser.add_argument("model", help="model name or local path, e.g. all-MiniLM-L6-v2")
+    parser.add_argument("output_dir", help="gets model.onnx, model_quantized.onnx and tokenizer.json")
+    parser.add_argument("--no-quantize", action="store_true", help="skip the int8 copy")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args(argv)
+    path = export_onnx(args.model, args.output_dir, quantize=not args.no_quantize, opset=args.opset)
+    print(f"exported {args.model} to {path}")
+
+if __name__ == "__main__":
+    main()
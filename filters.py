@@ -0,0 +1,147 @@
+import os
+from datetime import datetime, timezone
+import numpy as np
+
+# metadata filters for retrieval. every field we filter on belongs to a file (source, file type, modified
+# date), so a filter selects whole sources: SourceIndex keeps the slots of each source and turns a filter
+# into the sorted slots bm25 scores and the chunk ids the vector search is limited to
+
+
+class MetadataFilter:
+    # sources and file types match any of the given values, dates are inclusive ISO 8601 bounds on the
+    # file's modified time ("2024-05-01" or "2024-05-01T12:00:00"). unset fields match everything
+
+    def __init__(self, sources=None, file_types=None, date_from=None, date_to=None):
+        self.sources = frozenset(sources) if sources else None
+        self.file_types = frozenset(_file_type(t) for t in file_types) if file_types else None
+        self.date_from = _check_date(date_from)
+        self.date_to = _check_date(date_to)
+
+    def __bool__(self):
+        return any(v is not None for v in (self.sources, self.file_types, self.date_from, self.date_to))
+
+    def key(self):
+        # hashable and the same for equal filters, part of retrieval and answer cache keys
+        return (tuple(sorted(self.sources)) if self.sources is not None else None,
+                tuple(sorted(self.file_types)) if self.file_types is not None else None,
+                self.date_from, self.date_to)
+
+    def matches(self, source, metadata):
+        if self.sources is not None and source not in self.sources:
+            return False
+        if self.file_types is not None and file_type(source, metadata) not in self.file_types:
+            return False
+        if self.date_from is None and self.date_to is None:
+            return True
+        modified = metadata.get("modified")
+        if modified is None:
+            return False  # indexed before modified dates were recorded
+        if self.date_from is not None and modified < self.date_from:
+            return False
+        # a date without a time covers that whole day
+        return self.date_to is None or modified[:len(self.date_to)] <= self.date_to
+
+
+class Selection:
+    # what a filter resolves to on one snapshot: sorted bm25 slots, their chunk ids and the sources
+    __slots__ = ("slots", "ids", "sources")
+
+    def __init__(self, slots, ids, sources):
+        self.slots = slots
+        self.ids = ids
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class SourceIndex:
+    # source -> set of bm25 slots and source -> its file level metadata (the ChunkRecords' shared dict).
+    # copy() shares the slot sets until the copy first changes one, like BM25Index does with postings
+
+    def __init__(self):
+        self.slots = {}
+        self.metadata = {}
+        self._owned = None  # sources whose slot set this copy may modify, None means all of them
+
+    @classmethod
+    def build(cls, docs):
+        index = cls()
+        for slot, record in enumerate(docs):
+            if record is not None:
+                index.add(slot, record)
+        return index
+
+    def copy(self):
+        other = SourceIndex()
+        other.slots = dict(self.slots)
+        other.metadata = dict(self.metadata)
+        other._owned = set()
+        return other
+
+    def _slots(self, source):
+        slots = self.slots.get(source)
+        if slots is None:
+            slots = self.slots[source] = set()
+        elif self._owned is not None and source not in self._owned:
+            slots = self.slots[source] = set(slots)
+        else:
+            return slots
+        if self._owned is not None:
+            self._owned.add(source)
+        return slots
+
+    def add(self, slot, record):
+        self._slots(record.source).add(slot)
+        self.metadata[record.source] = record.shared
+
+    def remove(self, slot, record):
+        source = record.source
+        slots = self._slots(source)
+        slots.discard(slot)
+        if not slots:
+            del self.slots[source]
+            self.metadata.pop(source, None)
+
+    def replace(self, record):
+        # new metadata for a chunk already in the index, the file's metadata follows its latest chunk
+        self.metadata[record.source] = record.shared
+
+    def select(self, metadata_filter):
+        sources = [s for s, metadata in self.metadata.items() if metadata_filter.matches(s, metadata)]
+        if not sources:
+            return np.empty(0, dtype=np.int64), sources
+        slots = np.concatenate([np.fromiter(self.slots[s], dtype=np.int64, count=len(self.slots[s]))
+                                for s in sources])
+        slots.sort()
+        return slots, sources
+
+
+def file_type(source, metadata):
+    # chunks indexed before file_type was recorded take it from the file name
+    value = metadata.get("file_type")
+    return value if value is not None else _file_type(os.path.splitext(source or "")[1])
+
+
+def _file_type(value):
+    return value.lower().lstrip(".")
+
+
+def modified_time(path):
+    # a file's modified time as stored in chunk metadata, utc without an offset so strings compare in order
+    modified = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).replace(tzinfo=None)
+    return modified.isoformat(timespec="seconds")
+
+
+def _check_date(value):
+    if value is None or value == "":
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid date {value!r}, expected ISO 8601 like 2024-05-01") from None
+    if "T" not in value and " " not in value:
+        return parsed.date().isoformat()
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(timespec="seconds")
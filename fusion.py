@@ -0,0 +1,38 @@
+import numpy as np
+
+FUSION_MODES = ("minmax", "zscore", "rrf")
+
+
+def normalize(scores, mode="minmax", rrf_k=60):
+    # scores are one retriever's candidates, best first
+    scores = np.asarray(scores, dtype=np.float64)
+    if mode == "minmax":
+        spread = scores.max() - scores.min()
+        return (scores - scores.min()) / spread if spread else np.ones_like(scores)
+    if mode == "zscore":
+        std = scores.std()
+        return (scores - scores.mean()) / std if std else np.ones_like(scores)
+    if mode == "rrf":
+        # same as EnsembleRetriever: weight / (rank + c), ranks starting at 1
+        return 1.0 / (rrf_k + np.arange(1, len(scores) + 1))
+    raise ValueError(f"unknown fusion mode {mode!r}, expected one of {FUSION_MODES}")
+
+
+def fuse(results, weights, mode="minmax", k=None, rrf_k=60):
+    # results: one (ids, scores) pair of arrays per retriever. returns the top k ids, their fused
+    # scores and the raw score each retriever gave them (nan where a retriever didn't return it)
+    ids = np.unique(np.concatenate([np.asarray(r[0], dtype=np.int64) for r in results]))
+    fused = np.zeros(len(ids))
+    raw = np.full((len(results), len(ids)), np.nan)
+    for row, ((candidates, scores), weight) in enumerate(zip(results, weights)):
+        if not len(candidates):
+            continue
+        positions = np.searchsorted(ids, candidates)
+        norm = normalize(scores, mode, rrf_k)
+        # a candidate this retriever didn't return gets 0 from it, or its lowest z-score if that is below 0
+        fill = min(norm.min(), 0.0) if mode == "zscore" else 0.0
+        fused += weight * fill
+        fused[positions] += weight * (norm - fill)
+        raw[row, positions] = scores
+    order = np.argsort(-fused, kind="stable")[:k]
+    return ids[order], fused[order], raw[:, order]
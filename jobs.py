@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class QueueFull(Exception):
+    pass
+
+
+_DONE = object()
+
+
+class IngestJob:
+
+    def __init__(self, filename, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"  # queued -> running -> done | failed
+        self.stage = None
+        self.message = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.pages_extracted = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.stage_seconds = {}
+
+    @contextmanager
+    def track(self, stage):
+        previous = self.stage
+        self.stage = stage
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + time.perf_counter() - start
+            self.stage = previous
+
+    def track_iter(self, stage, items):
+        # track() for a stage that streams, only the time spent producing each item counts
+        items = iter(items)
+        while True:
+            with self.track(stage):
+                item = next(items, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "message": self.message,
+            "error": self.error,
+            "pages_extracted": self.pages_extracted,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "stage_seconds": {k: round(v, 4) for k, v in self.stage_seconds.items()},
+            "queued_seconds": round((self.started_at or end) - self.created_at, 4),
+            "total_seconds": round(end - self.created_at, 4),
+        }
+
+
+class IngestQueue:
+    # bounded queue drained by a few worker threads, submit raises QueueFull instead of piling up work
+
+    def __init__(self, handler, workers=2, max_pending=16, max_history=1000):
+        self.handler = handler  # handler(job, *args)
+        self.workers = workers
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self._pending = {}  # key -> queued job, so retried uploads share one job
+        self._running = {}  # key -> running job, one job per key runs at a time
+        self._waiting = {}  # key -> (job, key, args) dequeued while that key's job was still running
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def full(self):
+        return self._queue.full()
+
+    def submit(self, key, *args, filename=None):
+        with self._lock:
+            job = self._pending.get(key)
+            if job is not None and job.status == "queued":
+                return job
+
+            job = IngestJob(filename or str(key))
+            try:
+                self._queue.put_nowait((job, key, args))
+            except queue.Full:
+                raise QueueFull(f"{self._queue.maxsize} ingest jobs already pending")
+            self._pending[key] = job
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_history:
+                self.jobs.popitem(last=False)
+            self._start_workers()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"ingest-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        item = None
+        while True:
+            if item is None:
+                item = self._queue.get()
+                if item is None:
+                    return
+            job, key, args = item
+            with self._lock:
+                if key in self._running:
+                    # the worker running this key's job picks it up when that one is done.
+                    # it stays pending meanwhile, so a retried upload still gets it back
+                    self._waiting[key] = item
+                    item = None
+                    continue
+                if self._pending.get(key) is job:
+                    del self._pending[key]
+                self._running[key] = job
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                self.handler(job, *args)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.stage = None
+                job.finished_at = time.time()
+                with self._lock:
+                    del self._running[key]
+                    item = self._waiting.pop(key, None)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
@@ -0,0 +1,141 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# latency histograms and gauges rendered in the prometheus text format, no client library needed.
+# histograms are in seconds and keyed by one label (the stage), gauges are read when /metrics is scraped
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+
+    def __init__(self, name, description, label="stage", buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self._series = {}  # label value -> (per bucket counts with a final +Inf bucket, [sum])
+
+    def observe(self, value, seconds):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bucket] += 1
+            series[1][0] += seconds
+
+    @contextmanager
+    def time(self, value):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(value, time.perf_counter() - start)
+
+    def count(self, value):
+        with self.lock:
+            series = self._series.get(value)
+            return sum(series[0]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {value: (list(counts), total[0]) for value, (counts, total) in self._series.items()}
+        for value in sorted(series):
+            counts, total = series[value]
+            labels = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{_number(bound)}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {_number(total)}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # read() returns a number, or a dict of label value -> number, None leaves the gauge out
+
+    def __init__(self, name, description, read, label=None):
+        self.name = name
+        self.description = description
+        self.read = read
+        self.label = label
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []  # a gauge that can't be read right now doesn't break the scrape
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge"]
+        if isinstance(value, dict):
+            lines += [f'{self.name}{{{self.label}="{_escape(k)}"}} {_number(v)}'
+                      for k, v in sorted(value.items()) if v is not None]
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def histogram(self, name, description, label="stage", buckets=BUCKETS):
+        return self._register(Histogram(name, description, label, buckets))
+
+    def gauge(self, name, description, read, label=None):
+        # registering a name again replaces the gauge, so a module reload doesn't duplicate it
+        self.metrics[name] = Gauge(name, description, read, label)
+        return self.metrics[name]
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes():
+    # current rss from /proc on linux, None elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+QUERY_SECONDS = REGISTRY.histogram(
+    "rag_query_stage_seconds",
+    "query latency per stage: embed, vector, bm25, fuse, retrieve, pack, llm and total",
+)
+INGEST_SECONDS = REGISTRY.histogram(
+    "rag_ingest_stage_seconds",
+    "ingest latency per stage: extract and file per file, split, embed, vector_write and bm25 per batch",
+)
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens",
+    "estimated prompt context tokens per query: retrieved chunks as returned, and packed as sent to the llm",
+    label="kind", buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
@@ -1,75 +1,669 @@
 import os
-from PyPDF2 import PdfReader
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from PIL import Image
-import pytesseract
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
-import os
+from langchain.schema import Document, BaseRetriever
+from bm25 import BM25Index, BM25IndexRetriever
+from embeddings import EMBEDDING_BACKENDS, EmbeddingPipeline, LazyEmbeddings, get_embeddings
+from cache import LRUCache, CachedQueryEmbeddings, make_cache, normalize_query
+from fusion import FUSION_MODES, fuse
+from vectors import make_vector_index
+from chunkstore import ChunkStore
+from chunker import iter_spans
+from filters import Selection, SourceIndex, file_type, modified_time
+from metrics import QUERY_SECONDS, INGEST_SECONDS
+import asyncio
+import hashlib
+import itertools
+import pickle
 import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+import numpy as np
+
+# chroma, torch, PyPDF2 and pytesseract are imported where they are first needed, so importing
+# this module (and api) stays fast and the embedding model loads on the first embed
+QUERY_BLOCK = 64  # queries scored together by search_batch, bounds its (queries x chunks) score matrix
+# filters keeping at most this fraction of the chunks are pushed down into the vector search, larger ones
+# query the whole index and drop the rest, over-fetching until enough are left
+FILTER_PUSHDOWN = 0.5
+
+class IndexSnapshot:
+    # one consistent view of the index: the bm25 index, whose documents are ChunkRecords, chroma id -> bm25 slot
+    # and source -> bm25 slots for metadata filters. a published snapshot is never modified, writers change a
+    # copy() and the manager swaps it in
+
+    def __init__(self, bm25_index=None, slots=None, fingerprint=0, sources=None):
+        self.bm25_index = bm25_index if bm25_index is not None else BM25Index()
+        self.slots = slots if slots is not None else {}
+        self.fingerprint = fingerprint  # xor of chunk hashes, see version
+        self.sources = sources if sources is not None else SourceIndex.build(self.bm25_index.docs)
+        self.chunks = []
+        self._selections = {}  # filter key -> Selection, filters are resolved once per snapshot
+
+    def copy(self):
+        return IndexSnapshot(self.bm25_index.copy(), dict(self.slots), self.fingerprint, self.sources.copy())
+
+    @property
+    def version(self):
+        # changes whenever a chunk is added or removed or its file's metadata changes (a re-upload with a new
+        # modified time), and is the same for the same chunks, so keys built on it also stay valid across
+        # restarts for on-disk caches
+        return f"{len(self.slots)}-{self.fingerprint:016x}"
+
+    def get(self, chunk_id):
+        slot = self.slots.get(chunk_id)
+        return None if slot is None else self.bm25_index.docs[slot]
+
+    def add(self, chunks):
+        for chunk, slot in zip(chunks, self.bm25_index.add_documents(chunks)):
+            self.slots[chunk.id] = slot
+            self.sources.add(slot, chunk)
+            self.fingerprint ^= _chunk_hash(chunk)
+
+    def remove(self, ids):
+        slots = [self.slots.pop(i) for i in ids]
+        for slot in slots:
+            record = self.bm25_index.docs[slot]
+            self.sources.remove(slot, record)
+            self.fingerprint ^= _chunk_hash(record)
+        self.bm25_index.remove(slots)
+
+    def replace(self, chunk):
+        slot = self.slots[chunk.id]
+        self.fingerprint ^= _chunk_hash(self.bm25_index.docs[slot]) ^ _chunk_hash(chunk)
+        self.bm25_index.replace(slot, chunk)
+        self.sources.replace(chunk)
+
+    def select(self, metadata_filter):
+        # the chunks a MetadataFilter keeps, as sorted bm25 slots plus their ids and sources
+        key = metadata_filter.key()
+        selection = self._selections.get(key)
+        if selection is None:
+            slots, sources = self.sources.select(metadata_filter)
+            docs = self.bm25_index.docs
+            selection = Selection(slots, frozenset(docs[slot].id for slot in slots.tolist()), sources)
+            if len(self._selections) >= 64:
+                self._selections.clear()
+            self._selections[key] = selection
+        return selection
+
 
 class HybridRetrieverManager:
     
-    def __init__(self, persist_dir="./chroma_db", k=3, bm25_weight=0.5, semantic_weight=0.5):
+    def __init__(self, persist_dir="./chroma_db", k=3, bm25_weight=0.5, semantic_weight=0.5,
+                 embeddings=None, warm_start=True, embedding_model="all-MiniLM-L6-v2",
+                 embed_batch_size=64, embed_workers=0, query_cache_size=1024, query_cache_ttl=None,
+                 retrieval_cache_size=256, retrieval_cache_ttl=None, retrieval_cache_path=None,
+                 fusion="minmax", candidates=20, vector_backend="chroma", vector_dtype="float32",
+                 compaction_threshold=0.25, embedding_backend="torch"):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"unknown fusion mode {fusion!r}, expected one of {FUSION_MODES}")
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"unknown embedding backend {embedding_backend!r}, expected one of {EMBEDDING_BACKENDS}")
         self.persist_dir = persist_dir
         self.k = k
         self.bm25_weight = bm25_weight
         self.semantic_weight = semantic_weight
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        
-        if os.path.exists(persist_dir) and os.listdir(persist_dir):
-            self.vectordb = Chroma(
-                persist_directory=persist_dir,
-                embedding_function=self.embeddings
-            )
-        else:
-            self.vectordb = Chroma(
-                persist_directory=persist_dir,
-                embedding_function=self.embeddings
-            )
-        
-        self.all_chunks = []
-        self.bm25_retriever = None
-        self.ensemble_retriever = None
+        self.fusion = fusion
+        self.candidates = candidates  # taken from each retriever before fusing down to k
+        self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+        # removed chunks leave dead bm25 slots behind, past this fraction of all slots a background
+        # compaction renumbers the index
+        self.compaction_threshold = compaction_threshold
+        self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compact")
+        self._compaction = None
+        self.embedding_model = embedding_model
+        self.embedding_backend = embedding_backend
+        self.vector_backend = vector_backend
+        self.vector_dtype = vector_dtype
+        # managers without their own embeddings share the process-wide model, loaded on first use
+        # embedding_backend "onnx" / "onnx-int8" takes embedding_model as the directory export_onnx() wrote
+        self.embeddings = embeddings or LazyEmbeddings(embedding_model, embedding_backend)
+        # embed_workers > 0 encodes in that many processes, each with its own copy of embedding_model
+        self.embedder = EmbeddingPipeline(self.embeddings, embedding_model, embed_batch_size, embed_workers,
+                                          embedding_backend)
+        self.lock = threading.RLock()  # serializes writers, readers only ever look at a published snapshot
+        self.snapshot_path = os.path.join(persist_dir, "bm25_snapshot.pkl")
+        # repeated questions skip the model, the vector store embeds queries through this wrapper
+        self.query_cache = LRUCache(query_cache_size, query_cache_ttl)
+        self.query_embeddings = CachedQueryEmbeddings(self.embeddings, self.query_cache)
+        # ranked chunks per (query, k, weights, corpus version), kept apart from app's answer cache
+        self.retrieval_cache = make_cache(retrieval_cache_size, retrieval_cache_ttl, retrieval_cache_path)
+
+        has_data = os.path.exists(persist_dir) and bool(os.listdir(persist_dir))
+        self.vectordb = _open_chroma(persist_dir, self.query_embeddings)
+        # chroma keeps documents and metadata, nearest neighbour queries go to this index
+        self.vector_index = make_vector_index(vector_backend, persist_dir, self.vectordb._collection, vector_dtype)
+
+        # the retriever handed to chains never changes, it reads whichever snapshot is current per query
+        self.retriever = CachedRetriever(manager=self)
+        self._publish(IndexSnapshot())
+
+        # chunk texts live in one file next to chroma, the index only holds small records pointing into it
+        self.store = None
+        if has_data and warm_start:
+            self._hydrate()
+        if self.store is None:
+            self._open_store()
+
+    @property
+    def all_chunks(self):
+        return self._snapshot.chunks
+
+    @property
+    def bm25_index(self):
+        return self._snapshot.bm25_index
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _publish(self, snapshot):
+        snapshot.chunks = [d for d in snapshot.bm25_index.docs if d is not None]
+        self._snapshot = snapshot  # a single reference swap, queries see the old or the new snapshot
     
-    def add_documents(self, new_chunks):
-        if not new_chunks:
+    def _open_store(self, filename=None):
+        self.store = ChunkStore(self.persist_dir, filename)
+        self.store.remove_stale_files()
+
+    def _hydrate(self):
+        # rebuild the index from what is already persisted instead of re-embedding
+        ids = self.vectordb.get(include=[])["ids"]
+        if not ids:
             return
-        
-        self.vectordb.add_documents(new_chunks)
 
-        self.all_chunks.extend(new_chunks)
-        self.bm25_retriever = BM25Retriever.from_documents(self.all_chunks)
-        self.bm25_retriever.k = self.k
+        loaded = self._load_snapshot()
+        if (loaded is not None and set(loaded["ids"]) == set(ids) and "text_file" in loaded
+                and os.path.exists(os.path.join(self.persist_dir, loaded["text_file"]))):
+            index = loaded["index"]
+            self._open_store(loaded["text_file"])
+            # bind also counts the text of chunks removed before the restart as dead, for compaction
+            self.store.bind(r for r in index.docs if r is not None)
+            snapshot = IndexSnapshot(index, {r.id: slot for slot, r in enumerate(index.docs) if r is not None})
+            for record in snapshot.bm25_index.docs:
+                if record is not None:
+                    snapshot.fingerprint ^= _chunk_hash(record)
+        else:
+            stored = self.vectordb.get(include=["documents", "metadatas"])
+            self._open_store()
+            snapshot = IndexSnapshot()
+            snapshot.add(self.store.add([
+                Document(page_content=text, metadata=meta or {}, id=chunk_id)
+                for chunk_id, text, meta in zip(stored["ids"], stored["documents"], stored["metadatas"])
+            ]))
+        if not self.vector_index.load(ids):
+            stored = self.vectordb.get(include=["embeddings"])
+            self.vector_index.add(stored["ids"], stored["embeddings"])
+        self._publish(snapshot)
 
-        self._rebuild_ensemble()
-    
-    def _rebuild_ensemble(self):
-        semantic_retriever = self.vectordb.as_retriever(search_kwargs={"k": self.k})
-        self.ensemble_retriever = EnsembleRetriever(
-            retrievers=[self.bm25_retriever, semantic_retriever],
-            weights=[self.bm25_weight, self.semantic_weight]
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"ignoring unreadable bm25 snapshot: {e}")
+            return None
+
+    def save_snapshot(self):
+        with self.lock:
+            snapshot = self._snapshot
+            if not snapshot.slots:
+                return
+            state = {"ids": list(snapshot.slots), "index": snapshot.bm25_index, "text_file": self.store.filename}
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+            self.vector_index.save()
+
+    def add_documents(self, new_chunks, progress=None):
+        with self.lock:
+            return self._apply(new_chunks=new_chunks, progress=progress)[0]
+
+    def remove_ids(self, ids):
+        with self.lock:
+            return self._apply(remove_ids=ids)[1]
+
+    def remove_source(self, source):
+        # the source's slots come from the snapshot's SourceIndex, no scan over every chunk
+        with self.lock:
+            snapshot = self._snapshot
+            docs = snapshot.bm25_index.docs
+            return self.remove_ids([docs[slot].id for slot in sorted(snapshot.sources.slots.get(source, ()))])
+
+    def replace_source(self, source, new_chunks, progress=None):
+        # re-upload of a file: drop chunks that no longer exist, embed only new ones,
+        # unchanged chunks keep their vectors and just pick up the new metadata
+        return self.replace_source_stream(source, [new_chunks], progress)
+
+    def replace_source_stream(self, source, batches, progress=None):
+        # replace_source for chunks arriving in batches while the file is still being extracted.
+        # each batch is searchable once embedded, stale chunks go together with the last batch
+        added = removed = 0
+        kept = set()
+        batches = iter(batches)
+        batch = next(batches, [])
+        while batch is not None:
+            following = next(batches, None)
+            with self.lock:
+                assign_chunk_ids(batch)
+                kept.update(c.id for c in batch)
+                current = self._snapshot
+                updated = []
+                for chunk in batch:
+                    record = current.get(chunk.id)
+                    if record is not None and record.metadata != chunk.metadata:
+                        updated.append(self.store.with_metadata(record, chunk.metadata))
+                stale = [] if following is not None else [
+                    c.id for c in self.all_chunks if c.source == source and c.id not in kept
+                ]
+                batch_added, batch_removed = self._apply(batch, stale, updated, progress)
+            added += batch_added
+            removed += batch_removed
+            batch = following
+        return added, removed
+
+    def _apply(self, new_chunks=(), remove_ids=(), updated=(), progress=None):
+        # ids are derived from source, position and content, so already indexed chunks are skipped
+        current = self._snapshot
+        assign_chunk_ids(new_chunks)
+        fresh, seen = [], set()
+        for chunk in new_chunks:
+            if chunk.id in current.slots or chunk.id in seen:
+                continue
+            seen.add(chunk.id)
+            fresh.append(chunk)
+        remove_ids = [i for i in dict.fromkeys(remove_ids) if i in current.slots]
+        if not fresh and not remove_ids and not updated:
+            return 0, 0
+
+        # new vectors and metadata go in before the swap, the current snapshot ignores ids it doesn't know
+        # and maps the ones it does to its own documents
+        if fresh:
+            self.embedder.run(fresh, self._write_vectors, progress)
+        if updated:
+            self.vectordb._collection.update(ids=[c.id for c in updated], metadatas=[c.metadata for c in updated])
+
+        start = time.perf_counter()
+        draft = current.copy()
+        self.store.release([current.get(i) for i in remove_ids])
+        draft.remove(remove_ids)
+        for record in updated:
+            draft.replace(record)
+        draft.add(self.store.add(fresh))
+        self._publish(draft)
+        _record(None, "bm25", start, INGEST_SECONDS)
+
+        # stale vectors only go once no new query can ask for them
+        if remove_ids:
+            self.vectordb.delete(ids=remove_ids)
+            self.vector_index.delete(remove_ids)
+            if self.needs_compaction() and (self._compaction is None or self._compaction.done()):
+                self._compaction = self._compactor.submit(self.compact)
+        return len(fresh), len(remove_ids)
+
+    def needs_compaction(self):
+        index = self._snapshot.bm25_index
+        return index.dead_count > self.compaction_threshold * len(index.docs) or self.store.needs_compaction()
+
+    def compact(self):
+        # rebuilds the bm25 index without dead slots and rewrites the chunk texts once enough of them
+        # are dead. the result is published like any other write, queries on the old snapshot are unaffected
+        with self.lock:
+            current = self._snapshot
+            index = current.bm25_index.compact()
+            if self.store.needs_compaction():
+                index.docs = self.store.compact(index.docs)
+            self._publish(IndexSnapshot(index, {r.id: slot for slot, r in enumerate(index.docs)}, current.fingerprint))
+
+    def _write_vectors(self, chunks, vectors):
+        start = time.perf_counter()
+        self.vectordb._collection.upsert(
+            ids=[c.id for c in chunks],
+            embeddings=vectors,
+            documents=[c.page_content for c in chunks],
+            metadatas=[c.metadata for c in chunks],
         )
+        self.vector_index.add([c.id for c in chunks], vectors)
+        _record(None, "vector_write", start, INGEST_SECONDS)
+
+    def source_counts(self):
+        return {source: len(slots) for source, slots in self._snapshot.sources.slots.items()}
+
+    def source_metadata(self):
+        # source -> the file level metadata filters match on (file_type, modified, file_hash)
+        return dict(self._snapshot.sources.metadata)
+
+    def source_hashes(self):
+        return {source: metadata.get("file_hash") for source, metadata in self._snapshot.sources.metadata.items()}
+
+    def index_stats(self):
+        # sizes for the /metrics gauges. vector_bytes is None for chroma, its hnsw index isn't ours to measure
+        snapshot = self._snapshot
+        return {
+            "chunks": len(snapshot.chunks),
+            "vocabulary": len(snapshot.bm25_index.postings),
+            "vectors": len(self.vector_index),
+            "chunk_text_bytes": self.store.buffer.size,
+            "vector_bytes": getattr(self.vector_index, "nbytes", None),
+        }
+
+    def get_retriever(self, filters=None):
+        # a MetadataFilter gets its own retriever, the shared one searches everything
+        return self.retriever if not filters else CachedRetriever(manager=self, filters=filters)
+
+    def search(self, query, k=None, snapshot=None, with_scores=False, timings=None, filters=None):
+        # bm25 and chroma run side by side, each returns a candidate pool that is fused
+        # into one ranking on normalized scores. a timings dict gets milliseconds per stage
+        # (embed, vector, bm25, fuse). filters (a MetadataFilter) limits both sides to the chunks it keeps
+        snapshot = snapshot or self._snapshot
+        k = k or self.k
+        n = max(self.candidates, k)
+        selection = snapshot.select(filters) if filters else None
+        if selection is not None and not len(selection):
+            return []
+        semantic = self._search_pool.submit(self._semantic_scores, snapshot, query, n, None, timings, selection)
+        start = time.perf_counter()
+        bm25 = snapshot.bm25_index.top_scores(query, n, None if selection is None else selection.slots)
+        _record(timings, "bm25", start)
+        semantic = semantic.result()
+        start = time.perf_counter()
+        results = self._fuse(snapshot, bm25, semantic, k, with_scores)
+        _record(timings, "fuse", start)
+        return results
+
+    def search_batch(self, queries, k=None, snapshot=None, with_scores=False, filters=None):
+        # search() for many queries against one snapshot: the queries are embedded in one call and
+        # each block of them is scored by bm25 in one pass and sent to the vector index together
+        snapshot = snapshot or self._snapshot
+        k = k or self.k
+        n = max(self.candidates, k)
+        selection = snapshot.select(filters) if filters else None
+        if selection is not None and not len(selection):
+            return [[] for _ in queries]
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK):
+            block = queries[start:start + QUERY_BLOCK]
+            semantic = self._search_pool.submit(self._semantic_scores_many, snapshot, block, n, selection)
+            bm25 = snapshot.bm25_index.top_scores_many(block, n, None if selection is None else selection.slots)
+            for bm25_hits, semantic_hits in zip(bm25, semantic.result()):
+                results.append(self._fuse(snapshot, bm25_hits, semantic_hits, k, with_scores))
+        return results
+
+    def retrieve_batch(self, queries, filters=None, snapshot=None):
+        # search_batch through the retrieval cache, only the misses are searched
+        snapshot = snapshot or self._snapshot
+        keys = [self.retrieval_key(query, snapshot, filters) for query in queries]
+        results = [self.retrieval_cache.get(key) for key in keys]
+        misses = [i for i, docs in enumerate(results) if docs is None]
+        for i, docs in zip(misses, self.search_batch([queries[i] for i in misses], snapshot=snapshot,
+                                                     filters=filters)):
+            self.retrieval_cache.put(keys[i], docs)
+            results[i] = docs
+        return [list(docs) for docs in results]
+
+    def _fuse(self, snapshot, bm25, semantic, k, with_scores):
+        slots, fused, raw = fuse([bm25, semantic], [self.bm25_weight, self.semantic_weight], self.fusion, k)
+        # only the k results are turned into Documents
+        docs = [snapshot.bm25_index.docs[slot].to_document() for slot in slots]
+        if not with_scores:
+            return docs
+        return [
+            (doc, {"fused": float(score), "bm25": _score(bm25_score), "semantic": _score(semantic_score)})
+            for doc, score, bm25_score, semantic_score in zip(docs, fused, raw[0], raw[1])
+        ]
 
-    def get_retriever(self):
-        return self.ensemble_retriever
+    async def asearch(self, query, k=None, snapshot=None, with_scores=False, filters=None):
+        return await asyncio.to_thread(self.search, query, k, snapshot, with_scores, None, filters)
+
+    def _semantic_scores_many(self, snapshot, queries, n, selection=None):
+        if not snapshot.slots:
+            return [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in queries]
+        vectors = self.query_embeddings.embed_queries(queries)
+        allowed, where = self._allowed(snapshot, selection)
+        results = []
+        for query, vector, (ids, distances) in zip(queries, vectors, self.vector_index.query_many(vectors, n, where)):
+            hits = [(snapshot.slots[i], -d) for i, d in zip(ids, distances) if i in allowed]
+            if len(hits) < n and len(ids) == n:
+                # needs the over-fetch
+                results.append(self._semantic_scores(snapshot, query, n, vector, None, selection))
+            else:
+                results.append((np.array([h[0] for h in hits], dtype=np.int64), np.array([h[1] for h in hits])))
+        return results
+
+    def _semantic_scores(self, snapshot, query, n, vector=None, timings=None, selection=None):
+        # nearest ids restricted to the snapshot (and a filter's selection), scored as negative squared l2 distance
+        if not snapshot.slots:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if vector is None:
+            start = time.perf_counter()
+            vector = self.query_embeddings.embed_query(query)
+            _record(timings, "embed", start)
+        start = time.perf_counter()
+        allowed, where = self._allowed(snapshot, selection)
+        fetch = n
+        while True:
+            ids, distances = self.vector_index.query(vector, fetch, where)
+            hits = [(snapshot.slots[i], -d) for i, d in zip(ids, distances) if i in allowed]
+            # over-fetch when chroma returns chunks written for a newer snapshot or a filter wasn't pushed down
+            if len(hits) >= n or len(ids) < fetch:
+                break
+            fetch *= 2
+        hits = hits[:n]
+        _record(timings, "vector", start)
+        return np.array([h[0] for h in hits], dtype=np.int64), np.array([h[1] for h in hits])
+
+    @staticmethod
+    def _allowed(snapshot, selection):
+        # the ids semantic hits may come from, and the selection to push into the vector index if it's small
+        if selection is None:
+            return snapshot.slots, None
+        return selection.ids, selection if len(selection) <= FILTER_PUSHDOWN * len(snapshot.slots) else None
+
+    def corpus_version(self):
+        return self._snapshot.version
+
+    def retrieval_key(self, query, snapshot=None, filters=None):
+        version = (snapshot or self._snapshot).version
+        key = (normalize_query(query), self.k, self.bm25_weight, self.semantic_weight,
+               self.fusion, self.candidates, version)
+        return key + (filters.key(),) if filters else key
+
+    def cache_stats(self):
+        return {"query_embedding": self.query_cache.stats(), "retrieval": self.retrieval_cache.stats()}
+
+    def close(self):
+        self.embedder.shutdown()
+        self._search_pool.shutdown()
+        self._compactor.shutdown()
+        self.store.close()
 
     def get_chunk_count(self):
         return len(self.all_chunks)
     
     def clear(self):
-        self.all_chunks = []
-        self.bm25_retriever = None
-        self.ensemble_retriever = None
-        if os.path.exists(self.persist_dir):
-            shutil.rmtree(self.persist_dir)
-        self.vectordb = Chroma(
-            persist_directory=self.persist_dir,
-            embedding_function=self.embeddings
-        )
+        with self.lock:
+            if os.path.exists(self.persist_dir):
+                shutil.rmtree(self.persist_dir)
+            self.vectordb = _open_chroma(self.persist_dir, self.query_embeddings)
+            self.vector_index = make_vector_index(
+                self.vector_backend, self.persist_dir, self.vectordb._collection, self.vector_dtype
+            )
+            self._open_store()
+            self._publish(IndexSnapshot())
+
+class CachedRetriever(BaseRetriever):
+    # stable facade over the manager's current snapshot, each query pins one snapshot start to finish
+    manager: Any
+    filters: Any = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        snapshot = self.manager.snapshot()
+        key = self.manager.retrieval_key(query, snapshot, self.filters)
+        docs = self.manager.retrieval_cache.get(key)
+        if docs is None:
+            docs = self.manager.search(query, snapshot=snapshot, filters=self.filters)
+            self.manager.retrieval_cache.put(key, docs)
+        return list(docs)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        snapshot = self.manager.snapshot()
+        key = self.manager.retrieval_key(query, snapshot, self.filters)
+        docs = self.manager.retrieval_cache.get(key)
+        if docs is None:
+            docs = await self.manager.asearch(query, snapshot=snapshot, filters=self.filters)
+            self.manager.retrieval_cache.put(key, docs)
+        return list(docs)
+
+def _record(timings, stage, start, histogram=QUERY_SECONDS):
+    # every stage lands in its /metrics histogram, and in timings as milliseconds when one is passed
+    seconds = time.perf_counter() - start
+    histogram.observe(stage, seconds)
+    if timings is not None:
+        timings[f"{stage}_ms"] = seconds * 1000
+
+def _open_chroma(persist_dir, embedding_function):
+    from langchain_community.vectorstores import Chroma
+    return Chroma(persist_directory=persist_dir, embedding_function=embedding_function)
+
+def _score(value):
+    return None if np.isnan(value) else float(value)
+
+def _chunk_hash(record):
+    # the chunk id with its file's metadata, chunk_index and start_index already follow from the id
+    key = f"{record.id}\0{sorted(record.shared.items())!r}"
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:16], 16)
+
+def extract_pdf(path):
+    return extract_pdf_pages(path, 0, pdf_page_count(path))
+
+def pdf_page_count(path):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(path).pages)
+
+def extract_pdf_pages(path, start, stop):
+    # pages [start, stop), runs in extract pool workers so each opens its own reader
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def extract_image(path):
+    return "".join(extract_image_frames(path, 0, image_frame_count(path)))
+
+def image_frame_count(path):
+    from PIL import Image
+    with Image.open(path) as image:
+        return getattr(image, "n_frames", 1)
+
+def extract_image_frames(path, start, stop):
+    import pytesseract
+    from PIL import Image
+    texts = []
+    with Image.open(path) as image:
+        for i in range(start, stop):
+            image.seek(i)
+            texts.append(pytesseract.image_to_string(image))
+    return texts
+
+def extract_text(path):
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+def read_text_blocks(path, block_chars=1 << 20):
+    # extract_text a block at a time, so a large text file is chunked without holding all of it
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        yield from iter(lambda: f.read(block_chars), "")
+
+# file extension -> function(path) returning the extracted text, or a list with one string per page
+EXTRACTORS = {
+    ".pdf": extract_pdf,
+    ".png": extract_image,
+    ".jpg": extract_image,
+    ".jpeg": extract_image,
+    ".txt": extract_text,
+}
+
+# file extension -> (pages per task, count(path), extract(path, start, stop) returning a list of page texts),
+# used by iter_pages to spread one file over the extract pool
+PAGED_EXTRACTORS = {
+    ".pdf": (8, pdf_page_count, extract_pdf_pages),
+    ".png": (1, image_frame_count, extract_image_frames),
+    ".jpg": (1, image_frame_count, extract_image_frames),
+    ".jpeg": (1, image_frame_count, extract_image_frames),
+}
+
+def register_extractor(extensions, extractor):
+    if isinstance(extensions, str):
+        extensions = [extensions]
+    for ext in extensions:
+        EXTRACTORS[ext.lower()] = extractor
+        PAGED_EXTRACTORS.pop(ext.lower(), None)
+
+def iter_pages(path, pool=None, lookahead=8):
+    # yields page texts in order as they are extracted. paged formats are split into page ranges
+    # that run on the pool, at most `lookahead` ranges ahead of the consumer so memory stays bounded
+    ext = os.path.splitext(path)[1].lower()
+    paged = PAGED_EXTRACTORS.get(ext)
+    if paged is None:
+        extractor = EXTRACTORS.get(ext)
+        if extractor is None:
+            return
+        if extractor is extract_text:
+            yield from read_text_blocks(path)
+            return
+        pages = extractor(path) if pool is None else pool.submit(extractor, path).result()
+        yield from [pages] if isinstance(pages, str) else pages
+        return
+
+    per_task, count, extract = paged
+    total = count(path)
+    ranges = [(start, min(start + per_task, total)) for start in range(0, total, per_task)]
+    if pool is None:
+        for start, stop in ranges:
+            yield from extract(path, start, stop)
+        return
+
+    in_flight = deque()
+    try:
+        for start, stop in ranges:
+            in_flight.append(pool.submit(extract, path, start, stop))
+            if len(in_flight) >= lookahead:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+def load_file(path):
+    extractor = EXTRACTORS.get(os.path.splitext(path)[1].lower())
+    if extractor is None:
+        return None
+    pages = extractor(path)
+    if isinstance(pages, str):
+        pages = [pages]
+    text = "".join(pages)
+    if not text.strip():
+        return None
+    return Document(
+        page_content=text,
+        metadata={"source": os.path.basename(path), "file_hash": file_hash(path), "pages": len(pages)}
+    )
+
+def file_metadata(path):
+    # metadata every chunk of a file carries. file_type and modified are what retrieval filters on
+    source = os.path.basename(path)
+    return {"source": source, "file_hash": file_hash(path), "file_type": file_type(source, {}),
+            "modified": modified_time(path)}
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 def load_files(data_dir="data"):
     docs = []
@@ -77,31 +671,120 @@ def load_files(data_dir="data"):
         path = os.path.join(data_dir, fname)
         if not os.path.isfile(path):
             continue
-        text = ""
-        if fname.lower().endswith(".pdf"):
-            reader = PdfReader(path)
-            text = "".join([p.extract_text() or "" for p in reader.pages])
-        elif fname.lower().endswith(('.png', '.jpg', '.jpeg')):
-            image = Image.open(path)
-            text = pytesseract.image_to_string(image)
-        elif fname.lower().endswith('.txt'):
-            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                text = f.read()
-        if text.strip():
-            docs.append(Document(page_content=text, metadata={"source": fname}))
+        doc = load_file(path)
+        if doc is not None:
+            docs.append(doc)
     return docs
 
-def chunk_files(docs, chunk_size=800, chunk_overlap=100):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    return splitter.split_documents(docs)
+def chunk_files(docs, chunk_size=800, chunk_overlap=100, length_function=len):
+    chunks = []
+    for doc in docs:
+        for batch in iter_chunks([doc.page_content], doc.metadata, chunk_size, chunk_overlap,
+                                 length_function=length_function):
+            chunks += batch
+    return chunks
+
+def iter_chunks(pages, metadata, chunk_size=800, chunk_overlap=100, batch_chars=64000, length_function=len):
+    # splits text while pages are still arriving and yields batches of about batch_chars characters of
+    # chunks, each with its chunk_index and start_index (character offset in the file). chunker.iter_spans
+    # holds back the text the last chunks can still change with, so chunks overlap across pages and
+    # batches like they do within one
+    waited = [0.0]  # time spent extracting pages, which are pulled through the splitter
+
+    def pulled():
+        pages_iter = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(pages_iter, None)
+            waited[0] += time.perf_counter() - start
+            if page is None:
+                return
+            yield page
+
+    spans = iter_spans(pulled(), chunk_size, chunk_overlap, length=length_function, window=batch_chars)
+    batch = []
+    size = 0
+    position = 0
+    split = 0.0
+    while True:
+        start = time.perf_counter()
+        waited[0] = 0.0
+        span = next(spans, None)
+        split += time.perf_counter() - start - waited[0]
+        if span is None:
+            break
+        offset, _, text = span
+        batch.append(Document(page_content=text, metadata=dict(metadata, chunk_index=position, start_index=offset)))
+        position += 1
+        size += len(text)
+        if size >= batch_chars:
+            INGEST_SECONDS.observe("split", split)
+            yield assign_chunk_ids(batch)
+            batch, size, split = [], 0, 0.0
+    if batch:
+        INGEST_SECONDS.observe("split", split)
+        yield assign_chunk_ids(batch)
+
+def index_batches(manager, path, batches, progress=None):
+    # replace_source_stream for the chunk batches of one file. no text coming out of it (an emptied
+    # re-upload, a scan ocr reads nothing in) removes the file's old chunks: (0, removed)
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        return 0, manager.remove_source(os.path.basename(path))
+    return manager.replace_source_stream(os.path.basename(path), itertools.chain([first], batches), progress)
+
+def sync_dir(manager, data_dir, ingest):
+    # brings the index in line with data_dir: sources whose file is gone are removed and ingest(path) runs
+    # for files that are new or changed since they were indexed, a file that fails to ingest is removed too.
+    # dotfiles are uploads being written or waiting for their job (api.upload). returns the names ingested
+    indexed = manager.source_hashes()
+    files = sorted(f for f in os.listdir(data_dir)
+                   if os.path.isfile(os.path.join(data_dir, f)) and not f.startswith("."))
+    for source in indexed:
+        if source not in files:
+            manager.remove_source(source)
+    ingested = []
+    for fname in files:
+        path = os.path.join(data_dir, fname)
+        if indexed.get(fname) == file_hash(path):
+            continue
+        try:
+            ingest(path)
+        except ValueError:
+            manager.remove_source(fname)
+            continue
+        ingested.append(fname)
+    return ingested
+
+def chunk_id(source, position, text):
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return f"{source}:{position}:{content_hash}"
+
+def assign_chunk_ids(chunks):
+    # position is the chunk's index within its source, chunks that already have an id keep it
+    positions = {}
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        position = chunk.metadata.get("chunk_index")
+        if position is None:
+            position = positions.get(source, 0)
+            chunk.metadata["chunk_index"] = position
+        positions[source] = position + 1
+        if chunk.id is None:
+            chunk.id = chunk_id(source, position, chunk.page_content)
+    return chunks
 
 def hybrid_retriever(chunks, persist_dir="./chroma_db", bm25_weight=0.5, semantic_weight=0.5, k=3):
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    from langchain.retrievers import EnsembleRetriever
+    from langchain_community.vectorstores import Chroma
+    embeddings = get_embeddings("all-MiniLM-L6-v2")
     vectordb = Chroma.from_documents(chunks, embedding=embeddings, persist_directory=persist_dir)
     semantic_retriever = vectordb.as_retriever(search_kwargs={"k": k})
 
-    bm25_retriever = BM25Retriever.from_documents(chunks)
-    bm25_retriever.k = k
+    bm25_index = BM25Index()
+    bm25_index.add_documents(chunks)
+    bm25_retriever = BM25IndexRetriever(index=bm25_index, k=k)
 
     ensemble_retriever = EnsembleRetriever(
         retrievers=[bm25_retriever, semantic_retriever],
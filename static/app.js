@@ -15,6 +15,39 @@ async function uploadFile() {
   }</div>`
   messages.appendChild(notification)
   scrollToBottom()
+
+  if (data.job_id) {
+    await pollJob(data.job_id, notification.querySelector(".notification-message"))
+  }
+}
+
+async function pollJob(jobId, target) {
+  while (true) {
+    await new Promise((resolve) => setTimeout(resolve, 500))
+    const res = await fetch(`/api/jobs/${jobId}`)
+    if (!res.ok) {
+      // unknown job (e.g. the server restarted), it will never finish
+      const body = await res.json().catch(() => ({}))
+      target.textContent = `upload status unavailable: ${body.error || res.statusText}`
+      return
+    }
+    const job = await res.json()
+
+    if (job.status === "done") {
+      target.textContent = job.message
+      return
+    }
+    if (job.status === "failed" || job.error) {
+      target.textContent = `${job.filename || "upload"} failed: ${job.error}`
+      return
+    }
+    target.textContent =
+      job.status === "queued"
+        ? `${job.filename} waiting to be indexed...`
+        : `${job.filename}: ${job.stage || "starting"} (${job.pages_extracted} pages, ${
+            job.chunks_embedded
+          }/${job.chunks_total} chunks embedded)`
+  }
 }
 
 async function sendQuery() {
@@ -47,34 +80,76 @@ async function sendQuery() {
   messages.appendChild(loadingContainer)
   scrollToBottom()
 
-  const res = await fetch("/api/query", {
+  const botMsg = document.createElement("div")
+  botMsg.className = "bot"
+  botMsg.innerHTML = `<div class="bot-message"></div>`
+  const target = botMsg.querySelector(".bot-message")
+  let answer = ""
+
+  // answer tokens arrive as server-sent events, the message is re-rendered as they come in
+  try {
+    await streamQuery(query, (event, data) => {
+      if (event === "token") {
+        if (!answer) {
+          loadingContainer.remove()
+          messages.appendChild(botMsg)
+        }
+        answer += data
+        target.innerHTML = formatAnswer(answer)
+        scrollToBottom()
+      } else if (event === "error") {
+        answer = answer || data.error
+        target.innerHTML = formatAnswer(answer)
+      }
+    })
+  } catch (err) {
+    answer = answer || err.message
+    target.innerHTML = formatAnswer(answer)
+  }
+  loadingContainer.remove()
+  if (!botMsg.parentNode) messages.appendChild(botMsg)
+  scrollToBottom()
+
+  queryInput.disabled = false
+  sendBtn.disabled = false
+  queryInput.focus()
+}
+
+async function streamQuery(query, onEvent) {
+  const res = await fetch("/api/query/stream", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ query }),
   })
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader()
+  let buffer = ""
+
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) return
+    buffer += value
+    let end
+    while ((end = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, end)
+      buffer = buffer.slice(end + 2)
+      let event = "message"
+      let data = ""
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7)
+        else if (line.startsWith("data: ")) data += line.slice(6)
+      }
+      onEvent(event, JSON.parse(data))
+    }
+  }
+}
 
-  const data = await res.json()
-
-  loadingContainer.remove()
-
-  let answer = data.answer || data.error
-
-  answer = answer
+function formatAnswer(answer) {
+  return escapeHtml(answer)
     .replace(/\*\*\*([\s\S]+?)\*\*\*/g, "<strong><em>$1</em></strong>")
     .replace(/\*\*([\s\S]+?)\*\*/g, "<strong>$1</strong>")
     .replace(/\n\* /g, "\n• ")
     .replace(/\n(\d+)\. /g, "\n$1. ")
     .replace(/\n/g, "<br>")
-
-  const botMsg = document.createElement("div")
-  botMsg.className = "bot"
-  botMsg.innerHTML = `<div class="bot-message">${answer}</div>`
-  messages.appendChild(botMsg)
-  scrollToBottom()
-
-  queryInput.disabled = false
-  sendBtn.disabled = false
-  queryInput.focus()
 }
 
 function handleEnter(event) {
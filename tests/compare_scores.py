@@ -2,7 +2,7 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),'..')))
 from retriever import load_files, chunk_files
-from langchain_huggingface import HuggingFaceEmbeddings
+from embeddings import get_embeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.retrievers import BM25Retriever
 
@@ -11,7 +11,7 @@ docs = load_files(data_dir)
 
 chunks = chunk_files(docs)
 
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+embeddings = get_embeddings("all-MiniLM-L6-v2")
 vectordb = Chroma.from_documents(chunks, embedding=embeddings, persist_directory="./chroma_db")
 bm25 = BM25Retriever.from_documents(chunks)
 bm25.k = 5
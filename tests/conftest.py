@@ -0,0 +1,13 @@
+import time
+
+def wait_for_job(client, response, timeout=300):
+    """upload returns a job id right away, poll /api/jobs until indexing finishes"""
+    assert response.status_code == 202, response.json()
+    job_id = response.json()["job_id"]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"ingest job {job_id} didn't finish in {timeout}s")
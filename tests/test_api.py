@@ -4,13 +4,19 @@ from pathlib import Path
 import tempfile
 import sys
 import random
-from langchain_huggingface import HuggingFaceEmbeddings
+import json
+import threading
 from sklearn.metrics.pairwise import cosine_similarity
+from langchain_core.language_models.fake import FakeStreamingListLLM
+from langchain.schema import Document
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from api import api
 import app as app_module
+from conftest import wait_for_job
+import retriever
+from embeddings import get_embeddings
 
 client = TestClient(api)
 
@@ -26,8 +32,8 @@ class SemanticEvaluator:
     
     def __init__(self):
         if SemanticEvaluator._model is None:
-            hf = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-            SemanticEvaluator._model = hf._client
+            # the same model instance the app's manager embeds with
+            SemanticEvaluator._model = get_embeddings("all-MiniLM-L6-v2")._client
         self.model = SemanticEvaluator._model
     
     def calculate_similarity(self, answer: str, expected: str) -> float:
@@ -87,10 +93,11 @@ def test_upload_file():
                 "/api/upload",
                 files={"file": ("ship_info.txt", f, "text/plain")}
             )
-        if response.status_code != 200:
-            print(f"upload failed: {response.json()}")
-        assert response.status_code == 200
-        assert "uploaded and indexed" in response.json()["message"]
+        job = wait_for_job(client, response)
+        if job["status"] != "done":
+            print(f"upload failed: {job}")
+        assert job["status"] == "done"
+        assert "uploaded and indexed" in job["message"]
 
         saved_file = Path("data/ship_info.txt")
         assert saved_file.exists()
@@ -112,7 +119,7 @@ def test_query_after_upload():
                 files={"file": ("ship_info.txt", f, "text/plain")}
             )
 
-        assert upload_response.status_code == 200
+        assert wait_for_job(client, upload_response)["status"] == "done"
         queries = [
             {
                 "query": "how many livestock units were there on the ship yesterday?",
@@ -202,5 +209,261 @@ def test_query_after_upload():
     finally:
         Path(temp_path).unlink()
 
+def test_delete_document():
+    """test that a deleted document is gone from the index, the listing and data/"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+        f.write(TEST_CONTENT)
+        temp_path = f.name
+
+    try:
+        with open(temp_path, 'rb') as f:
+            upload_response = client.post("/api/upload", files={"file": ("ship_info.txt", f, "text/plain")})
+        assert wait_for_job(client, upload_response)["status"] == "done"
+        listed = client.get("/api/documents").json()["documents"]
+        assert "ship_info.txt" in [d["source"] for d in listed]
+
+        response = client.delete("/api/documents/ship_info.txt")
+        assert response.status_code == 200
+        assert response.json()["chunks_removed"] > 0
+        assert not Path("data/ship_info.txt").exists()
+        assert "ship_info.txt" not in [d["source"] for d in client.get("/api/documents").json()["documents"]]
+
+        assert client.delete("/api/documents/ship_info.txt").status_code == 404
+    finally:
+        Path(temp_path).unlink()
+
+def test_retrieve_without_llm():
+    """test that /api/retrieve ranks chunks with scores and stage timings, without a chain"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+        f.write(TEST_CONTENT)
+        temp_path = f.name
+
+    try:
+        with open(temp_path, 'rb') as f:
+            upload_response = client.post("/api/upload", files={"file": ("ship_info.txt", f, "text/plain")})
+        assert wait_for_job(client, upload_response)["status"] == "done"
+        app_module.qa_chain = None
+
+        data = client.post("/api/retrieve", json={"query": "how many goats were on the ship?", "k": 2}).json()
+        assert 0 < len(data["results"]) <= 2
+        assert "27 goats" in data["results"][0]["content"]
+        assert set(data["results"][0]["scores"]) == {"fused", "bm25", "semantic"}
+        assert {"embed_ms", "vector_ms", "bm25_ms", "fuse_ms", "total_ms"} <= set(data["timings"])
+        assert data["context"]["chunks"] == len(data["results"])
+        assert data["context"]["tokens"] <= data["context"]["tokens_retrieved"]
+    finally:
+        Path(temp_path).unlink()
+
+def test_filtered_retrieve_and_query():
+    """test that source and file type filters limit retrieval and answers, and bad dates are a 400"""
+    files = {"ship_info.txt": TEST_CONTENT, "harbour_notes.txt": "The harbour master counted 12 goats on the pier."}
+    for name, content in files.items():
+        upload_response = client.post("/api/upload", files={"file": (name, content.encode(), "text/plain")})
+        assert wait_for_job(client, upload_response)["status"] == "done"
+    listed = {d["source"]: d for d in client.get("/api/documents").json()["documents"]}
+    assert listed["harbour_notes.txt"]["file_type"] == "txt" and listed["harbour_notes.txt"]["modified"]
+
+    query = {"query": "how many goats were there?", "k": 3}
+    data = client.post("/api/retrieve", json=dict(query, sources=["harbour_notes.txt"])).json()
+    assert data["results"] and {r["source"] for r in data["results"]} == {"harbour_notes.txt"}
+    assert client.post("/api/retrieve", json=dict(query, file_types=["pdf"])).json()["results"] == []
+    modified = listed["ship_info.txt"]["modified"]
+    assert client.post("/api/retrieve", json=dict(query, date_from=modified[:10], date_to=modified[:10])).json()["results"]
+    assert client.post("/api/retrieve", json=dict(query, date_to="2000-01-01")).json()["results"] == []
+
+    app_module.create_chain(llm=FakeStreamingListLLM(responses=["stub answer"]))
+    response = client.post("/api/query", json={"query": "how many goats were there?", "sources": ["ship_info.txt"]})
+    assert response.status_code == 200 and set(response.json()["sources"]) == {"ship_info.txt"}
+    response = client.post("/api/query", json={"query": "goats", "date_from": "yesterday"})
+    assert response.status_code == 400
+
+    # no file matches: no answer, no sources, and the llm is never asked
+    app_module.create_chain(llm=FakeStreamingListLLM(responses=[]))
+    unmatched = {"query": "how many goats were there?", "file_types": ["pdf"]}
+    assert client.post("/api/query", json=unmatched).json() == {"answer": "", "sources": []}
+    events = read_events(client.post("/api/query/stream", json=unmatched))
+    assert [event for event, _ in events] == ["sources", "done"] and events[0][1] == []
+    batch = client.post("/api/query/batch", json={"queries": [unmatched["query"]], "file_types": ["pdf"]}).json()
+    assert batch["results"] == [{"query": unmatched["query"], "answer": "", "sources": []}]
+
+def test_metrics_after_upload_and_query():
+    """test that /metrics exposes ingest and query stage histograms and index size gauges"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+        f.write(TEST_CONTENT)
+        temp_path = f.name
+
+    try:
+        with open(temp_path, 'rb') as f:
+            upload_response = client.post("/api/upload", files={"file": ("ship_info.txt", f, "text/plain")})
+        assert wait_for_job(client, upload_response)["status"] == "done"
+        app_module.create_chain(llm=FakeStreamingListLLM(responses=["stub answer"]))
+        assert client.post("/api/query", json={"query": "who was the captain of the ship?"}).status_code == 200
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        lines = response.text.splitlines()
+        for stage in ("embed", "vector", "bm25", "fuse", "retrieve", "llm", "total"):
+            assert any(line.startswith(f'rag_query_stage_seconds_count{{stage="{stage}"}}') for line in lines), stage
+        for stage in ("extract", "split", "embed", "vector_write", "bm25", "file"):
+            assert any(line.startswith(f'rag_ingest_stage_seconds_count{{stage="{stage}"}}') for line in lines), stage
+        chunks = next(line for line in lines if line.startswith("rag_index_chunks "))
+        assert int(chunks.split()[1]) == app_module.retriever_manager.get_chunk_count()
+        assert any(line.startswith("rag_index_vocabulary_terms ") for line in lines)
+        assert any(line.startswith('rag_index_memory_bytes{component="chunk_text"}') for line in lines)
+    finally:
+        Path(temp_path).unlink()
+
+def test_batch_query(monkeypatch):
+    """test that a batch returns one result per query in order, with and without the llm, cached under the index it read"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+        f.write(TEST_CONTENT)
+        temp_path = f.name
+
+    try:
+        with open(temp_path, 'rb') as f:
+            upload_response = client.post("/api/upload", files={"file": ("ship_info.txt", f, "text/plain")})
+        assert wait_for_job(client, upload_response)["status"] == "done"
+        app_module.create_chain(llm=FakeStreamingListLLM(responses=["stub answer"]))
+        queries = ["how many cows were on the ship?", "who was the captain?", "how fast was the ship?"]
+
+        retrieved = client.post("/api/query/batch", json={"queries": queries, "retrieval_only": True}).json()
+        assert [r["query"] for r in retrieved["results"]] == queries
+        assert all(r["chunks"] and "answer" not in r for r in retrieved["results"])
+        assert "67 cows" in "".join(c["content"] for c in retrieved["results"][0]["chunks"])
+
+        answered = client.post("/api/query/batch", json={"queries": queries}).json()
+        assert [r["query"] for r in answered["results"]] == queries
+        assert all(r["answer"] == "stub answer" and r["sources"] for r in answered["results"])
+
+        # an upload finishing between retrieval and the answers doesn't file them under the newer index
+        manager = app_module.get_manager()
+        retrieve_batch = manager.retrieve_batch
+        def retrieve_then_index(queries, filters=None, snapshot=None):
+            results = retrieve_batch(queries, filters, snapshot)
+            manager.add_documents(retriever.chunk_files([Document(page_content="The deck had 9 lifeboats.",
+                                                                  metadata={"source": "deck_notes.txt"})]))
+            return results
+        monkeypatch.setattr(manager, "retrieve_batch", retrieve_then_index)
+        query = "how many sheep were on the ship?"
+        before = manager.snapshot()
+        assert client.post("/api/query/batch", json={"queries": [query]}).json()["results"][0]["answer"] == "stub answer"
+        assert manager.snapshot().version != before.version
+        assert app_module.answer_cache.get(app_module._answer_key(query, None, before)) is not None
+        assert app_module.answer_cache.get(app_module._answer_key(query)) is None
+    finally:
+        app_module.get_manager().remove_source("deck_notes.txt")
+        Path(temp_path).unlink()
+
+def read_events(response):
+    """parse a server-sent event stream into (event, data) pairs"""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_stream_query_without_documents():
+    """test that the streaming endpoint reports the error as an event"""
+    response = client.post("/api/query/stream", json={"query": "how many humans were there on the ship?"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert [event for event, _ in read_events(response)] == ["error"]
+
+def test_stream_query_after_upload():
+    """test that sources come first, then the answer tokens, then the timings"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+        f.write(TEST_CONTENT)
+        temp_path = f.name
+
+    try:
+        with open(temp_path, 'rb') as f:
+            upload_response = client.post("/api/upload", files={"file": ("ship_info.txt", f, "text/plain")})
+        assert wait_for_job(client, upload_response)["status"] == "done"
+        app_module.create_chain(llm=FakeStreamingListLLM(responses=["There were 67 cows on the ship."]))
+
+        query = {"query": "how many cows were on the ship?"}
+        events = read_events(client.post("/api/query/stream", json=query))
+        names = [event for event, _ in events]
+        assert names[0] == "sources" and "ship_info.txt" in events[0][1]
+        assert names[-1] == "done" and set(names[1:-1]) == {"token"}
+        assert "".join(data for event, data in events if event == "token") == "There were 67 cows on the ship."
+        timings = events[-1][1]
+        assert timings["retrieval_ms"] >= 0 and timings["llm_ms"] >= timings["first_token_ms"]
+
+        # the streamed answer is cached for the plain endpoint too
+        assert client.post("/api/query", json=query).json()["answer"] == "There were 67 cows on the ship."
+    finally:
+        Path(temp_path).unlink()
+
+def test_uploads_extract_concurrently(monkeypatch):
+    """test that two queued uploads extract side by side instead of waiting for each other's indexing"""
+    barrier = threading.Barrier(2, timeout=30)
+
+    def extract(path):
+        barrier.wait()  # only passes once both files are extracting at the same time
+        return Path(path).read_text()
+
+    monkeypatch.setattr(app_module, "extract_pool", None)
+    monkeypatch.setitem(retriever.EXTRACTORS, ".slow", extract)
+    names = ["pump_log.slow", "valve_log.slow"]
+    try:
+        responses = [
+            client.post("/api/upload", files={"file": (name, f"The {name[:4]} ran for {i + 3} hours.".encode(), "text/plain")})
+            for i, name in enumerate(names)
+        ]
+        for response in responses:
+            job = wait_for_job(client, response)
+            assert job["status"] == "done", job["error"]
+    finally:
+        for name in names:
+            app_module.get_manager().remove_source(name)
+            (Path("data") / name).unlink(missing_ok=True)
+
+def test_reupload_waits_for_the_running_job(monkeypatch):
+    """test that a new version uploaded while the old one is extracting only replaces the file once that job is done"""
+    started, release = threading.Event(), threading.Event()
+
+    def extract(path):
+        text = Path(path).read_text()
+        if "first" in text:
+            started.set()
+            release.wait(30)
+        return text + " " + Path(path).read_text()  # read again, as a lazily extracted pdf would
+
+    monkeypatch.setattr(app_module, "extract_pool", None)
+    monkeypatch.setitem(retriever.EXTRACTORS, ".slow", extract)
+    path = Path("data") / "winch_log.slow"
+    try:
+        first = client.post("/api/upload", files={"file": (path.name, b"The first winch held 4 tons.", "text/plain")})
+        assert started.wait(30)
+        second = client.post("/api/upload", files={"file": (path.name, b"The second winch held 9 tons.", "text/plain")})
+        assert path.read_text() == "The first winch held 4 tons."
+        release.set()
+        assert wait_for_job(client, first)["status"] == "done"
+        assert wait_for_job(client, second)["status"] == "done"
+        assert path.read_text() == "The second winch held 9 tons."
+        texts = [c.page_content for c in app_module.get_manager().all_chunks if c.metadata["source"] == path.name]
+        assert texts and all("second" in text and "first" not in text for text in texts)
+    finally:
+        release.set()
+        app_module.get_manager().remove_source(path.name)
+        path.unlink(missing_ok=True)
+
+def test_reupload_without_text_removes_the_old_chunks():
+    """test that re-uploading a file emptied of text finishes with its old chunks removed instead of failing"""
+    path = Path("data") / "crane_log.txt"
+    try:
+        first = client.post("/api/upload", files={"file": (path.name, b"The crane lifted 12 containers.", "text/plain")})
+        assert wait_for_job(client, first)["status"] == "done"
+        assert path.name in app_module.get_manager().source_counts()
+
+        job = wait_for_job(client, client.post("/api/upload", files={"file": (path.name, b"  \n", "text/plain")}))
+        assert job["status"] == "done" and job["chunks_total"] == 0, job["error"]
+        assert "no text found" in job["message"]
+        assert path.name not in app_module.get_manager().source_counts()
+    finally:
+        app_module.get_manager().remove_source(path.name)
+        path.unlink(missing_ok=True)
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "-s"])
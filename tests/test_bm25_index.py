@@ -0,0 +1,117 @@
+import pytest
+import random
+import numpy as np
+import sys
+from pathlib import Path
+from langchain.schema import Document
+from langchain_community.retrievers import BM25Retriever
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bm25 import BM25Index, BM25IndexRetriever
+
+WORDS = ["ship", "captain", "cargo", "livestock", "cows", "goats", "warehouse", "boxes",
+         "factory", "widgets", "machines", "library", "manuscript", "the", "a", "of", "was", "in"]
+
+def make_docs(n, seed):
+    rng = random.Random(seed)
+    return [
+        Document(page_content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40))),
+                 metadata={"source": f"doc_{i}.txt"})
+        for i in range(n)
+    ]
+
+QUERIES = ["how many cows were on the ship", "warehouse boxes", "captain of the ship",
+           "library manuscript", "factory machines widgets", "unknown words only"]
+
+def assert_same_ranking(index, docs, k):
+    reference = BM25Retriever.from_documents(docs)
+    reference.k = k
+    retriever = BM25IndexRetriever(index=index, k=k)
+    for query in QUERIES:
+        expected = [d.page_content for d in reference.invoke(query)]
+        got = [d.page_content for d in retriever.invoke(query)]
+        assert got == expected, f"ranking differs for '{query}'"
+
+def test_incremental_matches_full_rebuild():
+    """testing that adding documents in batches ranks the same as BM25Retriever over all of them"""
+    docs = make_docs(300, seed=1)
+    index = BM25Index()
+    for start in range(0, len(docs), 37):
+        index.add_documents(docs[start:start + 37])
+        assert_same_ranking(index, docs[:start + 37], k=5)
+
+def test_removal_matches_rebuild_without_removed():
+    """testing that removed documents stop being scored and the rest rank like a fresh index"""
+    docs = make_docs(200, seed=2)
+    index = BM25Index()
+    slots = index.add_documents(docs)
+
+    removed = set(random.Random(3).sample(slots, 60))
+    assert index.remove(removed) == 60
+    assert len(index) == 140
+
+    remaining = [d for slot, d in zip(slots, docs) if slot not in removed]
+    assert_same_ranking(index, remaining, k=10)
+
+def test_copy_leaves_original_untouched():
+    """testing that writes to a copy don't show up in the index it was copied from"""
+    docs = make_docs(150, seed=4)
+    original = BM25Index()
+    slots = original.add_documents(docs[:100])
+
+    copy = original.copy()
+    copy.remove(slots[:30])
+    copy.add_documents(docs[100:])
+
+    assert len(original) == 100
+    assert_same_ranking(original, docs[:100], k=5)
+    assert_same_ranking(copy, docs[30:], k=5)
+
+def test_compact_drops_dead_slots():
+    """testing that compaction renumbers live documents without changing the ranking"""
+    docs = make_docs(200, seed=5)
+    index = BM25Index()
+    slots = index.add_documents(docs)
+    removed = set(random.Random(6).sample(slots, 80))
+    index.remove(removed)
+
+    compacted = index.compact()
+    assert compacted.dead_count == 0
+    assert len(compacted.docs) == len(compacted) == 120
+    assert index.dead_count == 80  # the original is left as it was
+    remaining = [d for slot, d in zip(slots, docs) if slot not in removed]
+    assert_same_ranking(compacted, remaining, k=10)
+
+def test_batch_scoring_matches_single_queries():
+    """testing that scoring queries together gives each one the same top slots and scores"""
+    index = BM25Index()
+    slots = index.add_documents(make_docs(250, seed=7))
+    index.remove(slots[::9])
+    queries = QUERIES + ["ship ship cargo"]
+    for query, (batch_slots, batch_scores) in zip(queries, index.top_scores_many(queries, 10)):
+        single_slots, single_scores = index.top_scores(query, 10)
+        assert list(batch_slots) == list(single_slots)
+        assert batch_scores == pytest.approx(single_scores)
+
+def test_tiny_corpus_still_matches():
+    """testing that one or two documents, where every term gets a negative idf, still match their terms"""
+    docs = [Document(page_content="the captain of the ship counted the cows", metadata={"source": "log.txt"}),
+            Document(page_content="boxes of widgets in the warehouse", metadata={"source": "stock.txt"})]
+    for corpus in (docs[:1], docs):
+        index = BM25Index()
+        slots = index.add_documents(corpus)
+        found, scores = index.top_scores("how many cows did our captain count", 5)
+        assert list(found) == [slots[0]] and scores[0] <= 0
+        assert list(index.top_scores("unknown words only", 5)[0]) == []
+        assert [list(f) for f, _ in index.top_scores_many(["captain cows", "warehouse"], 5)] == \
+            [[slots[0]], [slots[1]] if len(corpus) == 2 else []]
+        assert list(index.top_scores("captain cows", 5, slots=np.array(slots[:1]))[0]) == [slots[0]]
+
+def test_empty_index():
+    """testing that an empty index returns nothing instead of failing"""
+    index = BM25Index()
+    assert BM25IndexRetriever(index=index, k=3).invoke("ship") == []
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,129 @@
+import pytest
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from cache import LRUCache, DiskCache, CachedQueryEmbeddings
+from retriever import HybridRetrieverManager, chunk_files
+from langchain.schema import Document
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return super().embed_query(text)
+
+def test_lru_eviction_and_stats():
+    """testing that the least recently used entry is evicted and counters add up"""
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2 and stats["misses"] == 1
+    assert stats["memory_bytes"] > 0
+
+def test_ttl_expiry():
+    """testing that entries past their ttl count as misses"""
+    cache = LRUCache(max_size=10, ttl=0.05)
+    cache.put("q", 1)
+    assert cache.get("q") == 1
+    time.sleep(0.1)
+    assert cache.get("q") is None
+    assert len(cache) == 0 and cache.memory_bytes == 0
+
+def test_query_embeddings_hit_on_normalized_text():
+    """testing that repeated questions differing in case/whitespace only hit the model once"""
+    model = CountingEmbeddings(size=16)
+    cached = CachedQueryEmbeddings(model, LRUCache(max_size=10))
+
+    first = cached.embed_query("How many cows were on the ship?")
+    second = cached.embed_query("  how many  cows were on the ship?\n")
+    assert first == second
+    assert model.calls == 1
+    assert cached.cache.stats()["hits"] == 1
+    assert cached.cache.memory_bytes >= 16 * 4
+
+def test_query_embeddings_batch_embeds_misses_once():
+    """testing that a batch sends only uncached, distinct queries to the model in one call"""
+    class BatchCounting(DeterministicFakeEmbedding):
+        batches: list = []
+
+        def embed_documents(self, texts):
+            self.batches.append(list(texts))
+            return super().embed_documents(texts)
+
+    model = BatchCounting(size=16)
+    cached = CachedQueryEmbeddings(model, LRUCache(max_size=10))
+    known = cached.embed_query("ship")
+    vectors = cached.embed_queries(["Ship", "cows", "goats", "COWS "])
+    assert model.batches == [["cows", "goats"]]
+    assert vectors.shape == (4, 16)
+    assert np.allclose(vectors[0], known) and np.allclose(vectors[1], vectors[3])
+
+def test_zero_size_disables_cache():
+    """testing that max_size=0 turns caching off"""
+    model = CountingEmbeddings(size=8)
+    cached = CachedQueryEmbeddings(model, LRUCache(max_size=0))
+    cached.embed_query("ship")
+    cached.embed_query("ship")
+    assert model.calls == 2
+
+def test_disk_cache_survives_reopen():
+    """testing that the sqlite backend keeps entries across instances and trims to max_size"""
+    path = Path(tempfile.mkdtemp()) / "answers.sqlite"
+    try:
+        cache = DiskCache(str(path), max_size=2)
+        cache.put(("q1", 3), ("answer one", ["a.txt"]))
+        cache.put(("q2", 3), ("answer two", ["b.txt"]))
+        cache.get(("q1", 3))
+        cache.put(("q3", 3), ("answer three", ["c.txt"]))
+
+        reopened = DiskCache(str(path), max_size=2)
+        assert reopened.get(("q1", 3)) == ("answer one", ["a.txt"])
+        assert reopened.get(("q2", 3)) is None
+        assert len(reopened) == 2
+    finally:
+        shutil.rmtree(path.parent, ignore_errors=True)
+
+def test_corpus_version_and_retrieval_cache():
+    """testing that retrieval results are cached until the corpus changes"""
+    persist_dir = tempfile.mkdtemp()
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=DeterministicFakeEmbedding(size=16))
+        ship = chunk_files([Document(page_content="The ship carried 150 livestock units.", metadata={"source": "ship.txt"})])
+        empty_version = manager.corpus_version()
+        manager.add_documents(ship)
+        version = manager.corpus_version()
+        assert version != empty_version
+
+        retriever = manager.get_retriever()
+        retriever.invoke("livestock on the ship")
+        retriever.invoke("Livestock on the  ship")
+        assert manager.retrieval_cache.stats()["hits"] == 1
+
+        warehouse = chunk_files([Document(page_content="The warehouse stores 3400 boxes.", metadata={"source": "warehouse.txt"})])
+        manager.add_documents(warehouse)
+        assert manager.corpus_version() != version
+        retriever.invoke("livestock on the ship")
+        assert manager.retrieval_cache.stats()["misses"] == 2
+
+        manager.remove_source("warehouse.txt")
+        assert manager.corpus_version() == version
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
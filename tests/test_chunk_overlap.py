@@ -3,11 +3,13 @@ from fastapi.testclient import TestClient
 from pathlib import Path
 import tempfile
 import sys
+import time
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from api import api
 import app as app_module
+from conftest import wait_for_job
 
 client = TestClient(api)
 
@@ -67,7 +69,7 @@ def test_chunk_overlap():
                 files={"file": ("library.txt", f, "text/plain")}
             )
         
-        assert response.status_code == 200
+        assert wait_for_job(client, response)["status"] == "done"
 
         chunks = app_module.chunks
         print(f"total chunks created: {len(chunks)}")
@@ -121,7 +123,7 @@ def test_no_information_loss():
                 files={"file": ("library.txt", f, "text/plain")}
             )
         
-        assert response.status_code == 200
+        assert wait_for_job(client, response)["status"] == "done"
 
         chunks = app_module.chunks
 
@@ -165,7 +167,7 @@ def test_chunk_size_constraints(): # chars - characters
                 files={"file": ("library.txt", f, "text/plain")}
             )
 
-        assert response.status_code == 200
+        assert wait_for_job(client, response)["status"] == "done"
 
         chunks = app_module.chunks
 
@@ -0,0 +1,82 @@
+import random
+import sys
+from pathlib import Path
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from chunker import split_spans, iter_spans, token_length
+from retriever import chunk_files, iter_chunks
+
+WORDS = ["river", "bank", "surveyor", "boundary", "stones", "drainage", "x" * 30, "soil", "plot"]
+
+def random_text(rng, n_words, long_runs=True):
+    """words with spaces, single and double newlines, and now and then a run too long to fit a chunk"""
+    parts = []
+    for _ in range(n_words):
+        if rng.random() < 0.8:
+            parts.append(rng.choice(WORDS))
+        else:
+            parts.append(rng.choice(["\n", "\n\n", " ", "  ", "\n\n\n"] + (["y" * rng.randint(100, 1200)] if long_runs else [])))
+        parts.append(" " if rng.random() < 0.9 else "")
+    return "".join(parts)
+
+def random_pieces(rng, text):
+    pieces = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 3000)
+        pieces.append(text[i:i + n])
+        i += n
+    return pieces
+
+def test_chunks_match_langchain():
+    """testing that the spans cut the same chunks as RecursiveCharacterTextSplitter for several sizes"""
+    rng = random.Random(0)
+    for _ in range(100):
+        text = random_text(rng, rng.randint(1, 3000))
+        chunk_size, chunk_overlap = rng.choice([(800, 100), (200, 20), (50, 10), (800, 0)])
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        assert [text[s:e] for s, e in split_spans(text, chunk_size, chunk_overlap)] == splitter.split_text(text)
+
+def test_chunks_match_langchain_with_a_length_function():
+    """testing sizes measured by a length function other than len, words here"""
+    rng = random.Random(1)
+    words = lambda text: len(text.split())
+    for _ in range(30):
+        text = random_text(rng, rng.randint(100, 3000))
+        splitter = RecursiveCharacterTextSplitter(chunk_size=40, chunk_overlap=8, length_function=words)
+        assert [text[s:e] for s, e in split_spans(text, 40, 8, length=words)] == splitter.split_text(text)
+
+def test_streamed_chunks_match_the_whole_text():
+    """testing that chunks of text arriving in pieces equal the chunks of the whole text, offsets included"""
+    rng = random.Random(2)
+    for _ in range(100):
+        text = random_text(rng, rng.randint(1000, 8000), long_runs=rng.random() < 0.5)
+        whole = [(s, e, text[s:e]) for s, e in split_spans(text)]
+        assert list(iter_spans(random_pieces(rng, text), window=rng.choice([1000, 4000]))) == whole
+
+def test_chunk_metadata_has_offsets():
+    """testing that every chunk knows its index and where it starts in the file"""
+    rng = random.Random(3)
+    text = random_text(rng, 20000)
+    chunks = [c for batch in iter_chunks(random_pieces(rng, text), {"source": "notes.txt"}, batch_chars=4000)
+              for c in batch]
+    assert len(chunks) > 20
+    for i, chunk in enumerate(chunks):
+        start = chunk.metadata["start_index"]
+        assert chunk.metadata["chunk_index"] == i
+        assert chunk.metadata["source"] == "notes.txt"
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+
+    whole = chunk_files([Document(page_content=text, metadata={"source": "notes.txt"})])
+    assert [c.id for c in whole] == [c.id for c in chunks]
+
+def test_token_length_keeps_chunks_in_the_model_window():
+    """testing chunks sized in the embedding model's tokens"""
+    length = token_length("all-MiniLM-L6-v2")
+    text = random_text(random.Random(4), 5000, long_runs=False)
+    spans = split_spans(text, 256, 32, length=length)
+    assert len(spans) > 1
+    assert all(length(text[s:e]) <= 256 for s, e in spans)
@@ -0,0 +1,107 @@
+import pickle
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from chunkstore import ChunkStore
+from retriever import HybridRetrieverManager, chunk_files
+
+TEXT = "\n\n".join(
+    f"Section {i}. Grüße from the lighthouse keeper, who counted {i * 11} gulls and {i * 3} ships "
+    f"passing the northern reef before dawn." * 4
+    for i in range(10)
+)
+
+@pytest.fixture
+def tmp_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+def make_chunks(text=TEXT, source="lighthouse.txt"):
+    return chunk_files([Document(page_content=text, metadata={"source": source, "file_hash": "abc"})])
+
+def test_records_round_trip_to_documents(tmp_dir):
+    """testing that records read back the same text, id and metadata as the chunks they were made from"""
+    chunks = make_chunks()
+    store = ChunkStore(tmp_dir)
+    records = store.add(chunks)
+    for chunk, record in zip(chunks, records):
+        doc = record.to_document()
+        assert doc.page_content == chunk.page_content
+        assert doc.metadata == chunk.metadata
+        assert doc.id == chunk.id
+    store.close()
+
+def test_metadata_is_shared_between_chunks_of_a_file(tmp_dir):
+    """testing that chunks of one file point at a single metadata dict"""
+    store = ChunkStore(tmp_dir)
+    records = store.add(make_chunks()) + store.add(make_chunks(source="other.txt"))
+    by_source = {}
+    for record in records:
+        by_source.setdefault(record.source, set()).add(id(record.shared))
+    assert all(len(dicts) == 1 for dicts in by_source.values())
+    assert len(by_source) == 2
+    store.close()
+
+def test_compaction_keeps_live_texts(tmp_dir):
+    """testing that compact() rewrites live chunks to a new file and drops the old one"""
+    store = ChunkStore(tmp_dir)
+    records = store.add(make_chunks())
+    old_file, old_buffer = store.filename, store.buffer
+    store.release(records[::2])
+    live = records[1::2]
+    compacted = store.compact(live)
+    assert store.filename != old_file
+    assert not (Path(tmp_dir) / old_file).exists()
+    assert old_buffer._file.closed  # no file descriptor left open per compaction
+    assert [r.page_content for r in compacted] == [r.page_content for r in live]
+    assert live[0].page_content == compacted[0].page_content  # old records still read their map
+    store.close()
+
+def test_records_pickle_without_text(tmp_dir):
+    """testing that a pickled record carries offsets only and reads again once bound"""
+    store = ChunkStore(tmp_dir)
+    record = store.add(make_chunks())[3]
+    loaded = pickle.loads(pickle.dumps(record))
+    assert loaded.buffer is None
+    store.bind([loaded])
+    assert loaded.page_content == record.page_content
+    store.close()
+
+def test_reopened_store_counts_dead_bytes(tmp_dir):
+    """testing that binding the live records of a reopened file counts the rest of it as dead"""
+    store = ChunkStore(tmp_dir)
+    records = store.add(make_chunks())
+    store.release(records[::2])
+    dead = store.dead_bytes
+    store.close()
+
+    reopened = ChunkStore(tmp_dir, store.filename)
+    reopened.bind([pickle.loads(pickle.dumps(r)) for r in records[1::2]])
+    assert reopened.dead_bytes == dead > 0
+    assert reopened.needs_compaction() == store.needs_compaction()
+    reopened.close()
+
+def test_manager_search_and_warm_start_use_the_store(tmp_dir):
+    """testing that search returns Documents and a snapshot restart reads texts from the saved file"""
+    embeddings = DeterministicFakeEmbedding(size=32)
+    manager = HybridRetrieverManager(persist_dir=tmp_dir, embeddings=embeddings)
+    chunks = make_chunks()
+    manager.add_documents(chunks)
+    results = manager.search("lighthouse keeper gulls")
+    assert all(isinstance(doc, Document) for doc in results)
+    manager.save_snapshot()
+    manager.close()
+
+    restarted = HybridRetrieverManager(persist_dir=tmp_dir, embeddings=embeddings)
+    texts = {c.id: c.page_content for c in restarted.all_chunks}
+    assert texts == {c.id: c.page_content for c in chunks}
+    assert restarted.source_hashes() == {"lighthouse.txt": "abc"}
+    restarted.close()
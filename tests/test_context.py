@@ -0,0 +1,65 @@
+import pytest
+import sys
+from pathlib import Path
+from langchain.schema import Document
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from context import estimate_tokens, pack_context
+from retriever import chunk_files
+
+TEXT = " ".join(f"Line {i} of the manifest lists {i * 3} crates of bolts for the northern docks." for i in range(60))
+
+def chunks_of(text, source="manifest.txt", chunk_size=200, chunk_overlap=50):
+    chunks = chunk_files([Document(page_content=text, metadata={"source": source})], chunk_size, chunk_overlap)
+    for i, chunk in enumerate(chunks):
+        chunk.id = f"{source}:{i}"
+    return chunks
+
+def test_overlapping_chunks_merge_into_the_original_text():
+    """testing that neighbouring chunks of a file become one passage with the overlap written once"""
+    chunks = chunks_of(TEXT)
+    start, end = 3, 7
+    # retrieved out of file order, chunk 5 ranked best
+    docs = [chunks[5], chunks[3], chunks[6], chunks[4]]
+    packed, stats = pack_context(docs)
+    assert len(packed) == 1
+    expected_end = chunks[end - 1].metadata["start_index"] + len(chunks[end - 1].page_content)
+    assert packed[0].page_content == TEXT[chunks[start].metadata["start_index"]:expected_end]
+    assert packed[0].metadata["merged_chunks"] == 4
+    assert packed[0].metadata["start_index"] == chunks[start].metadata["start_index"]
+    assert stats["chunks"] == 4 and stats["passages"] == 1
+    assert stats["tokens"] < stats["tokens_retrieved"]
+    assert stats["tokens_saved"] == stats["tokens_retrieved"] - stats["tokens"]
+
+def test_duplicates_and_rank_order():
+    """testing that repeated chunks are dropped and passages keep the rank of their best chunk"""
+    chunks = chunks_of(TEXT)
+    other = chunks_of("The harbour master counted 12 goats on the pier.", source="harbour.txt")[0]
+    # the same file uploaded again under another name, different whitespace
+    copy = Document(page_content=" " + other.page_content.replace(" ", "  "), metadata={"source": "harbour (1).txt"},
+                    id="copy")
+    no_offset = Document(page_content="A note without offsets.", metadata={"source": "notes.txt"}, id="note")
+    docs = [other, chunks[10], no_offset, chunks[2], chunks[10], copy, chunks[11]]
+    packed, stats = pack_context(docs)
+    assert [d.metadata["source"] for d in packed] == ["harbour.txt", "manifest.txt", "notes.txt", "manifest.txt"]
+    assert packed[1].metadata["merged_chunks"] == 2 and packed[3] is chunks[2]
+    assert stats["chunks"] == 7 and stats["passages"] == 4
+
+def test_budget_keeps_the_best_passages():
+    """testing that the budget is never exceeded, and the passage that doesn't fit is cut at a word"""
+    chunks = chunks_of(TEXT)
+    docs = [chunks[20], chunks[0], chunks[26]]
+    unlimited, _ = pack_context(docs)
+    budget = estimate_tokens(unlimited[0].page_content) + 20
+    packed, stats = pack_context(docs, budget=budget)
+    assert stats["tokens"] <= budget and len(packed) == 2
+    assert packed[0] is unlimited[0]
+    assert packed[1].metadata["truncated"] and unlimited[1].page_content.startswith(packed[1].page_content)
+    assert unlimited[1].page_content[len(packed[1].page_content)] == " "
+    assert [d.page_content for d in pack_context(docs, budget=1, length=len)[0]] == [chunks[20].page_content[0]]
+    assert pack_context([], budget=100)[1] == {"chunks": 0, "passages": 0, "tokens_retrieved": 0, "tokens": 0,
+                                               "tokens_saved": 0}
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,99 @@
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from retriever import HybridRetrieverManager, chunk_files
+
+PARAGRAPHS = [
+    f"Paragraph {i}. The harbour master logged vessel number {i * 7} arriving with {i * 13} containers "
+    f"of cargo, which were unloaded at berth {i % 5} before the evening tide turned." * 3
+    for i in range(8)
+]
+
+@pytest.fixture
+def manager():
+    persist_dir = tempfile.mkdtemp()
+    yield HybridRetrieverManager(persist_dir=persist_dir, embeddings=DeterministicFakeEmbedding(size=32))
+    shutil.rmtree(persist_dir, ignore_errors=True)
+
+def make_chunks(paragraphs, source="harbour.txt"):
+    return chunk_files([Document(page_content="\n\n".join(paragraphs), metadata={"source": source})])
+
+def test_chunk_ids_are_stable():
+    """testing that chunking the same text twice gives the same ids"""
+    first = [c.id for c in make_chunks(PARAGRAPHS)]
+    second = [c.id for c in make_chunks(PARAGRAPHS)]
+    assert first == second
+    assert len(set(first)) == len(first)
+
+def test_readding_unchanged_chunks_is_noop(manager):
+    """testing that adding the same chunks twice doesn't grow chroma, bm25 or all_chunks"""
+    assert manager.add_documents(make_chunks(PARAGRAPHS)) > 0
+    count = manager.get_chunk_count()
+
+    assert manager.add_documents(make_chunks(PARAGRAPHS)) == 0
+    assert manager.get_chunk_count() == count
+    assert manager.vectordb._collection.count() == count
+    assert len(manager.bm25_index) == count
+
+def test_changed_upload_replaces_only_changed_chunks(manager):
+    """testing that a re-upload with one edited paragraph only swaps the affected chunks"""
+    original = make_chunks(PARAGRAPHS)
+    manager.replace_source("harbour.txt", original)
+
+    edited = list(PARAGRAPHS)
+    edited[-1] = edited[-1].replace("containers", "crates")
+    updated = make_chunks(edited)
+
+    added, removed = manager.replace_source("harbour.txt", updated)
+    changed = len({c.id for c in updated} - {c.id for c in original})
+    assert 0 < changed < len(updated)
+    assert added == changed
+    assert removed == changed
+    assert sorted(c.id for c in manager.all_chunks) == sorted(c.id for c in updated)
+    assert manager.vectordb._collection.count() == len(updated)
+
+def test_snapshot_is_unchanged_by_later_writes(manager):
+    """testing that a snapshot taken before a re-upload still returns its own chunks"""
+    original = make_chunks(PARAGRAPHS)
+    manager.replace_source("harbour.txt", original)
+    retriever = manager.get_retriever()
+    before = manager.snapshot()
+
+    manager.replace_source("harbour.txt", make_chunks([p.replace("containers", "crates") for p in PARAGRAPHS]))
+    assert manager.get_retriever() is retriever
+    assert manager.snapshot() is not before
+
+    original_ids = {c.id for c in original}
+    assert {c.id for c in before.chunks} == original_ids
+    assert {d.id for d in manager.search("vessel containers", snapshot=before)} <= original_ids
+    assert not {d.id for d in retriever.invoke("vessel crates")} & original_ids
+
+def test_warm_start_keeps_ids(manager):
+    """testing that a restarted manager recognizes chunks already in chroma"""
+    manager.add_documents(make_chunks(PARAGRAPHS))
+    restarted = HybridRetrieverManager(persist_dir=manager.persist_dir, embeddings=manager.embeddings)
+    assert restarted.get_chunk_count() == manager.get_chunk_count()
+    assert restarted.add_documents(make_chunks(PARAGRAPHS)) == 0
+
+def test_removed_source_is_compacted_away(manager):
+    """testing that deleting a source drops it everywhere and compaction leaves no dead slots"""
+    manager.add_documents(make_chunks(PARAGRAPHS))
+    manager.add_documents(make_chunks(PARAGRAPHS[:2], source="pier.txt"))
+    kept = manager.source_counts()["pier.txt"]
+
+    assert manager.remove_source("harbour.txt") > 0
+    manager._compaction.result()  # more than a quarter of the slots died, so a compaction was scheduled
+    assert manager.source_counts() == {"pier.txt": kept}
+    assert manager.vectordb._collection.count() == kept
+    assert manager.bm25_index.dead_count == 0
+    assert {d.metadata["source"] for d in manager.search("vessel containers")} == {"pier.txt"}
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,52 @@
+import pytest
+import sys
+import time
+from pathlib import Path
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_core.embeddings import Embeddings
+from langchain.schema import Document
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from embeddings import EmbeddingPipeline, LazyEmbeddings
+
+def test_worker_processes_need_the_managers_model():
+    """testing that custom embeddings can't be combined with worker processes, which would load another model"""
+    with pytest.raises(ValueError):
+        EmbeddingPipeline(DeterministicFakeEmbedding(size=4), "all-MiniLM-L6-v2", workers=2)
+    with pytest.raises(ValueError):
+        EmbeddingPipeline(LazyEmbeddings("all-MiniLM-L6-v2"), "all-MiniLM-L6-v2", workers=2, backend="onnx")
+    EmbeddingPipeline(LazyEmbeddings("all-MiniLM-L6-v2"), "all-MiniLM-L6-v2", workers=2).shutdown()
+    EmbeddingPipeline(DeterministicFakeEmbedding(size=4), "all-MiniLM-L6-v2").shutdown()
+
+class SlowEmbeddings(Embeddings):
+    """counts the batches it encodes, each taking a little while"""
+    def __init__(self):
+        self.batches = 0
+
+    def embed_documents(self, texts):
+        time.sleep(0.05)
+        self.batches += 1
+        return [[0.0] * 4 for _ in texts]
+
+    def embed_query(self, text):
+        return [0.0] * 4
+
+def test_failed_write_leaves_no_batches_encoding():
+    """testing that a write error cancels queued batches and waits for the running one before raising"""
+    slow = SlowEmbeddings()
+    pipeline = EmbeddingPipeline(slow, "slow", batch_size=2)
+    chunks = [Document(page_content=f"chunk {i}") for i in range(20)]
+
+    def write(batch, vectors):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        pipeline.run(chunks, write)
+    encoded = slow.batches
+    time.sleep(0.2)
+    assert slow.batches == encoded < 10
+    pipeline.shutdown()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
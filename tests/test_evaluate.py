@@ -0,0 +1,86 @@
+import json
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from evaluate import read_queries, read_qrels, judge, index_dir, run
+from retriever import HybridRetrieverManager
+
+FILES = {
+    "ship.txt": "The ship carried 150 livestock units, among them 67 cows and 22 chickens.",
+    "warehouse.txt": "The warehouse stores 3400 boxes of screws next to the loading dock.",
+    "library.txt": "The library keeps old manuscripts about astronomy and star charts.",
+}
+
+@pytest.fixture
+def workdir():
+    path = Path(tempfile.mkdtemp())
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+def test_reads_queries_and_qrels(workdir):
+    """testing plain and tab separated queries, and trec qrels with non-relevant rows dropped"""
+    (workdir / "queries.tsv").write_text("q1\thow many cows\nboxes at the dock\n\n")
+    (workdir / "qrels.txt").write_text("q1 0 ship.txt 1\nq1 0 library.txt 0\n2 warehouse.txt\n")
+    assert read_queries(workdir / "queries.tsv") == [("q1", "how many cows"), ("2", "boxes at the dock")]
+    assert read_qrels(workdir / "qrels.txt") == {"q1": {"ship.txt"}, "2": {"warehouse.txt"}}
+
+def test_judge_matches_chunk_ids_and_sources():
+    """testing recall and reciprocal rank when qrels name sources or chunk ids"""
+    ranking = [("a.txt:0:x", "a.txt"), ("b.txt:3:y", "b.txt"), ("c.txt:1:z", "c.txt")]
+    assert judge(ranking, {"b.txt"}) == (1.0, 0.5)
+    assert judge(ranking, {"c.txt:1:z", "d.txt"}) == (0.5, pytest.approx(1 / 3))
+    assert judge(ranking, {"d.txt"}) == (0.0, 0.0)
+
+def test_run_reports_stages_and_metrics(workdir):
+    """testing an offline run over an indexed directory: stage latencies, recall, mrr and jsonl output"""
+    data_dir = workdir / "data"
+    data_dir.mkdir()
+    for name, text in FILES.items():
+        (data_dir / name).write_text(text)
+    # fake embeddings rank at random, keyword matches decide the order
+    manager = HybridRetrieverManager(persist_dir=str(workdir / "db"), embeddings=DeterministicFakeEmbedding(size=16),
+                                     bm25_weight=0.8, semantic_weight=0.2)
+    index_dir(manager, str(data_dir))
+    assert manager.get_chunk_count() == len(FILES)
+
+    queries = [("q1", "how many cows and livestock"), ("q2", "boxes of screws at the loading dock")]
+    qrels = {"q1": {"ship.txt"}, "q2": {"warehouse.txt"}}
+    with open(workdir / "ranked.jsonl", "w") as output:
+        report = run(manager, queries, k=2, qrels=qrels, output=output)
+
+    assert report["judged"] == 2
+    assert report["recall@2"] == 1.0 and report["mrr@2"] == 1.0
+    assert {"embed_ms", "vector_ms", "bm25_ms", "fuse_ms", "total_ms"} <= set(report)
+    lines = [json.loads(line) for line in (workdir / "ranked.jsonl").read_text().splitlines()]
+    assert [line["qid"] for line in lines] == ["q1", "q2"]
+    assert set(lines[0]["results"][0]["scores"]) == {"fused", "bm25", "semantic"}
+    manager.close()
+
+def test_index_dir_chunks_like_the_server_and_drops_removed_files(workdir):
+    """testing that index_dir uses the given chunk sizes and removes sources whose file is gone or has no text"""
+    data_dir = workdir / "data"
+    data_dir.mkdir()
+    for name, text in FILES.items():
+        (data_dir / name).write_text(text)
+    manager = HybridRetrieverManager(persist_dir=str(workdir / "db"), embeddings=DeterministicFakeEmbedding(size=16))
+    assert index_dir(manager, str(data_dir), chunk_size=40, chunk_overlap=10) == sorted(FILES)
+    assert manager.get_chunk_count() > len(FILES)
+    assert all(len(c.page_content) <= 40 for c in manager.all_chunks)
+
+    (data_dir / "ship.txt").unlink()
+    assert index_dir(manager, str(data_dir), chunk_size=40, chunk_overlap=10) == []
+    assert set(manager.source_counts()) == {"warehouse.txt", "library.txt"}
+
+    (data_dir / "warehouse.txt").write_text("\n")  # no text left, its old chunks go
+    assert index_dir(manager, str(data_dir), chunk_size=40, chunk_overlap=10) == ["warehouse.txt"]
+    assert set(manager.source_counts()) == {"library.txt"}
+    manager.close()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
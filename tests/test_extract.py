@@ -0,0 +1,91 @@
+import pytest
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import retriever
+from retriever import HybridRetrieverManager, iter_pages, iter_chunks, chunk_files
+
+PAGES = [
+    f"Page {i}. The surveyor measured plot {i * 17} at {i * 3 + 40} metres along the river bank, "
+    f"noting the soil, the drainage and the boundary stones.\n\n" * 6
+    for i in range(60)
+]
+
+class FakePages:
+    """paged extractor over PAGES that counts how many pages were extracted"""
+    def __init__(self):
+        self.extracted = 0
+        self.lock = threading.Lock()
+
+    def count(self, path):
+        return len(PAGES)
+
+    def extract(self, path, start, stop):
+        with self.lock:
+            self.extracted += stop - start
+        return PAGES[start:stop]
+
+@pytest.fixture
+def fake_pages(monkeypatch):
+    fake = FakePages()
+    monkeypatch.setitem(retriever.PAGED_EXTRACTORS, ".fake", (4, fake.count, fake.extract))
+    return fake
+
+def test_pages_come_back_in_order(fake_pages):
+    """testing that pool extraction yields every page once, in document order"""
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert list(iter_pages("report.fake", pool)) == PAGES
+    assert list(iter_pages("report.fake")) == PAGES
+    assert fake_pages.extracted == 2 * len(PAGES)
+
+def test_extraction_stays_a_bounded_distance_ahead(fake_pages):
+    """testing that only `lookahead` page ranges are extracted ahead of the consumer"""
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        pages = iter_pages("report.fake", pool, lookahead=2)
+        next(pages)
+        assert fake_pages.extracted <= 2 * 4
+        pages.close()
+
+def test_chunks_stream_before_the_last_page(fake_pages):
+    """testing that the first batch of chunks is ready long before all pages are extracted"""
+    batches = iter_chunks(iter_pages("report.fake"), {"source": "report.fake"}, batch_chars=4000)
+    first = next(batches)
+    assert first and fake_pages.extracted < len(PAGES)
+
+    streamed = first + [c for batch in batches for c in batch]
+    assert [c.metadata["chunk_index"] for c in streamed] == list(range(len(streamed)))
+    assert all(len(c.page_content) <= 800 for c in streamed)
+    whole = chunk_files([Document(page_content="".join(PAGES), metadata={"source": "report.fake"})])
+    assert [c.page_content for c in streamed] == [c.page_content for c in whole]
+
+def test_streamed_replace_drops_stale_chunks_last():
+    """testing that each batch is searchable as it lands and stale chunks go with the final one"""
+    persist_dir = tempfile.mkdtemp()
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=DeterministicFakeEmbedding(size=32))
+        old = list(iter_chunks(["Obsolete notes about the harbour. " * 40], {"source": "report.fake"}))[0]
+        manager.replace_source("report.fake", old)
+
+        counts = []
+        def batches():
+            for batch in iter_chunks(PAGES, {"source": "report.fake"}, batch_chars=4000):
+                yield batch
+                counts.append(manager.get_chunk_count())
+
+        added, removed = manager.replace_source_stream("report.fake", batches())
+        assert removed == len(old)
+        # earlier batches were searchable next to the old chunks before the stream ended
+        assert len(old) < max(counts) < len(old) + added
+        assert manager.get_chunk_count() == added
+        assert not {c.id for c in old} & {c.id for c in manager.all_chunks}
+        manager.close()
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
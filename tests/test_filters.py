@@ -0,0 +1,102 @@
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from filters import MetadataFilter
+from retriever import HybridRetrieverManager, chunk_files
+
+# 40 small files of four types modified over six months, all about crates, bolts and hinges so every
+# one of them matches the queries and an unfiltered search is dominated by the files that repeat "bolts" most
+FILES = [
+    (f"log_{i}.{ext}", f"2024-0{1 + i % 6}-1{i % 10}T08:30:00",
+     f"Crate {i} holds {'bolts ' * (1 + i % 5)}and hinges for the {word} line. " * 3)
+    for i, (ext, word) in enumerate([("txt", "north"), ("pdf", "south"), ("png", "east"), ("txt", "west")] * 10)
+]
+
+@pytest.fixture
+def manager(request):
+    persist_dir = tempfile.mkdtemp()
+    manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=DeterministicFakeEmbedding(size=16),
+                                     vector_backend=getattr(request, "param", "chroma"), candidates=5)
+    manager.add_documents(chunk_files([
+        Document(page_content=text, metadata={"source": source, "file_type": source.rsplit(".", 1)[1],
+                                              "modified": modified})
+        for source, modified, text in FILES
+    ]))
+    yield manager
+    manager.close()
+    shutil.rmtree(persist_dir, ignore_errors=True)
+
+def test_filter_matching():
+    """testing sources, file types and inclusive date bounds against a file's metadata"""
+    metadata = {"file_type": "pdf", "modified": "2024-03-15T10:00:00"}
+    assert MetadataFilter(sources=["a.pdf"]).matches("a.pdf", metadata)
+    assert not MetadataFilter(sources=["b.pdf"]).matches("a.pdf", metadata)
+    assert MetadataFilter(file_types=[".PDF", "txt"]).matches("a.pdf", metadata)
+    assert MetadataFilter(file_types=["txt"]).matches("old.txt", {})  # type taken from the name
+    assert MetadataFilter(date_from="2024-03-15", date_to="2024-03-15").matches("a.pdf", metadata)
+    assert MetadataFilter(date_to="2024-03-15T11:00:00+01:00").matches("a.pdf", metadata)
+    assert not MetadataFilter(date_from="2024-03-16").matches("a.pdf", metadata)
+    assert not MetadataFilter(date_from="2024-01-01").matches("a.pdf", {})  # no modified date recorded
+    assert not MetadataFilter() and MetadataFilter(sources=["a.pdf"])
+    assert MetadataFilter(file_types=["pdf", "txt"]).key() == MetadataFilter(file_types=["txt", ".pdf"]).key()
+    with pytest.raises(ValueError):
+        MetadataFilter(date_from="last tuesday")
+
+@pytest.mark.parametrize("manager", ["chroma", "numpy", "ivf"], indirect=True)
+def test_filtered_search_keeps_only_matching_chunks(manager):
+    """testing that filtered results all match, and that a filter still fills k when the top hits are elsewhere"""
+    query = "bolts bolts bolts hinges"
+    unfiltered = {d.metadata["source"] for d in manager.search(query, k=5)}
+    target = next(source for source, _, _ in FILES if source not in unfiltered)
+    results = manager.search(query, k=3, filters=MetadataFilter(sources=[target]), with_scores=True)
+    assert results and {d.metadata["source"] for d, _ in results} == {target}
+    assert all(scores["bm25"] is not None and scores["semantic"] is not None for _, scores in results)
+
+    for metadata_filter in [MetadataFilter(file_types=["pdf"]), MetadataFilter(date_from="2024-05-01"),
+                            MetadataFilter(file_types=["txt"], date_to="2024-02-28")]:
+        results = manager.search(query, k=5, filters=metadata_filter)
+        assert len(results) == 5
+        assert all(metadata_filter.matches(d.metadata["source"], d.metadata) for d in results)
+        batch = manager.search_batch([query, "hinges for the north line"], k=5, filters=metadata_filter)
+        assert [d.id for d in batch[0]] == [d.id for d in results]
+    assert manager.search(query, filters=MetadataFilter(sources=["missing.txt"])) == []
+
+def test_filters_follow_index_changes(manager):
+    """testing that a removed file stops matching and the retrieval cache keys filters apart"""
+    source = FILES[1][0]
+    metadata_filter = MetadataFilter(sources=[source])
+    retriever = manager.get_retriever(metadata_filter)
+    assert {d.metadata["source"] for d in retriever.invoke("crate bolts")} == {source}
+    assert manager.retrieval_key("crate bolts", filters=metadata_filter) != manager.retrieval_key("crate bolts")
+
+    manager.remove_source(source)
+    assert retriever.invoke("crate bolts") == []
+    assert source not in manager.source_counts() and source not in manager.source_metadata()
+    kept = FILES[0][0]
+    assert len(manager.search("crate", k=50, filters=MetadataFilter(sources=[kept]))) == manager.source_counts()[kept]
+
+def test_metadata_update_invalidates_cached_filtered_results(manager):
+    """testing that re-uploading an unchanged file with a new modified time changes the cached filtered results"""
+    source, modified, text = FILES[0]
+    metadata_filter = MetadataFilter(date_from="2025-01-01")
+    retriever = manager.get_retriever(metadata_filter)
+    assert retriever.invoke("crate bolts") == []
+    version = manager.snapshot().version
+
+    chunks = chunk_files([Document(page_content=text, metadata={"source": source, "file_type": "txt",
+                                                                "modified": "2025-02-01T09:00:00"})])
+    assert manager.replace_source(source, chunks) == (0, 0)  # same chunks, only the metadata changed
+    assert manager.snapshot().version != version
+    results = retriever.invoke("crate bolts")
+    assert results and {d.metadata["source"] for d in results} == {source}
+    assert all(d.metadata["modified"] == "2025-02-01T09:00:00" for d in results)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from langchain.schema import Document
+from langchain.retrievers import EnsembleRetriever
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fusion import fuse, normalize
+from retriever import HybridRetrieverManager, chunk_files
+
+def test_normalize_modes():
+    """testing min-max, z-score and rrf normalization of one candidate list"""
+    scores = np.array([9.0, 5.0, 1.0])
+    assert np.allclose(normalize(scores, "minmax"), [1.0, 0.5, 0.0])
+    assert np.allclose(normalize(scores, "zscore"), (scores - scores.mean()) / scores.std())
+    assert np.allclose(normalize(scores, "rrf"), [1 / 61, 1 / 62, 1 / 63])
+    assert np.allclose(normalize(np.array([2.0, 2.0]), "minmax"), [1.0, 1.0])
+    with pytest.raises(ValueError):
+        normalize(scores, "max")
+
+def test_rrf_matches_ensemble_retriever():
+    """testing that rrf mode ranks like EnsembleRetriever's weighted reciprocal rank"""
+    docs = [Document(page_content=f"doc {i}") for i in range(8)]
+    bm25 = [3, 1, 5, 0]
+    semantic = [5, 2, 3, 7]
+    ensemble = EnsembleRetriever(retrievers=[], weights=[0.3, 0.7])
+    expected = ensemble.weighted_reciprocal_rank([[docs[i] for i in bm25], [docs[i] for i in semantic]])
+
+    ids, fused, raw = fuse(
+        [(np.array(bm25), np.array([4.0, 3.0, 2.0, 1.0])), (np.array(semantic), np.array([0.9, 0.8, 0.7, 0.6]))],
+        [0.3, 0.7], mode="rrf",
+    )
+    assert [docs[i].page_content for i in ids] == [d.page_content for d in expected]
+    assert np.isnan(raw[0][list(ids).index(7)])
+
+def test_fusion_uses_scores():
+    """testing that min-max fusion keeps score gaps that rank-based fusion throws away"""
+    bm25 = (np.array([0, 1, 2]), np.array([10.0, 1.0, 0.9]))
+    semantic = (np.array([1, 0, 3]), np.array([-0.10, -0.11, -5.0]))
+    ids, _, _ = fuse([bm25, semantic], [0.4, 0.6], mode="minmax", k=1)
+    assert list(ids) == [0]
+    ids, _, _ = fuse([bm25, semantic], [0.4, 0.6], mode="rrf", k=1)
+    assert list(ids) == [1]
+
+def test_manager_search_scores():
+    """testing that the manager returns fused, bm25 and semantic scores for each result"""
+    persist_dir = tempfile.mkdtemp()
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=DeterministicFakeEmbedding(size=16),
+                                         bm25_weight=0.8, semantic_weight=0.2, fusion="zscore", candidates=5)
+        manager.add_documents(chunk_files([
+            Document(page_content="The ship carried 150 livestock units.", metadata={"source": "ship.txt"}),
+            Document(page_content="The warehouse stores 3400 boxes.", metadata={"source": "warehouse.txt"}),
+            Document(page_content="The factory built 900 machines.", metadata={"source": "factory.txt"}),
+            Document(page_content="The library keeps old manuscripts.", metadata={"source": "library.txt"}),
+        ]))
+        results = manager.search("livestock on the ship", with_scores=True)
+        assert results[0][0].metadata["source"] == "ship.txt"
+        assert results[0][1]["bm25"] > 0
+        assert set(results[0][1]) == {"fused", "bm25", "semantic"}
+        assert [d.id for d in manager.get_retriever().invoke("livestock on the ship")] == [d.id for d, _ in results]
+        manager.close()
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+@pytest.mark.parametrize("backend", ["chroma", "numpy"])
+def test_search_batch_matches_search(backend):
+    """testing that searching queries as a batch ranks each one like a single search"""
+    persist_dir = tempfile.mkdtemp()
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embeddings=DeterministicFakeEmbedding(size=16),
+                                         vector_backend=backend, candidates=5)
+        manager.add_documents(chunk_files([
+            Document(page_content=f"Crate {i} holds {i * 7} bolts and {i * 3} hinges for the {word} line.",
+                     metadata={"source": f"crate_{i}.txt"})
+            for i, word in enumerate(["north", "south", "east", "west", "river", "hill"] * 3)
+        ]))
+        queries = ["bolts for the north line", "hinges", "crate 12 river", "nothing matches this"]
+        batch = manager.search_batch(queries)
+        assert [[d.id for d in docs] for docs in batch] == [[d.id for d in manager.search(q)] for q in queries]
+        assert manager.retrieve_batch(queries) == batch
+        manager.close()
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -9,6 +9,7 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from api import api
 import app as app_module
+from conftest import wait_for_job
 
 client = TestClient(api)
 
@@ -62,10 +63,11 @@ def upload_document(content: str, filename: str):
                 "/api/upload",
                 files={"file": (filename, f, "text/plain")}
             )
+        job = wait_for_job(client, response)
         elapsed_time = time.time() - start_time
 
-        assert response.status_code == 200
-        assert "uploaded and indexed" in response.json()["message"]
+        assert job["status"] == "done"
+        assert "uploaded and indexed" in job["message"]
 
         return elapsed_time
     finally:
@@ -0,0 +1,102 @@
+import pytest
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from jobs import IngestQueue, QueueFull
+
+def wait(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.status not in ("done", "failed") and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+def test_job_reports_stages_and_progress():
+    """testing that a finished job carries its counters and per-stage timings"""
+    def handler(job, path):
+        with job.track("extract"):
+            job.pages_extracted = 3
+        with job.track("index"):
+            job.chunks_total = 10
+            job.chunks_embedded = 10
+        job.message = f"{path} uploaded and indexed."
+
+    queue = IngestQueue(handler, workers=1)
+    job = wait(queue.submit("a.txt", "a.txt"))
+    status = queue.get(job.id).to_dict()
+
+    assert status["status"] == "done"
+    assert status["pages_extracted"] == 3
+    assert status["chunks_embedded"] == status["chunks_total"] == 10
+    assert set(status["stage_seconds"]) == {"extract", "index"}
+    queue.shutdown()
+
+def test_failed_job_keeps_error():
+    """testing that handler exceptions end up on the job instead of killing the worker"""
+    def handler(job, path):
+        raise ValueError(f"no text extracted from {path}")
+
+    queue = IngestQueue(handler, workers=1)
+    job = wait(queue.submit("empty.txt", "empty.txt"))
+    assert job.status == "failed"
+    assert "no text extracted" in job.error
+
+    second = wait(queue.submit("empty2.txt", "empty2.txt"))
+    assert second.status == "failed"
+    queue.shutdown()
+
+def test_backpressure_and_retry_coalescing():
+    """testing that a full queue rejects new work and a retried upload reuses the queued job"""
+    release = threading.Event()
+    queue = IngestQueue(lambda job, path: release.wait(5), workers=1, max_pending=2)
+
+    running = queue.submit("first.txt", "first.txt")
+    while running.status != "running":
+        time.sleep(0.01)
+    queued = queue.submit("second.txt", "second.txt")
+    assert queue.submit("second.txt", "second.txt") is queued
+    queue.submit("third.txt", "third.txt")
+
+    with pytest.raises(QueueFull):
+        queue.submit("fourth.txt", "fourth.txt")
+
+    release.set()
+    assert wait(queued).status == "done"
+    queue.shutdown()
+
+def test_one_job_per_key_at_a_time():
+    """testing that a re-upload waits for the running job of the same file while other files go ahead"""
+    release = threading.Event()
+    running, order = set(), []
+    lock = threading.Lock()
+
+    def handler(job, path):
+        with lock:
+            assert path not in running
+            running.add(path)
+            order.append(path)
+        if path == "a.txt":
+            release.wait(5)
+        with lock:
+            running.discard(path)
+
+    queue = IngestQueue(handler, workers=2)
+    first = queue.submit("a.txt", "a.txt")
+    while first.status != "running":
+        time.sleep(0.01)
+    again = queue.submit("a.txt", "a.txt")
+    assert again is not first
+    other = wait(queue.submit("b.txt", "b.txt"))
+    assert other.status == "done" and again.status == "queued"
+    assert queue.submit("a.txt", "a.txt") is again  # still coalesces while it waits
+
+    release.set()
+    assert wait(again).status == "done" and first.status == "done"
+    assert order == ["a.txt", "b.txt", "a.txt"]
+    queue.shutdown()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,56 @@
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from metrics import Registry
+
+def test_histogram_buckets_are_cumulative():
+    """testing that each observation counts in its bucket and every bucket above it"""
+    registry = Registry()
+    histogram = registry.histogram("test_seconds", "test latency", buckets=(0.01, 0.1, 1.0))
+    for seconds in (0.005, 0.05, 0.05, 2.0):
+        histogram.observe("bm25", seconds)
+    histogram.observe("fuse", 0.001)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{stage="bm25",le="0.01"} 1' in lines
+    assert 'test_seconds_bucket{stage="bm25",le="0.1"} 3' in lines
+    assert 'test_seconds_bucket{stage="bm25",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{stage="bm25",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="bm25"} 4' in lines
+    assert 'test_seconds_count{stage="fuse"} 1' in lines
+    total = next(line for line in lines if line.startswith('test_seconds_sum{stage="bm25"}'))
+    assert abs(float(total.split()[-1]) - 2.105) < 1e-9
+
+def test_histogram_counts_concurrent_observations():
+    """testing that observations from many threads are all counted"""
+    histogram = Registry().histogram("test_seconds", "test latency")
+
+    def observe():
+        for _ in range(1000):
+            with histogram.time("embed"):
+                pass
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert histogram.count("embed") == 8000
+
+def test_gauges_are_read_at_render_time():
+    """testing plain and labelled gauges, and that unreadable or missing values are left out"""
+    registry = Registry()
+    sizes = {"chunks": 3}
+    registry.gauge("test_chunks", "chunks", lambda: sizes["chunks"])
+    registry.gauge("test_memory_bytes", "memory", lambda: {"vectors": 1024, "chroma": None}, label="component")
+    registry.gauge("test_missing", "not available", lambda: None)
+    registry.gauge("test_broken", "raises", lambda: 1 / 0)
+
+    sizes["chunks"] = 5
+    lines = registry.render().splitlines()
+    assert "test_chunks 5" in lines
+    assert 'test_memory_bytes{component="vectors"} 1024' in lines
+    assert not any("chroma" in line or "test_missing" in line or "test_broken" in line for line in lines)
@@ -0,0 +1,54 @@
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+from langchain.schema import Document
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from embeddings import encode, export_onnx, get_embeddings
+from retriever import HybridRetrieverManager
+
+TEXTS = [
+    "There were 17 people on the ship yesterday.",
+    "The captain's name was Jack.",
+    "Out of 150 livestock units - 67 cows, 22 chicken, 34 sheeps, 27 goats.",
+    "The Go programming language was created at Google in 2007.\nIt is statically typed.",
+]
+
+@pytest.fixture(scope="module")
+def onnx_dir():
+    pytest.importorskip("onnxruntime")
+    directory = tempfile.mkdtemp()
+    export_onnx("all-MiniLM-L6-v2", directory)
+    yield directory
+    shutil.rmtree(directory, ignore_errors=True)
+
+def test_onnx_vectors_match_torch(onnx_dir):
+    """testing that onnx and int8 vectors are unit length and point where the torch backend's do"""
+    torch_vectors = encode(get_embeddings("all-MiniLM-L6-v2"), TEXTS)
+    for backend, tolerance in (("onnx", 1e-4), ("onnx-int8", 0.05)):
+        vectors = encode(get_embeddings(onnx_dir, backend), TEXTS, batch_size=3)
+        assert vectors.shape == torch_vectors.shape
+        assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-4)
+        assert np.min(np.sum(vectors * torch_vectors, axis=1)) > 1 - tolerance, backend
+
+def test_manager_with_onnx_backend(onnx_dir):
+    """testing that a manager embeds and searches through the onnx backend"""
+    persist_dir = tempfile.mkdtemp()
+    try:
+        manager = HybridRetrieverManager(persist_dir=persist_dir, embedding_model=onnx_dir, embedding_backend="onnx")
+        manager.add_documents([Document(page_content=t, metadata={"source": "ship.txt"}) for t in TEXTS])
+        assert "Jack" in manager.search("who was the captain?", k=1)[0].page_content
+        manager.close()
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+def test_unknown_backend_is_rejected():
+    """testing that a misspelled embedding backend fails when the manager is built"""
+    persist_dir = tempfile.mkdtemp()
+    with pytest.raises(ValueError):
+        HybridRetrieverManager(persist_dir=persist_dir, embedding_backend="onnxruntime")
+    shutil.rmtree(persist_dir, ignore_errors=True)
@@ -0,0 +1,45 @@
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import embeddings
+from retriever import HybridRetrieverManager
+
+ROOT = Path(__file__).parent.parent
+HEAVY = ("torch", "sentence_transformers", "chromadb", "PyPDF2", "pytesseract", "langchain_google_genai")
+
+def test_import_api_skips_heavy_dependencies():
+    """testing that importing api loads neither the model, chroma, the extractors nor the llm client"""
+    code = f"import sys, api; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+def test_managers_share_one_lazily_loaded_model(monkeypatch):
+    """testing that the model isn't loaded until something is embedded, then once for every manager"""
+    loaded = []
+    def load(model_name):
+        loaded.append(model_name)
+        return DeterministicFakeEmbedding(size=32)
+    monkeypatch.setattr(embeddings, "_models", {})
+    monkeypatch.setattr("langchain_huggingface.HuggingFaceEmbeddings", lambda model_name: load(model_name))
+
+    dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+    try:
+        managers = [HybridRetrieverManager(persist_dir=d, embedding_model="shared-model") for d in dirs]
+        assert loaded == []
+        for manager in managers:
+            manager.search("anything")  # empty index, nothing to embed yet
+            manager.query_embeddings.embed_query("ship captain")
+        assert loaded == ["shared-model"]
+        assert managers[0].embeddings.model is managers[1].embeddings.model
+        for manager in managers:
+            manager.close()
+    finally:
+        for d in dirs:
+            shutil.rmtree(d, ignore_errors=True)
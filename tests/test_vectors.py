@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from vectors import NumpyVectorIndex, IVFVectorIndex
+from retriever import HybridRetrieverManager, chunk_files
+
+def clustered(n, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, n)] + 0.1 * rng.normal(size=(n, dim))
+    return [f"id{i}" for i in range(n)], vectors.astype(np.float32)
+
+def exact(vectors, query, n):
+    return list(np.argsort(((vectors - query) ** 2).sum(axis=1), kind="stable")[:n])
+
+@pytest.fixture
+def tmp_dir():
+    path = tempfile.mkdtemp()
+    yield Path(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+def test_numpy_index_matches_brute_force():
+    """testing exact search, deletes and re-adds against a plain numpy argsort"""
+    ids, vectors = clustered(3000)
+    index = NumpyVectorIndex()
+    index.add(ids[:2000], vectors[:2000])
+    index.add(ids[2000:], vectors[2000:])
+    index.delete(ids[:500])
+    for query in vectors[::300]:
+        expected = [ids[i + 500] for i in exact(vectors[500:], query, 5)]
+        found, distances = index.query(query, 5)
+        assert found == expected
+        assert np.all(np.diff(distances) >= 0)
+
+    half = NumpyVectorIndex(dtype="float16")
+    half.add(ids, vectors)
+    assert half.query(vectors[7], 1)[0] == [ids[7]]
+
+class ProbedIndex(NumpyVectorIndex):
+    """numpy index that runs a query whenever add() is entered, where a concurrent reader could look"""
+    def __init__(self, probe):
+        super().__init__()
+        self.probe = probe
+        self.seen = []
+
+    def add(self, ids, vectors):
+        self.seen.append(len(self.query(self.probe, 5)[0]))
+        super().add(ids, vectors)
+
+def test_numpy_compaction_is_invisible_to_queries():
+    """testing that a query never sees the index empty or half rebuilt while deletes compact it"""
+    ids, vectors = clustered(3000)
+    index = ProbedIndex(vectors[0])
+    index.add(ids[:1500], vectors[:1500])
+    for start in range(0, 1500, 50):
+        index.delete(ids[start:start + 50])
+        index.add(ids[1500 + start:1550 + start], vectors[1500 + start:1550 + start])
+    assert index.seen[1:] == [5] * (len(index.seen) - 1)
+    assert index._state[4] < 3000  # compacted at least once
+    for query in vectors[::300]:
+        assert index.query(query, 5)[0] == [ids[i + 1500] for i in exact(vectors[1500:], query, 5)]
+
+def test_ivf_recall_and_persistence(tmp_dir):
+    """testing that ivf finds most true neighbours, skips deleted ids and reloads from disk"""
+    ids, vectors = clustered(6000)
+    index = IVFVectorIndex(str(tmp_dir / "ivf"), min_build=1000)
+    for start in range(0, len(ids), 1000):
+        index.add(ids[start:start + 1000], vectors[start:start + 1000])
+    index.delete(ids[:100])
+    assert len(index) == 5900
+
+    queries = vectors[100::500]
+    hits = 0
+    for query in queries:
+        found, _ = index.query(query, 10)
+        assert not set(found) & set(ids[:100])
+        hits += len(set(found) & {ids[i + 100] for i in exact(vectors[100:], query, 10)})
+    assert hits / (10 * len(queries)) > 0.9
+
+    index.save()
+    reloaded = IVFVectorIndex(str(tmp_dir / "ivf"), min_build=1000)
+    assert reloaded.load(ids[100:])
+    assert reloaded.query(queries[0], 10)[0] == index.query(queries[0], 10)[0]
+    assert not IVFVectorIndex(str(tmp_dir / "ivf")).load(ids)
+
+def test_manager_backends_agree(tmp_dir):
+    """testing that the numpy backend ranks like chroma and is restored on restart"""
+    embeddings = DeterministicFakeEmbedding(size=16)
+    chunks = [Document(page_content=f"record {i} of the harbour log lists vessel {i * 3}", metadata={"source": f"log_{i}.txt"})
+              for i in range(30)]
+    results = {}
+    for backend in ("chroma", "numpy"):
+        manager = HybridRetrieverManager(persist_dir=str(tmp_dir / backend), embeddings=embeddings,
+                                         vector_backend=backend, semantic_weight=1.0, bm25_weight=0.0)
+        manager.add_documents(chunk_files(chunks))
+        results[backend] = [d.id for d in manager.search("vessel 27 in the log")]
+        manager.save_snapshot()
+        manager.close()
+    assert results["numpy"] == results["chroma"]
+    assert (tmp_dir / "numpy" / "vectors.npz").exists()
+
+    restarted = HybridRetrieverManager(persist_dir=str(tmp_dir / "numpy"), embeddings=embeddings,
+                                       vector_backend="numpy", semantic_weight=1.0, bm25_weight=0.0)
+    assert [d.id for d in restarted.search("vessel 27 in the log")] == results["numpy"]
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "-s"])
@@ -0,0 +1,491 @@
+import os
+import shutil
+import uuid
+import numpy as np
+
+# vector indexes used for the semantic side of hybrid search. each one has
+#   add(ids, vectors), delete(ids), query(vector, n, where=None) -> (ids, squared l2 distances, closest first),
+#   query_many(vectors, n, where=None) -> one query() result per vector,
+#   load(ids) -> True when what it persisted holds exactly these ids, save(), clear() and len()
+# chroma stays the store for documents and metadata either way, these only answer nearest neighbour queries.
+# where is a filters.Selection: only its chunk ids are searched (chroma filters on their sources instead)
+
+VECTOR_BACKENDS = ("chroma", "numpy", "ivf")
+
+
+def make_vector_index(backend, persist_dir, collection, dtype="float32"):
+    if backend == "chroma":
+        return ChromaVectorIndex(collection)
+    if backend == "numpy":
+        return NumpyVectorIndex(os.path.join(persist_dir, "vectors.npz"), dtype)
+    if backend == "ivf":
+        return IVFVectorIndex(os.path.join(persist_dir, "ivf"), dtype)
+    raise ValueError(f"unknown vector backend {backend!r}, expected one of {VECTOR_BACKENDS}")
+
+
+def _top(ids, distances, n):
+    if n < len(distances):
+        top = np.argpartition(distances, n - 1)[:n]
+    else:
+        top = np.arange(len(distances))
+    top = top[np.argsort(distances[top], kind="stable")]
+    return [ids[i] for i in top], distances[top]
+
+
+class ChromaVectorIndex:
+    # the collection's own hnsw index, the manager already writes every vector to chroma
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __len__(self):
+        return self.collection.count()
+
+    def add(self, ids, vectors):
+        pass
+
+    def delete(self, ids):
+        pass
+
+    def load(self, ids):
+        return True
+
+    def save(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def query(self, vector, n, where=None):
+        return self.query_many([vector], n, where)[0]
+
+    def query_many(self, vectors, n, where=None):
+        kwargs = {} if where is None else {"where": {"source": {"$in": sorted(where.sources)}}}
+        result = self.collection.query(query_embeddings=list(vectors), n_results=n, include=["distances"], **kwargs)
+        return [(ids, np.asarray(d, dtype=np.float32)) for ids, d in zip(result["ids"], result["distances"])]
+
+
+class NumpyVectorIndex:
+    # exact search, one matrix product over every stored vector. new rows are written past the row count
+    # readers know about and deletes swap in a new live mask, so queries never need a lock.
+    # float16 halves memory, blocks are widened to float32 for the product
+
+    def __init__(self, path=None, dtype="float32", block_rows=4096):
+        self.path = path  # .npz file, None keeps it in memory only
+        self.dtype = np.dtype(dtype)
+        self.block_rows = block_rows
+        self._reset()
+
+    def _reset(self):
+        # ids by row, matrix, squared norms, live mask, row count, id -> row
+        self._state = ([], np.empty((0, 0), dtype=self.dtype), np.empty(0, dtype=np.float32),
+                       np.empty(0, dtype=bool), 0, {})
+
+    @property
+    def _rows(self):
+        return self._state[5]
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def nbytes(self):
+        # allocated rows included, the matrix grows ahead of the row count
+        _, matrix, norms, _, _, _ = self._state
+        return matrix.nbytes + norms.nbytes
+
+    def ids(self):
+        return list(self._rows)
+
+    def vectors(self):
+        ids, matrix, _, live, count, _ = self._state
+        rows = np.flatnonzero(live[:count])
+        return [ids[r] for r in rows], matrix[rows]
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        row_ids, matrix, norms, live, count, positions = self._state
+        stale = [positions[i] for i in ids if i in positions]
+        end = count + len(ids)
+        if end > len(matrix):
+            capacity = max(2 * len(matrix), end, 1024)
+            grown = np.empty((capacity, vectors.shape[1]), dtype=self.dtype)
+            if count:
+                grown[:count] = matrix[:count]
+            grown_norms = np.empty(capacity, dtype=np.float32)
+            grown_norms[:count] = norms[:count]
+            matrix, norms = grown, grown_norms
+        matrix[count:end] = vectors
+        stored = matrix[count:end].astype(np.float32)
+        norms[count:end] = np.einsum("ij,ij->i", stored, stored)
+        live = np.concatenate([live[:count], np.ones(len(ids), dtype=bool)])
+        live[stale] = False
+        for offset, chunk_id in enumerate(ids):
+            positions[chunk_id] = count + offset
+            row_ids.append(chunk_id)
+        self._state = (row_ids, matrix, norms, live, end, positions)
+        if stale:
+            self._maybe_compact()
+
+    def delete(self, ids):
+        row_ids, matrix, norms, live, count, positions = self._state
+        rows = [positions.pop(i) for i in ids if i in positions]
+        if not rows:
+            return
+        live = live.copy()
+        live[rows] = False
+        self._state = (row_ids, matrix, norms, live, count, positions)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        # once most rows are dead, copy the live ones into fresh arrays and swap them in at once,
+        # a query running meanwhile keeps searching the old ones
+        row_ids, matrix, norms, live, count, _ = self._state
+        if count > 1024 and len(self._rows) < count // 2:
+            rows = np.flatnonzero(live[:count])
+            ids = [row_ids[r] for r in rows]
+            self._state = (ids, matrix[rows], norms[rows], np.ones(len(rows), dtype=bool), len(rows),
+                           {chunk_id: row for row, chunk_id in enumerate(ids)})
+
+    def query(self, vector, n, where=None):
+        row_ids, matrix, norms, live, count, positions = self._state
+        if not count or n <= 0:
+            return [], np.empty(0, dtype=np.float32)
+        query = np.asarray(vector, dtype=np.float32)
+        if where is not None:
+            rows = self._live_rows(where.ids, positions, live, count)
+            return self._query_rows(row_ids, matrix, norms, rows, query[None], n)[0]
+        distances = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            end = min(start + self.block_rows, count)
+            block = matrix[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            distances[start:end] = norms[start:end] - 2.0 * (block @ query)
+        distances += query @ query
+        distances[~live[:count]] = np.inf
+        ids, distances = _top(row_ids, distances, min(n, int(np.count_nonzero(live[:count]))))
+        return ids, distances
+
+    def query_many(self, vectors, n, where=None):
+        # query() for a block of queries, one matrix product per block of rows
+        row_ids, matrix, norms, live, count, positions = self._state
+        queries = np.asarray(vectors, dtype=np.float32)
+        if not count or n <= 0:
+            return [([], np.empty(0, dtype=np.float32)) for _ in queries]
+        if where is not None:
+            rows = self._live_rows(where.ids, positions, live, count)
+            return self._query_rows(row_ids, matrix, norms, rows, queries, n)
+        distances = np.empty((len(queries), count), dtype=np.float32)
+        for start in range(0, count, self.block_rows):
+            end = min(start + self.block_rows, count)
+            block = matrix[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            distances[:, start:end] = norms[start:end] - 2.0 * (queries @ block.T)
+        distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+        distances[:, ~live[:count]] = np.inf
+        n = min(n, int(np.count_nonzero(live[:count])))
+        return [_top(row_ids, row, n) for row in distances]
+
+    def _live_rows(self, ids, positions, live, count):
+        # rows of the given ids, in row order. rows a writer is still adding (past count) are left out
+        rows = np.fromiter((positions.get(i, -1) for i in ids), dtype=np.int64)
+        rows = rows[(rows >= 0) & (rows < count)]
+        rows = rows[live[rows]]
+        rows.sort()
+        return rows
+
+    def _query_rows(self, row_ids, matrix, norms, rows, queries, n):
+        # exact search over the given rows only, the filtered counterpart of query_many
+        n = min(n, len(rows))
+        if not n:
+            return [([], np.empty(0, dtype=np.float32)) for _ in queries]
+        distances = np.empty((len(queries), len(rows)), dtype=np.float32)
+        for start in range(0, len(rows), self.block_rows):
+            block_rows = rows[start:start + self.block_rows]
+            block = matrix[block_rows].astype(np.float32, copy=False)
+            distances[:, start:start + len(block_rows)] = norms[block_rows] - 2.0 * (queries @ block.T)
+        distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+        found = [row_ids[r] for r in rows]
+        return [_top(found, row, n) for row in distances]
+
+    def load(self, ids=None):
+        # ids=None takes whatever was saved
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                stored_ids = data["ids"].tolist()
+                if ids is not None and set(stored_ids) != set(ids):
+                    return False
+                self._reset()
+                self.add(stored_ids, data["vectors"])
+            return True
+        except Exception as e:
+            print(f"ignoring unreadable vector index {self.path}: {e}")
+            return False
+
+    def save(self):
+        if self.path is None:
+            return
+        ids, vectors = self.vectors()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=np.array(ids, dtype=str), vectors=vectors)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self._reset()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IVFList:
+    # one built ivf index: vectors grouped by nearest centroid in a memory-mapped .npy,
+    # cluster c owns rows offsets[c]:offsets[c + 1]
+
+    def __init__(self, ids, vectors, norms, offsets, centroids, trained_on, filename):
+        self.ids = ids
+        self.vectors = vectors
+        self.norms = norms
+        self.offsets = offsets
+        self.centroids = centroids
+        self.trained_on = trained_on  # corpus size when the centroids were trained
+        self.filename = filename
+        self.positions = {chunk_id: row for row, chunk_id in enumerate(ids)}
+
+
+class IVFVectorIndex:
+    # approximate search for large corpora: a query scans only the nprobe clusters whose centroids are
+    # closest. vectors added since the last build are searched exactly in a NumpyVectorIndex and the
+    # clusters are rebuilt once that delta, or the deleted rows, pass rebuild_ratio of the built index.
+    # below min_build vectors everything stays in the exact delta
+
+    def __init__(self, path, dtype="float32", nprobe=8, rebuild_ratio=0.05, min_build=4096, seed=0):
+        self.path = path  # directory
+        self.dtype = np.dtype(dtype)
+        self.nprobe = nprobe
+        self.rebuild_ratio = rebuild_ratio
+        self.min_build = min_build
+        self.seed = seed
+        self._state = (None, None, NumpyVectorIndex(None, dtype))  # built index, its dead rows, delta
+
+    def __len__(self):
+        built, dead, delta = self._state
+        return (len(built.ids) - int(dead.sum()) if built is not None else 0) + len(delta)
+
+    @property
+    def nbytes(self):
+        built, _, delta = self._state
+        if built is None:
+            return delta.nbytes
+        return built.vectors.nbytes + built.norms.nbytes + built.centroids.nbytes + delta.nbytes
+
+    def add(self, ids, vectors):
+        self._kill(ids)
+        self._state[2].add(ids, vectors)
+        self._maybe_rebuild()
+
+    def delete(self, ids):
+        self._state[2].delete(ids)
+        self._kill(ids)
+        self._maybe_rebuild()
+
+    def _kill(self, ids):
+        # built rows are never rewritten, deleted or replaced ones are masked out in a new dead array
+        built, dead, delta = self._state
+        if built is None:
+            return
+        rows = [built.positions[i] for i in ids if i in built.positions]
+        if rows:
+            dead = dead.copy()
+            dead[rows] = True
+            self._state = (built, dead, delta)
+
+    def _maybe_rebuild(self):
+        built, dead, delta = self._state
+        if built is None:
+            if len(delta) > self.min_build:
+                self.rebuild()
+        elif len(delta) + dead.sum() > self.rebuild_ratio * len(built.ids):
+            self.rebuild()
+
+    def _live(self):
+        built, dead, delta = self._state
+        ids, vectors = delta.vectors()
+        if built is None:
+            return ids, vectors.astype(np.float32)
+        keep = ~dead
+        kept = np.asarray(built.vectors[keep], dtype=np.float32)
+        if not ids:
+            return [i for i, k in zip(built.ids, keep) if k], kept
+        return [i for i, k in zip(built.ids, keep) if k] + ids, np.concatenate([kept, vectors.astype(np.float32)])
+
+    def rebuild(self):
+        ids, vectors = self._live()
+        if len(ids) < self.min_build:
+            delta = NumpyVectorIndex(None, self.dtype)
+            delta.add(ids, vectors)
+            self._swap(None, delta)
+            return
+
+        # the centroids are kept until the corpus has doubled, until then a rebuild is only a regroup
+        built = self._state[0]
+        if built is not None and len(ids) < 2 * built.trained_on:
+            centroids, trained_on = built.centroids, built.trained_on
+        else:
+            centroids, trained_on = self._train(vectors, max(1, int(np.sqrt(len(ids))))), len(ids)
+        assignment = self._assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        stored = vectors[order].astype(self.dtype)
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = f"vectors-{uuid.uuid4().hex[:8]}.npy"
+        np.save(os.path.join(self.path, filename), stored)
+        sorted_ids = [ids[i] for i in order]
+        widened = stored.astype(np.float32)
+        norms = np.einsum("ij,ij->i", widened, widened)
+        tmp_path = os.path.join(self.path, "index.npz.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=np.array(sorted_ids, dtype=str), norms=norms, offsets=offsets,
+                     centroids=centroids, trained_on=trained_on, filename=filename)
+        os.replace(tmp_path, os.path.join(self.path, "index.npz"))
+        built = IVFList(sorted_ids, np.load(os.path.join(self.path, filename), mmap_mode="r"),
+                        norms, offsets, centroids, trained_on, filename)
+        self._swap(built, NumpyVectorIndex(None, self.dtype))
+
+    def _swap(self, built, delta):
+        previous = self._state[0]
+        self._state = (built, None if built is None else np.zeros(len(built.ids), dtype=bool), delta)
+        # on posix a file that is still mapped by an in-flight query stays readable after removal
+        if previous is not None and (built is None or previous.filename != built.filename):
+            try:
+                os.remove(os.path.join(self.path, previous.filename))
+            except OSError:
+                pass
+
+    def _train(self, vectors, nlist, iterations=10, sample_per_list=64):
+        # lloyd's k-means on a sample, empty clusters are reseeded from random sample points
+        rng = np.random.default_rng(self.seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * sample_per_list), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        return centroids
+
+    @staticmethod
+    def _assign(vectors, centroids, block_rows=8192):
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_rows):
+            block = vectors[start:start + block_rows]
+            assignment[start:start + block_rows] = np.argmin(centroid_norms - 2.0 * (block @ centroids.T), axis=1)
+        return assignment
+
+    def query(self, vector, n, where=None):
+        built, dead, delta = self._state
+        ids, distances = delta.query(vector, n, where)
+        if built is None:
+            return ids, distances
+        query = np.asarray(vector, dtype=np.float32)
+        probe = np.argsort(np.einsum("ij,ij->i", built.centroids, built.centroids) - 2.0 * (built.centroids @ query))
+        spans = [(built.offsets[c], built.offsets[c + 1]) for c in probe[:self.nprobe]]
+        allowed = None
+        if where is not None:
+            allowed = np.fromiter((built.positions.get(i, -1) for i in where.ids), dtype=np.int64)
+            allowed = allowed[allowed >= 0]
+            allowed = np.sort(allowed[~dead[allowed]])
+            # a filter with fewer rows than the probed clusters hold is searched exactly, that's cheaper
+            if len(allowed) <= sum(end - start for start, end in spans):
+                return self._merge(ids, distances, built, self._exact(built, allowed, query), n)
+        rows = np.concatenate([np.arange(start, end) for start, end in spans])
+        if not len(rows):
+            return ids, distances
+        # each cluster is one contiguous slice of the mapped file, multiplied in place without a copy
+        if built.vectors.dtype == np.float32:
+            dots = np.concatenate([built.vectors[start:end] @ query for start, end in spans])
+        else:
+            dots = np.concatenate([built.vectors[start:end].astype(np.float32) @ query for start, end in spans])
+        found = built.norms[rows] - 2.0 * dots + query @ query
+        found[dead[rows]] = np.inf
+        if allowed is not None:
+            found[~np.isin(rows, allowed, assume_unique=True)] = np.inf
+            if np.count_nonzero(np.isfinite(found)) < n:
+                # the probed clusters hold too few of the filter's rows, search all of them instead
+                return self._merge(ids, distances, built, self._exact(built, allowed, query), n)
+        return self._merge(ids, distances, built, (rows, found), n)
+
+    @staticmethod
+    def _exact(built, rows, query):
+        # (rows, distances) of the given built rows, read from the mapped file in row order
+        vectors = np.asarray(built.vectors[rows], dtype=np.float32)
+        return rows, built.norms[rows] - 2.0 * (vectors @ query) + query @ query
+
+    @staticmethod
+    def _merge(ids, distances, built, found, n):
+        # the delta's hits and the built index's (rows, distances), n closest overall, dead rows dropped
+        rows, found = found
+        if not len(rows):
+            return ids, distances
+        top = np.argpartition(found, n - 1)[:n] if n < len(found) else np.arange(len(found))
+        all_ids = list(ids) + [built.ids[r] for r in rows[top]]
+        ids, distances = _top(all_ids, np.concatenate([distances, found[top]]), min(n, len(all_ids)))
+        keep = np.isfinite(distances)
+        return [i for i, k in zip(ids, keep) if k], distances[keep]
+
+    def query_many(self, vectors, n, where=None):
+        # each query probes its own clusters
+        return [self.query(vector, n, where) for vector in vectors]
+
+    def load(self, ids):
+        index_path = os.path.join(self.path, "index.npz")
+        delta_path = os.path.join(self.path, "delta.npz")
+        built = None
+        try:
+            if os.path.exists(index_path):
+                with np.load(index_path) as data:
+                    filename = str(data["filename"])
+                    built = IVFList(data["ids"].tolist(), np.load(os.path.join(self.path, filename), mmap_mode="r"),
+                                    data["norms"], data["offsets"], data["centroids"], int(data["trained_on"]), filename)
+            delta = NumpyVectorIndex(delta_path, self.dtype)
+            delta.load()
+        except Exception as e:
+            print(f"ignoring unreadable ivf index {self.path}: {e}")
+            return False
+        stored = set(built.ids if built is not None else ()) | set(delta.ids())
+        if (built is None and not len(delta)) or stored != set(ids):
+            return False
+        delta.path = None
+        self._state = (built, None if built is None else np.zeros(len(built.ids), dtype=bool), delta)
+        return True
+
+    def save(self):
+        # a build writes the clusters, so once there is one the delta is folded into it.
+        # below min_build only the delta is written
+        built, dead, delta = self._state
+        if built is not None and (dead.any() or len(delta)):
+            self.rebuild()
+            built, dead, delta = self._state
+        delta.path = os.path.join(self.path, "delta.npz")
+        try:
+            if len(delta):
+                delta.save()
+            elif os.path.exists(delta.path):
+                os.remove(delta.path)
+        finally:
+            delta.path = None
+
+    def clear(self):
+        self._state = (None, None, NumpyVectorIndex(None, self.dtype))
+        shutil.rmtree(self.path, ignore_errors=True)